@@ -1,9 +1,37 @@
 from io import BytesIO
+from urllib.parse import quote
 import datetime as dt
-from flask import Flask, render_template, request, send_file, redirect, session, jsonify
+import json
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+from flask import Flask, Response, render_template, request, redirect, session, jsonify, stream_with_context, g, \
+    url_for
+from sqlalchemy.orm import make_transient_to_detached
+from calculations import OrbCalculator, SATELLITES, CalculationCancelled, CalculationTimeout, to_datetime64
+from catalog import catalog
+from passes_cache import PassesCache
+import trajectory_export
+from live_stream import live_stream
+from ephemeris import EphemerisStore
+from geolocation import GeoIP
+from cache import LRUCache
+from search import MAX_SEARCH_LIMIT
+from scheduling import make_schedule
+import metrics
+from compute import ComputeLimiter, BudgetExceeded, Overloaded, disconnect_checker
+from jobs import JobQueue, ACTIVE_STATUSES, TIME_FORMAT as JOBS_TIME_FORMAT
+from timetables import Timetables
+from http_cache import cacheable, compress
+from ground_track import GroundTracks, TIME_FORMAT as GROUND_TRACK_TIME_FORMAT
+from coverage import compute_coverage, encode_raster, make_grid, to_png, COVERAGE_STEP
 from pyorbital.orbital import Orbital
-from calculations import OrbCalculator, SATELLITES
-import geoip2.database
+import propagators
+from propagators import Sgp4Orbital
+import visibility
+from trajectory_store import create_trajectory_store
 from forms.user import RegisterForm, LoginForm, EditProfileForm, EditGeopositionForm
 from forms.coords_form import ObservationPointCoordsForm, PassesSettingsForm
 from data import db_session
@@ -12,8 +40,293 @@ from flask_login import LoginManager, login_user, login_required, logout_user, c
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'yandexlyceum_secret_key'
+# Расчитывать пролеты по всему каталогу tle.txt, а не только по SATELLITES
+app.config['PASSES_ALL_SATELLITES'] = False
+# Количество процессов для тяжелых расчетов: пролетов и карт видимости (0 - расчитывать в потоке запроса),
+# и сколько спутников отдается процессу за раз при расчете пролетов
+app.config['PASSES_WORKERS'] = os.cpu_count()
+app.config['PASSES_CHUNK_SIZE'] = 8
+# Кеш расписаний пролетов: количество записей, время жизни (в секундах), точность округления
+# координат наблюдателя (знаков после запятой) и длина интервала округления времени начала (в минутах)
+app.config['PASSES_CACHE_SIZE'] = 256
+app.config['PASSES_CACHE_TTL'] = 3600
+app.config['PASSES_CACHE_PRECISION'] = 2
+app.config['PASSES_CACHE_BUCKET'] = 15
+# Сколько точек траектории расчитывается за раз при выгрузке в файл
+app.config['DOWNLOAD_CHUNK_SIZE'] = 3600
+# Таблицы положений спутников: шаг (в секундах), сверка результатов с прямым расчетом
+# и через сколько секунд без обращений таблица удаляется
+app.config['EPHEMERIS_STEP'] = 60
+app.config['EPHEMERIS_VERIFY'] = False
+app.config['EPHEMERIS_TTL'] = 3600
+# Трассы спутников на странице /object: интервал (в секундах), на который расчитывается одна общая трасса,
+# количество витков по умолчанию и наибольшее, количество хранимых трасс
+app.config['GROUND_TRACK_BUCKET'] = 60
+app.config['GROUND_TRACK_ORBITS'] = 1
+app.config['GROUND_TRACK_MAX_ORBITS'] = 5
+app.config['GROUND_TRACK_CACHE_SIZE'] = 256
+# Карты видимости спутника: наибольшее количество ячеек сетки, наибольшая длительность (в часах),
+# допустимый шаг по времени (в секундах) и наибольшее количество значений ячейки x момента в одном расчете
+app.config['COVERAGE_MAX_CELLS'] = 360 * 720
+app.config['COVERAGE_MAX_DURATION'] = 24 * 7
+app.config['COVERAGE_MIN_STEP'] = 5
+app.config['COVERAGE_MAX_STEP'] = 600
+app.config['COVERAGE_MAX_POINTS'] = 10 ** 9
+# База GeoIP и размер кеша результатов поиска по IP
+app.config['GEOIP_DATABASE'] = 'db/GeoLite2-City.mmdb'
+app.config['GEOIP_CACHE_SIZE'] = 4096
+# Хранилище траекторий пролетов (memory - в памяти процесса, database - в базе данных приложения),
+# время жизни траектории (в секундах) и ограничение на суммарный размер траекторий (в байтах)
+app.config['TRAJECTORY_STORE'] = 'memory'
+app.config['TRAJECTORY_TTL'] = 6 * 3600
+app.config['TRAJECTORY_MAX_BYTES'] = 64 * 1024 * 1024
+# Размер пула соединений с базой данных и сколько соединений можно открыть сверх него
+app.config['DB_POOL_SIZE'] = 5
+app.config['DB_MAX_OVERFLOW'] = 10
+# Кеш пользователей (вместе с координатами точки наблюдения): количество записей и время жизни (в секундах)
+app.config['USERS_CACHE_SIZE'] = 1024
+app.config['USERS_CACHE_TTL'] = 60
+# Метрики для /metrics: время обработки запросов, участков кода и количество вызовов расчета положения
+app.config['METRICS_ENABLED'] = True
+# Профилирование запросов: запросы дольше PROFILE_SLOW_REQUESTS секунд (None - не профилировать)
+# и запросы с заголовком PROFILE_HEADER (None - заголовок не учитывается) сохраняются в PROFILE_DIR
+# в формате свернутых стеков для построения flame graph
+app.config['PROFILE_SLOW_REQUESTS'] = None
+app.config['PROFILE_HEADER'] = None
+app.config['PROFILE_INTERVAL'] = 0.005
+app.config['PROFILE_DIR'] = 'profiles'
+# Расчет положения спутников: pyorbital или sgp4 (спутники x моменты одним вызовом, нужен пакет sgp4)
+app.config['PROPAGATOR'] = 'pyorbital'
+# Тяжелые расчеты пролетов: сколько выполняется одновременно (остальные запросы сразу получают 503),
+# ограничение времени расчета (в секундах) и бюджет запроса (спутники x часы x станции)
+app.config['COMPUTE_MAX_RUNNING'] = 4
+app.config['COMPUTE_TIMEOUT'] = 60
+app.config['COMPUTE_BUDGET'] = 5000
+# Фоновые расчеты пролетов на длительный срок: количество потоков очереди, длина части расчета и запас
+# окна части (в часах), время хранения результатов (в секундах) и наибольшая длительность расчета (в часах)
+app.config['JOBS_WORKERS'] = 2
+app.config['JOBS_CHUNK_HOURS'] = 24
+app.config['JOBS_CHUNK_MARGIN'] = 2
+app.config['JOBS_TTL'] = 24 * 3600
+app.config['JOBS_MAX_DURATION'] = 24 * 90
+# Расписания пролетов для сохраненных пользователями точек наблюдения: на сколько часов вперед они расчитаны,
+# как часто продлеваются и через сколько секунд без обращений удаляются
+app.config['TIMETABLES_ENABLED'] = True
+app.config['TIMETABLES_HOURS'] = 48
+app.config['TIMETABLES_REFRESH_INTERVAL'] = 600
+app.config['TIMETABLES_TTL'] = 7 * 24 * 3600
+# HTTP-кеширование ответов, определяемых параметрами запроса (в секундах), и сжатие текстовых ответов
+# больше HTTP_COMPRESS_MIN_SIZE байт
+app.config['HTTP_CACHE_MAX_AGE'] = 3600
+app.config['HTTP_COMPRESS_ENABLED'] = True
+app.config['HTTP_COMPRESS_MIN_SIZE'] = 1024
+app.config['HTTP_COMPRESS_LEVEL'] = 6
 login_manager = LoginManager()
 login_manager.init_app(app)
+passes_cache = PassesCache(maxsize=app.config['PASSES_CACHE_SIZE'], ttl=app.config['PASSES_CACHE_TTL'],
+                           precision=app.config['PASSES_CACHE_PRECISION'],
+                           alt_precision=app.config['PASSES_CACHE_PRECISION'],
+                           bucket=app.config['PASSES_CACHE_BUCKET'])
+ephemeris = EphemerisStore(step=app.config['EPHEMERIS_STEP'], verify=app.config['EPHEMERIS_VERIFY'],
+                           ttl=app.config['EPHEMERIS_TTL'])
+ground_tracks = GroundTracks(ephemeris, bucket=app.config['GROUND_TRACK_BUCKET'],
+                             maxsize=app.config['GROUND_TRACK_CACHE_SIZE'])
+geoip = GeoIP(app.config['GEOIP_DATABASE'], app.config['GEOIP_CACHE_SIZE'])
+trajectory_store = create_trajectory_store(app.config['TRAJECTORY_STORE'], app.config['TRAJECTORY_TTL'],
+                                           app.config['TRAJECTORY_MAX_BYTES'])
+users_cache = LRUCache(app.config['USERS_CACHE_SIZE'], app.config['USERS_CACHE_TTL'])
+compute_limiter = ComputeLimiter(app.config['COMPUTE_MAX_RUNNING'], app.config['COMPUTE_TIMEOUT'],
+                                 app.config['COMPUTE_BUDGET'])
+job_queue = JobQueue(app.config['JOBS_WORKERS'], app.config['JOBS_CHUNK_HOURS'], app.config['JOBS_CHUNK_MARGIN'],
+                     app.config['JOBS_TTL'])
+timetables = Timetables(lambda: passes_satellites(), hours=app.config['TIMETABLES_HOURS'],
+                        interval=app.config['TIMETABLES_REFRESH_INTERVAL'], ttl=app.config['TIMETABLES_TTL'],
+                        precision=app.config['PASSES_CACHE_PRECISION'],
+                        alt_precision=app.config['PASSES_CACHE_PRECISION'])
+
+propagators.set_propagator(app.config['PROPAGATOR'])
+
+if app.config['METRICS_ENABLED']:
+    metrics.instrument_orbital(Orbital)
+    # Sgp4Orbital расчитывает положение сам, а для одного момента - отдельным методом
+    metrics.instrument_orbital(Sgp4Orbital)
+    metrics.instrument_orbital(Sgp4Orbital, 'get_position_at')
+
+
+# Допустимый шаг (в секундах) траектории при выгрузке в файл
+MIN_TRAJECTORY_STEP = 0.01
+MAX_TRAJECTORY_STEP = 3600
+
+# Максимальная длительность (в секундах) траектории пролета, сохраняемой в хранилище траекторий.
+# Пролеты спутников на низкой орбите длятся не больше получаса
+MAX_PASS_TRAJECTORY_DURATION = 3 * 3600
+
+# Максимальное количество точек (спутники x моменты) в одном запросе координат
+MAX_BULK_POINTS = 1000000
+
+# Максимальное количество станций в одном запросе пролетов для сети станций
+MAX_NETWORK_STATIONS = 100
+
+# Максимальное количество антенн в запросе плана сопровождения
+MAX_ANTENNAS = 16
+
+# Как часто (в секундах) отправлять keep-alive в поток положения спутника, если нет новых данных
+STREAM_KEEPALIVE = 15
+
+# Как часто (в секундах) поток фонового расчета проверяет, не готова ли следующая часть
+JOBS_STREAM_POLL = 1
+
+
+def passes_satellites():
+    """
+    Спутники, по которым расчитываются пролеты
+    """
+    return catalog.names if app.config['PASSES_ALL_SATELLITES'] else SATELLITES
+
+
+def get_db_session():
+    """
+    Сессия базы данных текущего запроса, закрывается после его завершения
+    """
+    if 'db_sess' not in g:
+        g.db_sess = db_session.create_session()
+    return g.db_sess
+
+
+@app.teardown_appcontext
+def close_db_session(exception):
+    db_sess = g.pop('db_sess', None)
+    if db_sess is not None:
+        db_sess.close()
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    if app.config['METRICS_ENABLED']:
+        metrics.start_request()
+
+    header = app.config['PROFILE_HEADER']
+    g.profile_forced = bool(header and request.headers.get(header))
+    if g.profile_forced or app.config['PROFILE_SLOW_REQUESTS'] is not None:
+        g.profiler = metrics.SamplingProfiler(interval=app.config['PROFILE_INTERVAL']).start()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    """
+    Записывает время обработки запроса, добавляет заголовок Server-Timing с временем участков кода
+    и сохраняет профиль медленного запроса
+    """
+    if 'request_start' not in g:
+        return response
+
+    duration = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+    if app.config['METRICS_ENABLED']:
+        stats = metrics.finish_request(route, request.method, response.status_code, duration)
+        timings = [f'{section.replace(".", "-")};dur={value * 1000:.1f}' for section, value in stats.items()
+                   if section != 'propagator_calls']
+        response.headers['Server-Timing'] = ', '.join([f'total;dur={duration * 1000:.1f}'] + timings)
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.stop()
+        slow = app.config['PROFILE_SLOW_REQUESTS']
+        if g.profile_forced or (slow is not None and duration >= slow):
+            os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+            name = f'{dt.datetime.now().strftime("%Y%m%d-%H%M%S-%f")}{route.replace("/", "_")}.folded'
+            profiler.dump(os.path.join(app.config['PROFILE_DIR'], name))
+
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    if app.config['HTTP_COMPRESS_ENABLED']:
+        response = compress(response, app.config['HTTP_COMPRESS_MIN_SIZE'], app.config['HTTP_COMPRESS_LEVEL'])
+    return response
+
+
+def cache_stats() -> dict:
+    stats = {'passes': passes_cache.stats(), 'geoip': geoip.stats(), 'users': users_cache.stats(),
+             'ground_tracks': ground_tracks.stats()}
+    if app.config['TIMETABLES_ENABLED']:
+        stats['timetables'] = timetables.stats()
+    return stats
+
+
+metrics.registry.collector('orbitracker_cache_hit_ratio', 'Доля попаданий в кеш', lambda: {
+    (('cache', name),): stats['hit_ratio'] for name, stats in cache_stats().items()})
+metrics.registry.collector('orbitracker_cache_size', 'Количество записей в кеше', lambda: {
+    (('cache', name),): stats['size'] for name, stats in cache_stats().items()})
+metrics.registry.collector('orbitracker_ephemeris_lookups_total', 'Запросы положения по таблицам', lambda: {
+    (('result', 'table'),): ephemeris.lookups - ephemeris.fallbacks,
+    (('result', 'fallback'),): ephemeris.fallbacks}, kind='counter')
+metrics.registry.collector('orbitracker_stream_subscribers', 'Подписчики потока положений спутников',
+                           live_stream.subscribers_count)
+
+
+metrics.registry.collector('orbitracker_compute_running', 'Выполняющиеся тяжелые расчеты',
+                           lambda: compute_limiter.running)
+metrics.registry.collector('orbitracker_compute_rejected_total', 'Отклоненные из-за нагрузки тяжелые расчеты',
+                           lambda: compute_limiter.rejected, kind='counter')
+metrics.registry.collector('orbitracker_jobs', 'Фоновые расчеты пролетов по состояниям',
+                           lambda: {(('status', status),): count for status, count in job_queue.stats().items()})
+
+
+def compute_passes(function, *args, cost: float, **kwargs):
+    """
+    Выполняет тяжелый расчет пролетов с ограничениями compute_limiter. Расчет идет в пуле процессов
+    (если он запущен), а поток запроса только ждет результат и прерывает расчет, если истекло
+    отведенное время или клиент отключился
+    """
+    with compute_limiter.slot(cost) as deadline:
+        return function(*args, deadline=deadline, cancelled=disconnect_checker(request.environ), **kwargs)
+
+
+def get_cached_passes(lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
+                      start_time: dt.datetime, duration: int):
+    """
+    Расписание пролетов из passes_cache, а если его там нет - тяжелым расчетом через compute_passes.
+    Место в compute_limiter занимается и бюджет проверяется только при промахе кеша
+    """
+    satellites = passes_satellites()
+    passes = passes_cache.lookup(lat, lon, alt, min_elevation, min_apogee, start_time, duration, satellites)
+    if passes is None:
+        passes = compute_passes(passes_cache.get_passes, lat, lon, alt, min_elevation, min_apogee, start_time,
+                                duration, satellites=satellites, cost=len(satellites) * duration)
+    return passes
+
+
+@app.errorhandler(BudgetExceeded)
+def budget_exceeded(error):
+    return jsonify({'error': 'compute budget exceeded', 'budget': compute_limiter.budget}), 400
+
+
+@app.errorhandler(Overloaded)
+def overloaded(error):
+    return jsonify({'error': 'server is busy'}), 503, {'Retry-After': '5'}
+
+
+@app.errorhandler(CalculationTimeout)
+def calculation_timeout(error):
+    return jsonify({'error': 'calculation timeout'}), 504
+
+
+@app.errorhandler(CalculationCancelled)
+def calculation_cancelled(error):
+    # Клиент уже отключился, ответ никто не прочитает
+    return '', 499
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Метрики в текстовом формате Prometheus
+    """
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/')
@@ -24,19 +337,10 @@ def index():
 @app.route('/passes', methods=['GET'])
 def get_timetable():
     # Получаем пользователя если он зарегистрирован
-    user = None
-    if current_user.is_authenticated:
-        db_sess = db_session.create_session()
-        user = db_sess.query(User).filter(User.id == current_user.id).first()
+    user = current_user if current_user.is_authenticated else None
 
     # Получаем координаты пользователя по айпи
-    try:
-        reader = geoip2.database.Reader('db/GeoLite2-City.mmdb')
-        response = reader.city(request.remote_addr)
-        ip_lat = response.location.latitude
-        ip_lon = response.location.longitude
-    except geoip2.errors.AddressNotFoundError:
-        ip_lat = ip_lon = None
+    ip_lat, ip_lon = geoip.locate(request.remote_addr)
 
     # Если пользователь сохранил свои координаты или получилось определить их по айпи,
     # отображаем форму без ввода координат
@@ -61,7 +365,27 @@ def get_timetable():
         start_time = form.start_time.data
         duration = form.duration.data
 
-        passes = OrbCalculator.get_passes(lat, lon, alt, min_elevation, min_apogee, start_time, duration)
+        passes = None
+        # Для сохраненной пользователем точки наблюдения пролеты берутся из заранее расчитанного расписания
+        if app.config['TIMETABLES_ENABLED'] and isinstance(form, PassesSettingsForm) and user \
+                and user.lon and user.lat and user.alt:
+            passes = timetables.get_passes(get_db_session(), lat, lon, alt, min_elevation, min_apogee, start_time,
+                                           duration)
+
+        if passes is None:
+            # Ошибки тяжелого расчета показываются на странице с формой, а не в виде JSON, как в API
+            try:
+                passes = get_cached_passes(lat, lon, alt, min_elevation, min_apogee, start_time, duration)
+            except BudgetExceeded:
+                return render_template('get_passes.html', form=form, active_tab='passes',
+                                       message='Слишком долгий расчет, уменьшите продолжительность'), 400
+            except Overloaded:
+                return render_template('get_passes.html', form=form, active_tab='passes',
+                                       message='Сервер занят, попробуйте через несколько секунд'), \
+                    503, {'Retry-After': '5'}
+            except CalculationTimeout:
+                return render_template('get_passes.html', form=form, active_tab='passes',
+                                       message='Расчет не успел завершиться, уменьшите продолжительность'), 504
 
         return render_template('passes.html', passes=passes, lon=lon, lat=lat, alt=alt, active_tab='passes')
     return render_template('get_passes.html', form=form, active_tab='passes')
@@ -70,8 +394,8 @@ def get_timetable():
 @app.route('/make-pass-trajectory', methods=['GET'])
 def make_pass_trajectory():
     """
-    Расчитывает траекторию спутника и сохраняет в сессию, чтобы при обновлении страницы
-    не нужно было заново расчитывать координаты
+    Расчитывает траекторию спутника и сохраняет в хранилище траекторий, чтобы при обновлении страницы
+    не нужно было заново расчитывать координаты. В сессии хранится только token траектории
     """
     satellite = request.args.get('satellite')
     start_time = dt.datetime.strptime(f'{request.args.get("start")} +0000', '%Y.%m.%d %H:%M:%S %z')
@@ -80,46 +404,49 @@ def make_pass_trajectory():
     lat = float(request.args.get('lat'))
     alt = float(request.args.get('alt'))
 
+    if (end_time - start_time).total_seconds() > MAX_PASS_TRAJECTORY_DURATION:
+        return jsonify({'error': 'pass is too long'}), 400
+
     current_time = dt.datetime.now(tz=dt.timezone.utc)
 
-    orb = Orbital(satellite, 'tle.txt')
+    # Для упрощения вычислений, расчитываем координаты с шагом 20 секунд
+    trajectory = OrbCalculator.get_trajectory(satellite, max(start_time, current_time), end_time, 20, lon, lat, alt)
 
-    absolute_trajectory = []
-    viewer_trajectory = []
+    # Абсолютные координаты спутника
+    absolute_trajectory = np.column_stack([trajectory.lon, trajectory.lat, trajectory.alt])
+    # Координаты спутника на небе относительно наблюдателя
+    viewer_trajectory = np.column_stack([trajectory.azimuth, trajectory.elevation])
 
-    # Для упрощения вычислений, расчитываем координаты с шагом 20 секунд
-    for shift in range(0, (end_time - max(start_time, current_time)).seconds, 20):
-        shifted_time = max(start_time, current_time) + dt.timedelta(seconds=shift)
-
-        # Расчитываем абсолютные координаты спутника
-        satellite_lon, satellite_lat, satellite_alt = orb.get_lonlatalt(shifted_time)
-        absolute_trajectory.append([satellite_lon, satellite_lat, satellite_alt])
-
-        # Расчитываем координаты спутника на небе относительно наблюдателя
-        azimuth, elevation = orb.get_observer_look(shifted_time, lon, lat, alt)
-        viewer_trajectory.append([azimuth, elevation])
-
-    session['absolute_trajectory'] = absolute_trajectory
-    session['viewer_trajectory'] = viewer_trajectory
-    session['lat'] = lat
-    session['lon'] = lon
-    session['alt'] = alt
-    session['start_time'] = start_time.strftime('%Y.%m.%d %H:%M:%S')
-    session['end_time'] = end_time.strftime('%Y.%m.%d %H:%M:%S')
-    session['satellite'] = satellite
+    params = {'satellite': satellite, 'lat': lat, 'lon': lon, 'alt': alt,
+              'start_time': start_time.strftime('%Y.%m.%d %H:%M:%S'),
+              'end_time': end_time.strftime('%Y.%m.%d %H:%M:%S')}
+    session['trajectory'] = trajectory_store.put(params, absolute_trajectory, viewer_trajectory)
 
     return ''
 
 
+def stored_trajectory():
+    """
+    Траектория, на которую указывает token из сессии, или None
+    """
+    token = session.get('trajectory')
+    if token is None:
+        return None
+    return trajectory_store.get(token)
+
+
 @app.route('/get-pass-trajectory', methods=['GET'])
 def get_pass_trajectory():
     """
-    Достать траекторию спутника из сессии
+    Достать траекторию спутника из хранилища
     """
-    return jsonify({'absolute_trajectory': session['absolute_trajectory'],
-                    'viewer_trajectory': session['viewer_trajectory'],
-                    'lat': session['lat'], 'lon': session['lon'],
-                    'start_time': session['start_time'], 'end_time': session['end_time']}), 200
+    trajectory = stored_trajectory()
+    if trajectory is None:
+        return jsonify({'error': 'trajectory not found'}), 404
+
+    params, absolute_trajectory, viewer_trajectory = trajectory
+    return jsonify({'absolute_trajectory': absolute_trajectory.tolist(),
+                    'viewer_trajectory': viewer_trajectory.tolist(), **params}), 200
 
 
 @app.route('/get-viewer-coords', methods=['GET'])
@@ -127,18 +454,23 @@ def get_viewer_coords():
     """
     Расчитать текущие координаты спутника относительно наблюдателя, чтобы обновить их в браузере
     """
-    satellite = session['satellite']
-    start_time = dt.datetime.strptime(f'{session["start_time"]} +0000', '%Y.%m.%d %H:%M:%S %z')
-    end_time = dt.datetime.strptime(f'{session["end_time"]} +0000', '%Y.%m.%d %H:%M:%S %z')
+    trajectory = stored_trajectory()
+    if trajectory is None:
+        return jsonify({'error': 'trajectory not found'}), 404
+
+    params = trajectory[0]
+    satellite = params['satellite']
+    start_time = dt.datetime.strptime(f'{params["start_time"]} +0000', '%Y.%m.%d %H:%M:%S %z')
+    end_time = dt.datetime.strptime(f'{params["end_time"]} +0000', '%Y.%m.%d %H:%M:%S %z')
     current_time = dt.datetime.now(tz=dt.timezone.utc)
-    lat = session['lat']
-    lon = session['lon']
-    alt = session['alt']
+    lat = params['lat']
+    lon = params['lon']
+    alt = params['alt']
 
     if not start_time <= current_time <= end_time:
         return jsonify({'error': 'wrong time'}), 200
 
-    orb = Orbital(satellite, 'tle.txt')
+    orb = propagators.get_orbital(satellite)
 
     satellite_lon, satellite_lat, satellite_alt = orb.get_lonlatalt(current_time)
     azimuth, elevation = orb.get_observer_look(current_time, lon, lat, alt)
@@ -153,30 +485,41 @@ def view_pass_trajectory():
 
 
 @app.route('/download-trajectory', methods=['GET'])
+@cacheable()
 def download_trajectory():
+    """
+    Выгрузка траектории спутника относительно наблюдателя. Файл формируется и отдается частями,
+    step - шаг в секундах (по умолчанию 1), format - tsv (по умолчанию), csv или npy
+    """
     satellite = request.args.get('satellite')
     start_time = dt.datetime.strptime(request.args.get('start'), '%Y.%m.%d %H:%M:%S')
     end_time = dt.datetime.strptime(request.args.get('end'), '%Y.%m.%d %H:%M:%S')
     lon = float(request.args.get('lon'))
     lat = float(request.args.get('lat'))
     alt = float(request.args.get('alt'))
+    step = float(request.args.get('step', 1))
+    file_format = request.args.get('format', 'tsv')
 
-    orb = Orbital(satellite, 'tle.txt')
+    if file_format not in trajectory_export.FORMATS:
+        return jsonify({'error': 'unknown format'}), 400
+    if not MIN_TRAJECTORY_STEP <= step <= MAX_TRAJECTORY_STEP:
+        return jsonify({'error': 'wrong step'}), 400
 
-    content = f'Спутник {satellite}\n'
-    content += f'Начальная дата и время {start_time.strftime("%Y-%m-%d %H:%M:%S UTC")}\n'
-    content += '\n'
-    content += 'Время (UTC)\tАзимут\tЭлевация\n'
-    content += '\n'
+    # Проверяем, что спутник существует, до начала выгрузки
+    try:
+        catalog.get_record(satellite)
+    except KeyError:
+        return jsonify({'error': 'satellite not found'}), 404
 
-    for shift in range((end_time - start_time).seconds):
-        current_time = start_time + dt.timedelta(seconds=shift)
-        azimuth, elevation = orb.get_observer_look(current_time, lon, lat, alt)
-        content += f'{current_time.strftime("%H:%M:%S")}\t{azimuth:.2f}\t{elevation:.2f}\n'
+    writer, mimetype, extension = trajectory_export.FORMATS[file_format]
+    chunks = OrbCalculator.iter_trajectory(satellite, start_time, end_time, step, lon, lat, alt, absolute=False,
+                                           chunk_size=app.config['DOWNLOAD_CHUNK_SIZE'])
 
-    file = BytesIO(content.encode('utf-8'))
+    # Имя файла в кириллице передается по RFC 5987, для старых клиентов указываем запасное имя
+    disposition = f"attachment; filename=trajectory.{extension}; filename*=UTF-8''{quote(f'Траектория.{extension}')}"
 
-    return send_file(file, as_attachment=True, download_name='Траектория.txt', mimetype='text/plain')
+    return Response(stream_with_context(writer(chunks, satellite, start_time, end_time, step)),
+                    mimetype=mimetype, headers={'Content-Disposition': disposition})
 
 
 @app.route('/find-object', methods=['GET'])
@@ -186,10 +529,7 @@ def find_object():
     if not query:
         return render_template('find_object.html', active_tab='find_object')
 
-    satellites = []
-    for sat in SATELLITES:
-        if query.lower() in sat.lower():
-            satellites.append(sat)
+    satellites = [record.name for record in catalog.search(query, MAX_SEARCH_LIMIT)]
 
     # Возвращаем подходящие названия спутников пользователю, чтобы тот выбрал нужный
     return render_template('find_object.html', satellites=satellites, active_tab='find_object')
@@ -197,44 +537,44 @@ def find_object():
 
 @app.route('/object/<name>', methods=['GET'])
 def track_object(name):
-    start_time = dt.datetime.now(tz=dt.timezone.utc)
-
-    orb = Orbital(name, 'tle.txt')
-
-    trajectory = []
-    # Расчитываем траекторию за час до этой секудны, и на час после,
-    # примерно один виток вокруг Земли
-    for shift in range(-60, 60):
-        lon, lat, alt = orb.get_lonlatalt(start_time + dt.timedelta(minutes=shift))
-        trajectory.append((lon, lat, alt))
+    current_time = dt.datetime.now(tz=dt.timezone.utc)
+    satellite_lon, satellite_lat, satellite_alt = ephemeris.get_lonlatalt(name, current_time)
 
-    satellite_lon, satellite_lat, satellite_alt = orb.get_lonlatalt(start_time)
+    # Трасса загружается страницей отдельным запросом. Время в адресе округлено до интервала общей трассы,
+    # поэтому все, кто открыл страницу в этом интервале, получают один и тот же ответ
+    track_url = url_for('ground_track', sat=name, orbits=app.config['GROUND_TRACK_ORBITS'],
+                        time=ground_tracks.floor_to_bucket(current_time).strftime(GROUND_TRACK_TIME_FORMAT))
 
     # Получаем координаты пользователя, чтобы отобразить его местонахождение на карте
     user_lat = user_lon = None
     if current_user.is_authenticated:
-        db_sess = db_session.create_session()
-        user = db_sess.query(User).filter(User.id == current_user.id).first()
-        user_lat = user.lat
-        user_lon = user.lon
+        user_lat = current_user.lat
+        user_lon = current_user.lon
 
     if not user_lat and not user_lon:
-        try:
-            reader = geoip2.database.Reader('db/GeoLite2-City.mmdb')
-            response = reader.city(request.remote_addr)
-            user_lat = response.location.latitude
-            user_lon = response.location.longitude
-        except geoip2.errors.AddressNotFoundError:
-            user_lat = user_lon = None
-
-    return render_template('orbit.html', sat=name, trajectory=trajectory, user_lat=user_lat, user_lon=user_lon,
+        user_lat, user_lon = geoip.locate(request.remote_addr)
+
+    return render_template('orbit.html', sat=name, track_url=track_url, user_lat=user_lat, user_lon=user_lon,
                            satellite_lat=satellite_lat, satellite_lon=satellite_lon, satellite_alt=satellite_alt)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    db_sess = db_session.create_session()
-    user = db_sess.query(User).get(user_id)
+    """
+    Пользователь загружается из базы не чаще раза в USERS_CACHE_TTL секунд, в остальное время
+    он восстанавливается из кеша и присоединяется к сессии запроса без обращения к базе
+    """
+    db_sess = get_db_session()
+
+    values = users_cache.get(int(user_id))
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db_sess.merge(user, load=False)
+
+    user = db_sess.get(User, int(user_id))
+    if user is not None:
+        users_cache.set(user.id, {column.key: getattr(user, column.key) for column in User.__table__.columns})
     return user
 
 
@@ -248,7 +588,7 @@ def register():
             return render_template('register.html', message="Пароли не совпадают",
                                    form=form, active_tab='register')
 
-        db_sess = db_session.create_session()
+        db_sess = get_db_session()
 
         if db_sess.query(User).filter(User.email == form.email.data).first():
             return render_template('register.html', message="Такой пользователь уже есть",
@@ -272,7 +612,7 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
+        db_sess = get_db_session()
         user = db_sess.query(User).filter(User.email == form.email.data).first()
 
         if user and user.check_password(form.password.data):
@@ -305,13 +645,11 @@ def edit_profile():
     form2 = EditGeopositionForm()
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
-        user = db_sess.query(User).filter(User.id == current_user.id).first()
-
-        if user:
-            user.name = form.name.data
-            db_sess.commit()
-            return redirect('/profile')
+        user_id = current_user.id
+        current_user.name = form.name.data
+        get_db_session().commit()
+        users_cache.delete(user_id)
+        return redirect('/profile')
 
     return render_template('edit_profile.html', form=form, form2=form2, active_tab='profile')
 
@@ -323,20 +661,23 @@ def edit_geoposition():
     form1 = EditProfileForm()
 
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
-        user = db_sess.query(User).filter(User.id == current_user.id).first()
-
-        if user:
-            user.lat = form.lat.data
-            user.lon = form.lon.data
-            user.alt = form.alt.data
-            db_sess.commit()
-            return redirect('/profile')
+        user_id = current_user.id
+        old_position = current_user.lat, current_user.lon, current_user.alt
+        current_user.lat = form.lat.data
+        current_user.lon = form.lon.data
+        current_user.alt = form.alt.data
+        get_db_session().commit()
+        users_cache.delete(user_id)
+        # Расписание старой точки наблюдения больше не нужно, если ее не сохранил кто-то еще
+        if app.config['TIMETABLES_ENABLED']:
+            timetables.release(get_db_session(), *old_position)
+        return redirect('/profile')
 
     return render_template('edit_geoposition.html', form=form, form1=form1, active_tab='profile')
 
 
 @app.route('/api/coords', methods=['GET'])
+@cacheable(required=('time',))
 def coords():
     """
     Получение текущих абсолютных координат спутника
@@ -344,19 +685,236 @@ def coords():
     satellite = request.args.get('sat')
     time = request.args.get('time')
     if time:
-        dt.datetime.strptime(f"{request.args.get('time')} +0000", '%Y-%m-%d %H:%M:%S %z')
+        time = dt.datetime.strptime(f"{request.args.get('time')} +0000", '%Y-%m-%d %H:%M:%S %z')
 
     if satellite not in SATELLITES:
         return jsonify({'error': 'satellite not found'}), 200
 
-    orb = Orbital(satellite, 'tle.txt')
-
-    lon, lat, alt = orb.get_lonlatalt(time or dt.datetime.now(tz=dt.timezone.utc))
+    lon, lat, alt = ephemeris.get_lonlatalt(satellite, time or dt.datetime.now(tz=dt.timezone.utc))
 
     return jsonify({'lon': lon, 'lat': lat, 'alt': alt}), 200
 
 
+@app.route('/api/search', methods=['GET'])
+def search_satellites():
+    """
+    Подсказки при вводе: спутники, у которых с запросом q совпадает название, номер NORAD
+    или международное обозначение, лучшие совпадения первыми
+    """
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 10, type=int)
+
+    if limit is None or not 0 < limit <= MAX_SEARCH_LIMIT:
+        return jsonify({'error': 'wrong limit'}), 400
+
+    results = [{'name': record.name, 'norad_id': record.norad_id, 'intl_designator': record.intl_designator}
+               for record in catalog.search(query, limit)]
+    return jsonify({'query': query, 'results': results}), 200
+
+
+@app.route('/api/coords/bulk', methods=['GET', 'POST'])
+def bulk_coords():
+    """
+    Получение абсолютных координат нескольких спутников в несколько моментов времени.
+    Спутники передаются списком sat, моменты - списком time или промежутком start, end с шагом step (в секундах).
+    Параметры принимаются в строке запроса или в JSON теле POST запроса.
+    При format=npz ответ - архив numpy с массивами satellites, times (секунды от 1970-01-01 UTC)
+    и lon, lat, alt размера (спутники, моменты)
+    """
+    if request.method == 'POST':
+        params = request.get_json(silent=True) or {}
+    else:
+        params = {key: request.args.getlist(key) for key in request.args}
+        params.update({key: values[0] for key, values in params.items() if key not in ('sat', 'time')})
+        # В строке запроса спутники можно перечислить и через запятую
+        params['sat'] = [name for value in params.get('sat', []) for name in value.split(',')]
+
+    satellites = params.get('sat') or []
+    if isinstance(satellites, str):
+        satellites = [satellites]
+    # Повторяющиеся спутники расчитываются и возвращаются один раз
+    satellites = list(dict.fromkeys(satellites))
+    file_format = params.get('format', 'json')
+
+    try:
+        if params.get('time'):
+            times = params['time'] if isinstance(params['time'], list) else [params['time']]
+            times = np.array([dt.datetime.strptime(time, '%Y-%m-%d %H:%M:%S') for time in times],
+                             dtype='datetime64[us]')
+        else:
+            start_time = dt.datetime.strptime(params['start'], '%Y-%m-%d %H:%M:%S')
+            end_time = dt.datetime.strptime(params['end'], '%Y-%m-%d %H:%M:%S')
+            step = float(params.get('step', 60))
+            if not MIN_TRAJECTORY_STEP <= step <= MAX_TRAJECTORY_STEP:
+                return jsonify({'error': 'wrong step'}), 400
+            # Количество точек проверяется до создания массива моментов, чтобы не выделять под него лишнюю память
+            if (end_time - start_time).total_seconds() / step * max(len(satellites), 1) > MAX_BULK_POINTS:
+                return jsonify({'error': 'too many points'}), 400
+            times = np.arange(to_datetime64(start_time), to_datetime64(end_time),
+                              np.timedelta64(round(step * 1e6), 'us'))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'wrong time'}), 400
+
+    if not satellites:
+        return jsonify({'error': 'satellite not found'}), 400
+    if len(satellites) * len(times) > MAX_BULK_POINTS:
+        return jsonify({'error': 'too many points'}), 400
+
+    try:
+        positions = OrbCalculator.get_positions(satellites, times)
+    except KeyError:
+        return jsonify({'error': 'satellite not found'}), 404
+    except NotImplementedError:
+        return jsonify({'error': 'satellite not supported'}), 400
+
+    if file_format == 'npz':
+        file = BytesIO()
+        np.savez(file, satellites=np.array(list(positions.keys())),
+                 times=(times - np.datetime64(0, 'us')) / np.timedelta64(1, 's'),
+                 **{name: np.array([position[i] for position in positions.values()], dtype=np.float32)
+                    for i, name in enumerate(('lon', 'lat', 'alt'))})
+        return Response(file.getvalue(), mimetype='application/octet-stream')
+
+    return jsonify({'times': np.datetime_as_string(times, unit='s').tolist(),
+                    'satellites': {satellite: {'lon': lon.tolist(), 'lat': lat.tolist(), 'alt': alt.tolist()}
+                                   for satellite, (lon, lat, alt) in positions.items()}}), 200
+
+
+@app.route('/api/ephemeris', methods=['GET'])
+def ephemeris_stats():
+    """
+    Состояние таблиц положений спутников и, если включена сверка, максимальная погрешность интерполяции
+    """
+    return jsonify(ephemeris.stats()), 200
+
+
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """
+    Поток Server-Sent Events с текущими абсолютными координатами спутника. Если указаны координаты
+    наблюдателя, к ним добавляются азимут и элевация спутника относительно наблюдателя
+    """
+    satellite = request.args.get('sat')
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    alt = request.args.get('alt', 0, type=float)
+
+    try:
+        catalog.get_record(satellite)
+    except KeyError:
+        return jsonify({'error': 'satellite not found'}), 404
+
+    observer = (lat, lon, alt) if lat is not None and lon is not None else None
+
+    def events():
+        subscription = live_stream.subscribe(satellite, observer)
+        try:
+            while True:
+                try:
+                    data = subscription.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    # Комментарий SSE, чтобы прокси не закрывали соединение
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'data: {json.dumps(data)}\n\n'
+        finally:
+            live_stream.unsubscribe(subscription)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/ground-track', methods=['GET'])
+@cacheable(required=('time',))
+def ground_track():
+    """
+    Трасса спутника sat на orbits витков с моментом time (по умолчанию текущим) посередине: точки [lon, lat, alt],
+    прореженные на прямых участках, разбитые на части по антимеридиану. Трасса расчитывается один раз
+    на спутник и интервал GROUND_TRACK_BUCKET секунд
+    """
+    satellite = request.args.get('sat')
+    time = request.args.get('time')
+
+    try:
+        orbits = float(request.args.get('orbits', app.config['GROUND_TRACK_ORBITS']))
+        time = dt.datetime.strptime(f'{time} +0000', '%Y-%m-%d %H:%M:%S %z') if time \
+            else dt.datetime.now(tz=dt.timezone.utc)
+    except ValueError:
+        return jsonify({'error': 'wrong parameters'}), 400
+
+    if not 0 < orbits <= app.config['GROUND_TRACK_MAX_ORBITS']:
+        return jsonify({'error': 'wrong number of orbits', 'max_orbits': app.config['GROUND_TRACK_MAX_ORBITS']}), 400
+
+    try:
+        track = ground_tracks.get(satellite, time, orbits)
+    except KeyError:
+        return jsonify({'error': 'satellite not found'}), 404
+
+    return jsonify(track), 200
+
+
+@app.route('/api/coverage', methods=['GET'])
+@cacheable()
+def coverage_map():
+    """
+    Карта видимости спутника sat за duration часов с момента time: для каждой ячейки сетки с шагом resolution
+    градусов в прямоугольнике south, north, west, east - суммарное время (в секундах), когда элевация не меньше
+    min_elevation, и наибольшая элевация. Растры передаются построчно с севера на юг (см. coverage.encode_raster).
+    С format=png слой layer (visible_time или max_elevation) возвращается изображением для наложения на карту
+    """
+    satellite = request.args.get('sat')
+
+    try:
+        start_time = dt.datetime.strptime(f"{request.args.get('time')} +0000", '%Y-%m-%d %H:%M:%S %z')
+        duration = float(request.args.get('duration'))
+        resolution = float(request.args.get('resolution', 1))
+        min_elevation = float(request.args.get('min_elevation', 0))
+        step = float(request.args.get('step', COVERAGE_STEP))
+        bounds = tuple(float(request.args.get(name, default)) for name, default
+                       in (('south', -90), ('north', 90), ('west', -180), ('east', 180)))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'wrong parameters'}), 400
+
+    file_format = request.args.get('format', 'json')
+    layer = request.args.get('layer', 'visible_time')
+    south, north, west, east = bounds
+    if not (-90 <= south < north <= 90 and -180 <= west < east <= 180 and resolution > 0
+            and app.config['COVERAGE_MIN_STEP'] <= step <= app.config['COVERAGE_MAX_STEP']) \
+            or file_format not in ('json', 'png') or layer not in ('visible_time', 'max_elevation'):
+        return jsonify({'error': 'wrong parameters'}), 400
+    if not 0 < duration <= app.config['COVERAGE_MAX_DURATION']:
+        return jsonify({'error': 'wrong duration', 'max_duration': app.config['COVERAGE_MAX_DURATION']}), 400
+
+    lats, lons = make_grid(resolution, *bounds)
+    cells = len(lats) * len(lons)
+    if cells > app.config['COVERAGE_MAX_CELLS'] or cells * duration * 3600 / step > app.config['COVERAGE_MAX_POINTS']:
+        return jsonify({'error': 'grid is too large', 'max_cells': app.config['COVERAGE_MAX_CELLS'],
+                        'max_points': app.config['COVERAGE_MAX_POINTS']}), 400
+
+    try:
+        record = catalog.get_record(satellite)
+    except KeyError:
+        return jsonify({'error': 'satellite not found'}), 404
+
+    # Положение расчитывается для одного спутника, поэтому расчет стоит как пролеты одного спутника
+    result = compute_passes(OrbCalculator.run, compute_coverage, record.name, start_time, duration, resolution,
+                            bounds, min_elevation, step, cost=duration)
+
+    if file_format == 'png':
+        values = getattr(result, layer)
+        return Response(to_png(values, 90 if layer == 'max_elevation' else values.max()), mimetype='image/png')
+
+    end_time = start_time + dt.timedelta(hours=duration)
+    return jsonify({'satellite': record.name, 'start': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'end': end_time.strftime('%Y-%m-%d %H:%M:%S'), 'step': step, 'min_elevation': min_elevation,
+                    'grid': {'south': south, 'north': north, 'west': west, 'east': east,
+                             'rows': len(lats), 'cols': len(lons)},
+                    'visible_time': encode_raster(result.visible_time, 'uint32'),
+                    'max_elevation': encode_raster(result.max_elevation, 'int16', 0.01)}), 200
+
+
 @app.route('/api/trajectory', methods=['GET'])
+@cacheable(required=('time',))
 def trajectory():
     """
     Получение текущих координат спутника на небе относительно наблюдателя
@@ -367,18 +925,20 @@ def trajectory():
     alt = float(request.args.get('alt'))
     time = request.args.get('time')
     if time:
-        dt.datetime.strptime(f"{request.args.get('time')} +0000", '%Y-%m-%d %H:%M:%S %z')
+        time = dt.datetime.strptime(f"{request.args.get('time')} +0000", '%Y-%m-%d %H:%M:%S %z')
 
-    orb = Orbital(satellite, 'tle.txt')
+    orb = propagators.get_orbital(satellite)
     azimuth, elevation = orb.get_observer_look(time or dt.datetime.now(tz=dt.timezone.utc), lon, lat, alt)
 
     return jsonify({'azimuth': azimuth, 'elevation': elevation}), 200
 
 
 @app.route('/api/passes', methods=['GET'])
+@cacheable()
 def passes():
     """
-    Получение всех пролетов всех спутников за указанный период времени
+    Получение всех пролетов всех спутников за указанный период времени.
+    С параметром skipped=1 в ответ добавляются спутники, отброшенные до поиска пролетов, и причины
     """
     lon = float(request.args.get('lon'))
     lat = float(request.args.get('lat'))
@@ -386,11 +946,198 @@ def passes():
     start_time = dt.datetime.strptime(f"{request.args.get('time')} +0000", '%Y-%m-%d %H:%M:%S %z')
     duration = int(request.args.get('duration'))
 
-    passes = OrbCalculator.get_passes(lat, lon, alt, 0, 0, start_time, duration)
+    passes = get_cached_passes(lat, lon, alt, 0, 0, start_time, duration)
+
+    response = {'passes': passes}
+    if request.args.get('skipped'):
+        response['skipped'] = visibility.skip_reasons(catalog.get_orbit_bounds(), passes_satellites(), lat)
+    return jsonify(response), 200
+
+
+@app.route('/api/passes/network', methods=['POST'])
+def network_passes():
+    """
+    Получение пролетов всех спутников для сети наземных станций за указанный период времени.
+    Тело запроса: {"stations": [{"name": ..., "lat": ..., "lon": ..., "alt": ...}, ...], "time": ...,
+    "duration": ..., "min_elevation": ..., "min_apogee": ...}
+    """
+    params = request.get_json(silent=True) or {}
+
+    try:
+        stations = params['stations']
+        observers = [(float(station['lat']), float(station['lon']), float(station['alt'])) for station in stations]
+        start_time = dt.datetime.strptime(f"{params['time']} +0000", '%Y-%m-%d %H:%M:%S %z')
+        duration = int(params['duration'])
+        min_elevation = float(params.get('min_elevation', 0))
+        min_apogee = float(params.get('min_apogee', 0))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'wrong parameters'}), 400
+
+    if not 0 < len(observers) <= MAX_NETWORK_STATIONS:
+        return jsonify({'error': 'wrong number of stations'}), 400
+
+    satellites = passes_satellites()
+    passes = compute_passes(OrbCalculator.get_network_passes, observers, min_elevation, min_apogee, start_time,
+                            duration, satellites=satellites, cost=len(satellites) * duration * len(observers))
+
+    return jsonify({'stations': [{'name': station.get('name', str(i)), 'passes': station_passes}
+                                 for i, (station, station_passes) in enumerate(zip(stations, passes))]}), 200
+
+
+@app.route('/api/passes/schedule', methods=['POST'])
+def passes_schedule():
+    """
+    План сопровождения пролетов антеннами одной станции: какие пролеты пересекаются и какой антенне
+    достается каждый пролет, чтобы суммарная ценность была наибольшей.
+    Тело запроса: {"lat": ..., "lon": ..., "alt": ..., "time": ..., "duration": ..., "min_elevation": ...,
+    "min_apogee": ..., "antennas": 1, "gap": 0, "priorities": {"NOAA 19": 2, ...}}
+    """
+    params = request.get_json(silent=True) or {}
+
+    try:
+        lat, lon, alt = float(params['lat']), float(params['lon']), float(params['alt'])
+        start_time = dt.datetime.strptime(f"{params['time']} +0000", '%Y-%m-%d %H:%M:%S %z')
+        duration = int(params['duration'])
+        min_elevation = float(params.get('min_elevation', 0))
+        min_apogee = float(params.get('min_apogee', 0))
+        antennas = int(params.get('antennas', 1))
+        gap = float(params.get('gap', 0))
+        priorities = {catalog.get_record(satellite).name: float(weight)
+                      for satellite, weight in (params.get('priorities') or {}).items()}
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({'error': 'wrong parameters'}), 400
+
+    if not 0 < antennas <= MAX_ANTENNAS or gap < 0:
+        return jsonify({'error': 'wrong parameters'}), 400
+
+    passes = get_cached_passes(lat, lon, alt, min_elevation, min_apogee, start_time, duration)
+
+    return jsonify(make_schedule(passes, antennas, priorities, gap)), 200
+
+
+@app.route('/api/jobs/passes', methods=['POST'])
+def submit_passes_job():
+    """
+    Ставит в очередь фоновый расчет пролетов на длительный срок. Такой же запрос, пока его расчет
+    выполняется или хранится, получает тот же id.
+    Тело запроса: {"lat": ..., "lon": ..., "alt": ..., "time": ..., "duration": ..., "min_elevation": ...,
+    "min_apogee": ...}
+    """
+    params = request.get_json(silent=True) or {}
+
+    try:
+        start_time = dt.datetime.strptime(f"{params['time']} +0000", '%Y-%m-%d %H:%M:%S %z')
+        job_params = {
+            'lat': float(params['lat']), 'lon': float(params['lon']), 'alt': float(params['alt']),
+            'min_elevation': float(params.get('min_elevation', 0)),
+            'min_apogee': float(params.get('min_apogee', 0)),
+            'time': start_time.strftime(JOBS_TIME_FORMAT),
+            'duration': int(params['duration']),
+            'satellites': list(passes_satellites()),
+        }
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'wrong parameters'}), 400
+
+    if not 0 < job_params['duration'] <= app.config['JOBS_MAX_DURATION']:
+        return jsonify({'error': 'wrong duration', 'max_duration': app.config['JOBS_MAX_DURATION']}), 400
+
+    job, created = job_queue.submit(job_params)
+    del job['passes']
+    job['created'] = created
+
+    return jsonify(job), 202, {'Location': f"/api/jobs/{job['id']}"}
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Состояние фонового расчета и уже расчитанные пролеты. С параметром after=N отдаются только пролеты
+    из частей с номера N, поэтому при опросе можно передавать chunks_done из предыдущего ответа
+    """
+    job = job_queue.get(job_id, request.args.get('after', 0, type=int))
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job), 200
+
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job(job_id):
+    """
+    Поток Server-Sent Events с пролетами каждой готовой части фонового расчета. Последнее событие
+    (event: end) приходит, когда расчет завершен, отменен или завершился с ошибкой
+    """
+    job = job_queue.get(job_id, after=None)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+
+    def events():
+        after, state = 0, None
+        last_event = time.monotonic()
+        while True:
+            job = job_queue.get(job_id, after)
+            if job is None:
+                return
+
+            # Событие отправляется при каждом изменении состояния, пролеты в нем - только из новых частей
+            if (job['status'], job['chunks_done']) != state:
+                after, state = job['chunks_done'], (job['status'], job['chunks_done'])
+                last_event = time.monotonic()
+                yield f'data: {json.dumps(job)}\n\n'
+            elif time.monotonic() - last_event > STREAM_KEEPALIVE:
+                last_event = time.monotonic()
+                yield ': keep-alive\n\n'
+
+            if job['status'] not in ACTIVE_STATUSES:
+                yield 'event: end\ndata: {}\n\n'
+                return
+
+            # Расчеты этого процесса будят поток сразу, расчеты других процессов замечаются при следующем опросе
+            job_queue.wait(JOBS_STREAM_POLL)
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """
+    Отмена фонового расчета
+    """
+    job = job_queue.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'job not found'}), 404
+    return jsonify(job), 200
+
+
+@app.route('/api/passes/cache', methods=['GET'])
+def passes_cache_stats():
+    """
+    Счетчики попаданий и промахов кеша расписаний пролетов
+    """
+    return jsonify(passes_cache.stats()), 200
+
+
+def start_services():
+    """
+    Подключает базу данных и запускает пул процессов для тяжелых расчетов, очередь фоновых расчетов
+    и обновление расписаний. Вызывается при создании приложения, поэтому все это работает и под WSGI сервером,
+    а не только при запуске app.py
+    """
+    # Процессы пула, запущенные не через fork, заново импортируют app.py, и в них ничего запускать не нужно
+    if multiprocessing.parent_process() is not None:
+        return
+
+    os.makedirs('db', exist_ok=True)
+    db_session.global_init("db/orbitracker.db", pool_size=app.config['DB_POOL_SIZE'],
+                           max_overflow=app.config['DB_MAX_OVERFLOW'])
+    if app.config['PASSES_WORKERS']:
+        OrbCalculator.start_pool(app.config['PASSES_WORKERS'], app.config['PASSES_CHUNK_SIZE'])
+    job_queue.start()
+    if app.config['TIMETABLES_ENABLED']:
+        timetables.start()
 
-    return jsonify({'passes': passes}), 200
 
+start_services()
 
 if __name__ == '__main__':
-    db_session.global_init("db/orbitracker.db")
     app.run(host='0.0.0.0')
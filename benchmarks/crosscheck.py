@@ -0,0 +1,138 @@
+"""
+Сверка способов расчета положения (pyorbital и sgp4) на зафиксированном каталоге benchmarks/tle.txt:
+расхождение положений спутников, расхождение найденных пролетов и время расчета каждым способом.
+
+    python benchmarks/crosscheck.py
+    python benchmarks/crosscheck.py --hours 72 --max-error 0.01
+
+Завершается с кодом 1, если положения расходятся больше чем на max-error км,
+а время начала или конца пролетов - больше чем на max-time-error секунд. Границы пролетов находятся
+с точностью до целой секунды, поэтому сдвиг момента пересечения горизонта на микросекунды
+может изменить время на 1 с - такое расхождение допустимо
+"""
+import argparse
+import datetime as dt
+import os
+import sys
+import time
+import warnings
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TLE_FIXTURE = os.path.join(ROOT, 'benchmarks', 'tle.txt')
+
+# Начало сверки (через сутки после эпох TLE из benchmarks/tle.txt) и наблюдатель для сверки пролетов
+START_TIME = dt.datetime(2024, 4, 20, 12, 0, 0, tzinfo=dt.timezone.utc)
+OBSERVER = {'lat': 55.75, 'lon': 37.62, 'alt': 0.2}
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+warnings.simplefilter('ignore')
+
+from catalog import catalog  # noqa: E402
+from calculations import OrbCalculator, to_datetime64  # noqa: E402
+import propagators  # noqa: E402
+
+catalog.reload(TLE_FIXTURE)
+
+TIME_FORMAT = '%Y.%m.%d %H:%M:%S'
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def compare_positions(satellites: list, times: np.ndarray, backends: tuple) -> dict:
+    """
+    Наибольшее расхождение положений (км) каждого спутника между двумя способами расчета
+    """
+    results = []
+    for backend in backends:
+        propagators.set_propagator(backend)
+        positions, duration = timed(lambda: propagators.get_propagator().get_positions(satellites, times))
+        print(f'Положения {len(satellites)} спутников x {len(times)} моментов, {backend}: {duration * 1000:.1f} ms')
+        results.append(positions)
+
+    errors = np.linalg.norm(results[0] - results[1], axis=0).max(axis=1)
+    return dict(zip(satellites, errors.tolist()))
+
+
+def compare_passes(satellites: list, hours: int, backends: tuple) -> dict:
+    """
+    Сопоставляет пролеты, найденные двумя способами расчета: пролеты одного спутника сопоставляются
+    по порядку, и для них считается расхождение времени начала и конца (в секундах) и кульминации (в градусах)
+    """
+    results = []
+    for backend in backends:
+        propagators.set_propagator(backend)
+        passes, duration = timed(lambda: OrbCalculator.get_passes(
+            OBSERVER['lat'], OBSERVER['lon'], OBSERVER['alt'], 0, 0, START_TIME, hours, satellites=satellites))
+        print(f'Пролеты {len(satellites)} спутников за {hours} ч, {backend}: {duration * 1000:.1f} ms, '
+              f'найдено {len(passes)}')
+        by_satellite = {}
+        for data in passes:
+            by_satellite.setdefault(data[0], []).append(data)
+        results.append(by_satellite)
+
+    def seconds(first: str, second: str) -> float:
+        return abs((dt.datetime.strptime(first, TIME_FORMAT) - dt.datetime.strptime(second, TIME_FORMAT))
+                   .total_seconds())
+
+    report = {'mismatched_satellites': [], 'compared': 0, 'different': 0, 'max_time_error': 0.0,
+              'max_apogee_error': 0.0}
+    for satellite in set(results[0]) | set(results[1]):
+        first, second = results[0].get(satellite, []), results[1].get(satellite, [])
+        if len(first) != len(second):
+            report['mismatched_satellites'].append(satellite)
+            continue
+        for a, b in zip(first, second):
+            time_error = max(seconds(a[1], b[1]), seconds(a[2], b[2]))
+            report['compared'] += 1
+            report['different'] += time_error > 0
+            report['max_time_error'] = max(report['max_time_error'], time_error)
+            report['max_apogee_error'] = max(report['max_apogee_error'], abs(a[3] - b[3]))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка способов расчета положения спутников')
+    parser.add_argument('--hours', type=int, default=24, help='длительность сверки в часах')
+    parser.add_argument('--step', type=int, default=60, help='шаг сверки положений в секундах')
+    parser.add_argument('--max-error', type=float, default=0.01,
+                        help='допустимое расхождение положений в км (по умолчанию 0.01)')
+    parser.add_argument('--max-time-error', type=float, default=1,
+                        help='допустимое расхождение времени пролетов в секундах (по умолчанию 1)')
+    args = parser.parse_args()
+
+    backends = ('pyorbital', 'sgp4')
+    # Сравниваются только спутники, которые умеют расчитывать оба способа (sgp4 умеет все)
+    propagators.set_propagator('pyorbital')
+    satellites = [satellite for satellite in catalog.names if propagators.get_propagator().supports(satellite)]
+    times = to_datetime64(START_TIME) + np.arange(0, args.hours * 3600, args.step) * np.timedelta64(1, 's')
+
+    errors = compare_positions(satellites, times, backends)
+    worst = sorted(errors.items(), key=lambda item: item[1], reverse=True)
+    print(f'Расхождение положений: медиана {np.median(list(errors.values())) * 1000:.3f} м, '
+          f'наибольшее {worst[0][1] * 1000:.3f} м ({worst[0][0]})')
+
+    report = compare_passes(satellites, args.hours, backends)
+    print(f'Расхождение пролетов: время отличается у {report["different"]} из {report["compared"]}, '
+          f'до {report["max_time_error"]:g} с, '
+          f'кульминация до {report["max_apogee_error"]:g}°, '
+          f'разное количество пролетов у {len(report["mismatched_satellites"])} спутников')
+
+    failed = False
+    if worst[0][1] > args.max_error:
+        print(f'Положения расходятся больше чем на {args.max_error} км')
+        failed = True
+    if report['mismatched_satellites'] or report['max_time_error'] > args.max_time_error:
+        print(f'Пролеты расходятся: {", ".join(report["mismatched_satellites"]) or "время"}')
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Замеры скорости и памяти горячих путей: каталог TLE, расчет пролетов и маршруты с траекториями.
+Запускаются без сети на зафиксированном каталоге benchmarks/tle.txt и с зафиксированным текущим моментом,
+поэтому результаты разных запусков можно сравнивать между собой.
+
+    python benchmarks/run.py --save baseline.json
+    python benchmarks/run.py --compare baseline.json --threshold 0.15
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TLE_FIXTURE = os.path.join(ROOT, 'benchmarks', 'tle.txt')
+
+# Зафиксированный текущий момент (через сутки после эпох TLE из benchmarks/tle.txt)
+FIXED_NOW = datetime.datetime(2024, 4, 20, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+# Наблюдатель, для которого расчитываются пролеты и траектории
+OBSERVER = {'lat': 55.75, 'lon': 37.62, 'alt': 0.2}
+
+# Порог, выше которого замедление считается регрессией (0.1 - на 10%)
+DEFAULT_THRESHOLD = 0.1
+# Меньшие изменения считаются шумом независимо от порога: по времени (в секундах) и по памяти (в КиБ)
+NOISE_FLOOR = {'median': 0.0005, 'peak_kib': 64}
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+warnings.simplefilter('ignore')
+
+
+class FrozenDatetime(datetime.datetime):
+    """
+    datetime, у которого now() всегда возвращает FIXED_NOW
+    """
+
+    @classmethod
+    def now(cls, tz=None):
+        now = FIXED_NOW.astimezone(tz) if tz is not None else FIXED_NOW.replace(tzinfo=None)
+        return cls.combine(now.date(), now.timetz())
+
+
+datetime.datetime = FrozenDatetime
+
+from catalog import catalog, TleCatalog  # noqa: E402
+from calculations import OrbCalculator, SATELLITES, to_datetime64  # noqa: E402
+import propagators  # noqa: E402
+
+catalog.reload(TLE_FIXTURE)
+
+# Зарегистрированные замеры: [(название, функция), ...]
+BENCHMARKS = []
+
+
+def benchmark(name: str):
+    def register(function):
+        BENCHMARKS.append((name, function))
+        return function
+
+    return register
+
+
+@benchmark('catalog/load')
+def catalog_load():
+    TleCatalog(TLE_FIXTURE).snapshot()
+
+
+def passes_benchmark(duration: int, min_elevation: float, satellites: list):
+    def run():
+        OrbCalculator.get_passes(OBSERVER['lat'], OBSERVER['lon'], OBSERVER['alt'], min_elevation, 0, FIXED_NOW,
+                                 duration, satellites=satellites)
+
+    return run
+
+
+for _duration in (6, 24, 72):
+    for _min_elevation in (0, 20):
+        benchmark(f'passes/{_duration}h/elevation-{_min_elevation}')(
+            passes_benchmark(_duration, _min_elevation, SATELLITES))
+benchmark('passes/24h/catalog')(passes_benchmark(24, 0, catalog.names))
+
+
+def with_propagator(backend: str, function):
+    """
+    Замер function с другим способом расчета положения
+    """
+
+    def run():
+        previous = propagators.get_propagator().name
+        propagators.set_propagator(backend)
+        try:
+            function()
+        finally:
+            propagators.set_propagator(previous)
+
+    return run
+
+
+# Спутники, положение которых умеют расчитывать оба способа, и доступные способы расчета
+_near_earth = [satellite for satellite in catalog.names if propagators.PyorbitalPropagator().supports(satellite)]
+_backends = ('pyorbital', 'sgp4') if propagators.Satrec is not None else ('pyorbital',)
+
+
+def positions_benchmark(count: int, step: int):
+    times = to_datetime64(FIXED_NOW) + np.arange(count) * np.timedelta64(step, 's')
+
+    def run():
+        OrbCalculator.get_positions(_near_earth, times)
+
+    return run
+
+
+if 'sgp4' in _backends:
+    benchmark('passes/24h/catalog/sgp4')(with_propagator('sgp4', passes_benchmark(24, 0, catalog.names)))
+for _backend in _backends:
+    benchmark(f'positions/catalog/now/{_backend}')(with_propagator(_backend, positions_benchmark(1, 1)))
+    benchmark(f'positions/catalog/24h/{_backend}')(with_propagator(_backend, positions_benchmark(1440, 60)))
+
+
+def route_benchmark(url: str, method: str = 'get', json_body: dict = None, before=None):
+    def run():
+        if before is not None:
+            before()
+        response = getattr(client(), method)(url, json=json_body)
+        # Потоковые ответы читаются целиком, иначе расчет не выполняется
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f'{url}: {response.status_code}')
+
+    return run
+
+
+_client = None
+
+
+def client():
+    global _client
+    if _client is None:
+        import app as application
+        _client = application.app.test_client()
+    return _client
+
+
+def clear_passes_cache():
+    import app as application
+    application.passes_cache.clear()
+
+
+_observer = f"lat={OBSERVER['lat']}&lon={OBSERVER['lon']}&alt={OBSERVER['alt']}"
+_pass = f"satellite=NOAA 19&start=2024.04.20 12:00:00&end=2024.04.20 12:15:00&{_observer}"
+
+ROUTES = {
+    'route/object': ('/object/NOAA 19',),
+    'route/api-coords': ('/api/coords?sat=NOAA 19',),
+    'route/api-coords-bulk': (f'/api/coords/bulk?sat={",".join(SATELLITES)}'
+                              '&start=2024-04-20 12:00:00&end=2024-04-20 18:00:00&step=10',),
+    'route/api-trajectory': (f'/api/trajectory?sat=NOAA 19&{_observer}',),
+    'route/download-trajectory/tsv': (f'/download-trajectory?{_pass}',),
+    'route/download-trajectory/npy': (f'/download-trajectory?{_pass}&step=0.1&format=npy',),
+    'route/make-pass-trajectory': (f'/make-pass-trajectory?{_pass}',),
+    'route/api-passes': (f'/api/passes?{_observer}&time=2024-04-20 12:00:00&duration=24', 'get', None,
+                         clear_passes_cache),
+}
+
+for _name, _route in ROUTES.items():
+    benchmark(_name)(route_benchmark(*_route))
+
+
+def measure(function, repeat: int) -> dict:
+    """
+    Время выполнения (минимум и медиана из repeat запусков после одного прогревочного)
+    и пиковый объем памяти, выделенной за один запуск
+    """
+    function()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'min': min(times), 'median': statistics.median(times), 'peak_kib': round(peak / 1024, 1)}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    :returns: [(название, показатель, было, стало), ...] - показатели, выросшие больше чем на threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('median', 'peak_kib'):
+            if result[metric] > previous[metric] * (1 + threshold) and \
+                    result[metric] - previous[metric] > NOISE_FLOOR[metric]:
+                regressions.append((name, metric, previous[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры скорости и памяти Orbitracker')
+    parser.add_argument('--filter', default='', help='запускать только замеры, в названии которых есть строка')
+    parser.add_argument('--repeat', type=int, default=5, help='количество запусков каждого замера')
+    parser.add_argument('--save', help='сохранить результаты в JSON файл')
+    parser.add_argument('--compare', help='сравнить с результатами из JSON файла')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='допустимое относительное ухудшение (по умолчанию 0.1)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+
+    print(f'{"":40} {"минимум":>13} {"медиана":>13} {"память":>16}')
+    results = {}
+    for name, function in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        results[name] = measure(function, args.repeat)
+
+        result = results[name]
+        line = f'{name:40} {result["min"] * 1000:10.2f} ms {result["median"] * 1000:10.2f} ms ' \
+               f'{result["peak_kib"]:12.1f} KiB'
+        if baseline and name in baseline:
+            line += f' {result["median"] / baseline[name]["median"] - 1:+8.1%}'
+        print(line, flush=True)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'now': FIXED_NOW.isoformat(), 'repeat': args.repeat, 'results': results},
+                      file, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, metric, before, after in regressions:
+            print(f'Регрессия {name} ({metric}): {before:.4g} -> {after:.4g}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    """
+    Потокобезопасный кеш с ограниченным количеством записей, вытесняющий давно не использованные.
+    Если указан ttl, записи старше ttl секунд считаются устаревшими
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None or self._is_expired(item[0], now):
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self) -> list:
+        """
+        Список неустаревших записей [(key, value), ...], начиная с давно не использованных
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (created_at, value) in self._data.items()
+                    if not self._is_expired(created_at, now)]
+
+    def touch(self, key):
+        """
+        Отмечает запись как недавно использованную (например, если она была найдена через items())
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0}
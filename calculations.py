@@ -1,9 +1,144 @@
-from pyorbital.orbital import Orbital
+from catalog import catalog
+import metrics
+import propagators
+import visibility
+from propagators import to_datetime64, eci_to_lonlatalt
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait
 import datetime as dt
+import numpy as np
+from pyorbital import astronomy
+from scipy import optimize
 import math
+import time
 
 SATELLITES = ['METEOR-M2 2', 'METEOR-M2 3', 'NOAA 18', 'NOAA 19', 'METOP-B', 'METOP-C']
 
+# Точность (в секундах), с которой уточняются границы пролета по минимальной элевации
+PASS_BOUNDARY_TOLERANCE = 0.5
+
+# Сколько спутников отдается одному процессу пула за раз
+PASSES_CHUNK_SIZE = 8
+
+# Сколько точек траектории расчитывается за один вызов при потоковой выгрузке
+TRAJECTORY_CHUNK_SIZE = 3600
+
+# Как часто (в секундах) при ожидании пула проверяется, не пора ли прервать расчет
+ABORT_CHECK_INTERVAL = 0.1
+
+# Траектория спутника в виде столбцов: моменты времени (np.datetime64, UTC), абсолютные координаты
+# и координаты на небе относительно наблюдателя (None, если наблюдатель не указан)
+Trajectory = namedtuple('Trajectory', ['times', 'lon', 'lat', 'alt', 'azimuth', 'elevation'])
+
+
+class CalculationCancelled(Exception):
+    """
+    Расчет прерван, потому что его результат больше не нужен (например, клиент отключился)
+    """
+
+
+class CalculationTimeout(Exception):
+    """
+    Расчет прерван, потому что истекло отведенное на него время
+    """
+
+
+def check_abort(deadline: float = None, cancelled=None):
+    """
+    Бросает CalculationTimeout, если наступил deadline (по time.monotonic), или CalculationCancelled,
+    если cancelled() вернул True
+    """
+    if deadline is not None and time.monotonic() > deadline:
+        raise CalculationTimeout('Время расчета истекло')
+    if cancelled is not None and cancelled():
+        raise CalculationCancelled()
+
+
+def observers_elevation(positions: np.ndarray, times: np.ndarray, lons: np.ndarray, lats: np.ndarray,
+                        alts: np.ndarray) -> np.ndarray:
+    """
+    Элевация спутника для нескольких наблюдателей, те же вычисления, что и в Orbital.get_observer_look.
+    positions - положения спутника (3, моменты) в км, lons, lats, alts - столбцы (наблюдатели, 1)
+    :returns: массив (наблюдатели, моменты) в градусах
+    """
+    pos_x, pos_y, pos_z = positions
+    (opos_x, opos_y, opos_z), _ = astronomy.observer_position(times, lons, lats, alts)
+
+    lons = np.deg2rad(lons)
+    lats = np.deg2rad(lats)
+
+    theta = (astronomy.gmst(times) + lons) % (2 * np.pi)
+
+    rx = pos_x - opos_x
+    ry = pos_y - opos_y
+    rz = pos_z - opos_z
+
+    top_z = np.cos(lats) * np.cos(theta) * rx + np.cos(lats) * np.sin(theta) * ry + np.sin(lats) * rz
+    rg = np.sqrt(rx * rx + ry * ry + rz * rz)
+
+    return np.rad2deg(np.arcsin(top_z / rg))
+
+
+def find_passes(orb, elevations: np.ndarray, start_time: dt.datetime, lon: float, lat: float, alt: float,
+                tol: float = 0.001) -> list:
+    """
+    Поиск пролетов по уже расчитанной поминутной элевации, так же как в Orbital.get_next_passes
+    :returns: [(rise_time, fall_time, max_elevation_time), ...]
+    """
+
+    def elevation(minutes):
+        return orb.get_observer_look(start_time + dt.timedelta(minutes=np.float64(minutes)), lon, lat, alt)[1]
+
+    passes = []
+    rise_time = rise_minutes = None
+
+    for guess in np.where(np.diff(np.sign(elevations)))[0]:
+        horizon_minutes = optimize.brentq(elevation, guess, guess + 1.0)
+        horizon_time = start_time + dt.timedelta(minutes=horizon_minutes)
+
+        if elevations[guess] < 0:
+            rise_time, rise_minutes = horizon_time, horizon_minutes
+            continue
+
+        if rise_time:
+            interval_start = max(0, int(np.floor(rise_minutes)))
+            interval_end = min(len(elevations), int(np.ceil(horizon_minutes) + 1))
+            middle = interval_start + np.argmax(elevations[interval_start:interval_end])
+
+            highest = max_parabolic(elevation, max(rise_minutes, middle - 1), min(horizon_minutes, middle + 1),
+                                    tol / 60.0)
+            passes.append((rise_time, horizon_time, start_time + dt.timedelta(minutes=highest)))
+        rise_time = None
+
+    return passes
+
+
+def max_parabolic(fun, start: float, end: float, tol: float) -> float:
+    """
+    Поиск максимума последовательной параболической интерполяцией, как в Orbital.get_next_passes
+    """
+    a, c = float(start), float(end)
+    b = (a + c) / 2.0
+    f_a, f_b, f_c = -fun(a), -fun(b), -fun(c)
+
+    x = b
+    with np.errstate(invalid='raise'):
+        while True:
+            try:
+                x = x - 0.5 * (((b - a) ** 2 * (f_b - f_c) - (b - c) ** 2 * (f_b - f_a)) /
+                               ((b - a) * (f_b - f_c) - (b - c) * (f_b - f_a)))
+            except FloatingPointError:
+                return b
+            if abs(b - x) <= tol:
+                return x
+            f_x = -fun(x)
+            # Если приближение расходится, возвращаем лучшее найденное
+            if f_x > f_b:
+                return b
+
+            a, b, c = (a + x) / 2.0, x, (x + c) / 2.0
+            f_a, f_b, f_c = -fun(a), f_x, -fun(c)
+
 
 class OrbCalculator:
     """
@@ -11,67 +146,343 @@ class OrbCalculator:
     """
 
     @staticmethod
-    def get_passes(lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
-                   start_time: dt.datetime, duration: int):
+    def get_trajectory(satellite: str, start_time: dt.datetime, end_time: dt.datetime, step: float,
+                       lon: float = None, lat: float = None, alt: float = None,
+                       absolute: bool = True) -> Trajectory:
         """
-        Возвращает расписание всех пролетающих спутников в указзаном месте в указанное время
-        :returns: [[satellite_name, start_time, end_time, apogee, does_overlap], ...]
-        :rtype: list[list[str, str, str, float, bool]]
+        Расчитывает траекторию спутника на промежутке [start_time, end_time) с шагом step секунд
+        одним векторизованным вызовом. Если указаны координаты наблюдателя, то расчитываются
+        также азимут и элевация спутника. При absolute=False абсолютные координаты не расчитываются
         """
+        step = np.timedelta64(round(step * 1e6), 'us')
+        times = np.arange(to_datetime64(start_time), to_datetime64(end_time), step)
 
-        def sort_by_min_apogee(datetimes):
-            start, end, max_elevation = datetimes
-            azimuth, elevation = orb.get_observer_look(max_elevation, lon, lat, alt)
-            return elevation >= min_apogee
+        orb = propagators.get_orbital(satellite)
 
-        def map_by_min_elevation(datetimes):
-            start, end, max_elevation = datetimes
-            mapped_start, mapped_end = start, end
+        satellite_lon = satellite_lat = satellite_alt = None
+        if absolute:
+            satellite_lon, satellite_lat, satellite_alt = orb.get_lonlatalt(times)
 
-            for shift in range((max_elevation - start).seconds):
-                elevation = orb.get_observer_look(start + dt.timedelta(seconds=shift), lon, lat, alt)[1]
+        azimuth = elevation = None
+        if lon is not None and lat is not None:
+            azimuth, elevation = orb.get_observer_look(times, lon, lat, alt or 0)
 
-                if math.floor(elevation) >= min_elevation:
-                    mapped_start = start + dt.timedelta(seconds=shift)
-                    break
+        return Trajectory(times, satellite_lon, satellite_lat, satellite_alt, azimuth, elevation)
 
-            for shift in range((end - max_elevation).seconds):
-                elevation = orb.get_observer_look(end - dt.timedelta(seconds=shift), lon, lat, alt)[1]
+    @staticmethod
+    def get_positions(satellites: list, times: np.ndarray) -> dict:
+        """
+        Абсолютные координаты нескольких спутников в моменты times (np.datetime64, UTC): с pyorbital -
+        по одному векторизованному вызову на спутник, с sgp4 - одним вызовом на все спутники
+        :returns: {satellite_name: (lon, lat, alt), ...}
+        """
+        positions = propagators.get_propagator().get_positions(satellites, times)
+        lon, lat, alt = eci_to_lonlatalt(times, positions)
+        return {satellite: (lon[i], lat[i], alt[i]) for i, satellite in enumerate(satellites)}
 
-                if math.floor(elevation) >= min_elevation:
-                    mapped_end = end - dt.timedelta(seconds=shift)
-                    break
+    @staticmethod
+    def iter_trajectory(satellite: str, start_time: dt.datetime, end_time: dt.datetime, step: float,
+                        lon: float = None, lat: float = None, alt: float = None, absolute: bool = True,
+                        chunk_size: int = TRAJECTORY_CHUNK_SIZE):
+        """
+        То же, что и get_trajectory, но расчитывает траекторию частями по chunk_size точек,
+        чтобы длинные траектории не приходилось целиком держать в памяти
+        :returns: генератор Trajectory
+        """
+        start = to_datetime64(start_time)
+        end = to_datetime64(end_time)
+        chunk = np.timedelta64(round(step * 1e6), 'us') * chunk_size
 
-            return mapped_start, mapped_end, max_elevation
+        while start < end:
+            chunk_end = min(start + chunk, end)
+            yield OrbCalculator.get_trajectory(satellite, start, chunk_end, step, lon, lat, alt, absolute)
+            start = chunk_end
 
-        def prepare_data(data):
-            name, start_time, end_time, max_elevation_time = data
-            start_time = start_time.strftime('%Y.%m.%d %H:%M:%S')
-            end_time = end_time.strftime('%Y.%m.%d %H:%M:%S')
-            apogee = Orbital(name, 'tle.txt').get_observer_look(max_elevation_time, lon, lat, alt)[1]
-            return name, start_time, end_time, round(apogee, 2)
+    # Пул процессов для тяжелых расчетов, запускается один раз при создании приложения
+    _pool = None
+    _chunk_size = PASSES_CHUNK_SIZE
 
-        all_passes = []
+    @staticmethod
+    def start_pool(workers: int = None, chunk_size: int = PASSES_CHUNK_SIZE):
+        """
+        Запускает пул процессов, по которому распределяются спутники при расчете пролетов.
+        workers - количество процессов (по умолчанию по числу ядер),
+        chunk_size - сколько спутников обрабатывается одним заданием.
+        Процессы пула расчитывают положение тем же способом, что и текущий процесс
+        """
+        if OrbCalculator._pool is None:
+            OrbCalculator._pool = ProcessPoolExecutor(max_workers=workers, initializer=propagators.set_propagator,
+                                                      initargs=(propagators.get_propagator().name,))
+            OrbCalculator._chunk_size = chunk_size
+            # Процессы запускаются сразу, а не при первом расчете, когда у приложения уже работают другие потоки
+            OrbCalculator._pool.submit(int).result()
 
-        for satellite in SATELLITES:
-            orb = Orbital(satellite, 'tle.txt')
-            passes = orb.get_next_passes(start_time, duration, lon, lat, alt)
+    @staticmethod
+    def stop_pool():
+        if OrbCalculator._pool is not None:
+            OrbCalculator._pool.shutdown()
+            OrbCalculator._pool = None
 
-            # Убираем пролеты с апогеем ниже указанного
-            passes = filter(sort_by_min_apogee, passes)
+    @staticmethod
+    def run_chunks(function, satellites: list, params: tuple, deadline: float = None, cancelled=None) -> list:
+        """
+        Выполняет function(спутники, params) по частям списка спутников: в пуле процессов, если он запущен,
+        иначе в текущем потоке. Пока части выполняются, проверяется, не наступил ли
+        deadline (по time.monotonic) и не вернул ли cancelled() True. В этом случае невыполненные части
+        отменяются и бросается CalculationTimeout или CalculationCancelled
+        :returns: результаты частей в порядке спутников
+        """
 
-            # Убираем из пролета части, где элевация меньше чем min_elevation
-            passes = map(map_by_min_elevation, passes)
+        pool, chunk_size = OrbCalculator._pool, OrbCalculator._chunk_size
+        if pool is None:
+            # Способ расчета, считающий спутники массивами, получает их частями, остальные - по одному
+            if not propagators.get_propagator().vectorized:
+                chunk_size = 1
+            results = []
+            for i in range(0, len(satellites), chunk_size):
+                check_abort(deadline, cancelled)
+                results.append(function(satellites[i:i + chunk_size], params))
+            return results
+
+        futures = [pool.submit(function, satellites[i:i + chunk_size], params)
+                   for i in range(0, len(satellites), chunk_size)]
+        return OrbCalculator._wait(futures, deadline, cancelled)
 
-            # Добавляем к информации о пролете название спутника
-            for i in passes:
-                all_passes.append([satellite, *i])
+    @staticmethod
+    def run(function, *args, deadline: float = None, cancelled=None, **kwargs):
+        """
+        Выполняет function(*args, deadline=deadline, cancelled=cancelled, **kwargs) одним заданием в пуле
+        процессов, если он запущен, иначе в текущем потоке. Поток, вызвавший run, в это время только ждет
+        результат и прерывает ожидание так же, как run_chunks. Функцию cancelled нельзя передать в процесс пула,
+        поэтому там задание прерывается только по deadline (time.monotonic общее для всех процессов)
+        """
+        pool = OrbCalculator._pool
+        if pool is None:
+            return function(*args, deadline=deadline, cancelled=cancelled, **kwargs)
+        return OrbCalculator._wait([pool.submit(function, *args, deadline=deadline, **kwargs)],
+                                   deadline, cancelled)[0]
+
+    @staticmethod
+    def _wait(futures: list, deadline: float = None, cancelled=None) -> list:
+        try:
+            pending = futures
+            while pending:
+                check_abort(deadline, cancelled)
+                _, pending = wait(pending, timeout=ABORT_CHECK_INTERVAL)
+            # Результаты собираются в порядке заданий, то есть в том же порядке, что и без пула
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    @staticmethod
+    def get_passes(lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
+                   start_time: dt.datetime, duration: int, tolerance: float = PASS_BOUNDARY_TOLERANCE,
+                   satellites: list = None, deadline: float = None, cancelled=None, prefilter: bool = True):
+        """
+        Возвращает расписание всех пролетающих спутников в указзаном месте в указанное время.
+        tolerance - точность (в секундах), с которой ищется момент достижения min_elevation,
+        satellites - список спутников (по умолчанию SATELLITES). Если запущен пул процессов,
+        спутники распределяются по нему, результат при этом совпадает с последовательным расчетом.
+        deadline и cancelled позволяют прервать расчет, см. run_chunks. prefilter - заранее отбросить
+        спутники, которые не могут быть видны с широты наблюдателя (см. visibility.prefilter).
+        Пересечения пролетов и план их сопровождения строятся в scheduling.make_schedule
+        :returns: [(satellite_name, start_time, end_time, apogee), ...]
+        :rtype: list[tuple[str, str, str, float]]
+        """
+        if satellites is None:
+            satellites = SATELLITES
+        if prefilter:
+            satellites, _ = visibility.prefilter(catalog.get_orbit_bounds(), satellites, lat, min_apogee)
+
+        params = (lat, lon, alt, min_elevation, min_apogee, start_time, duration, tolerance)
+
+        results = OrbCalculator.run_chunks(OrbCalculator.get_satellites_passes, satellites, params, deadline, cancelled)
+        all_passes = [data for chunk_passes in results for data in chunk_passes]
 
         # Сортируем пролеты по времени начала
         all_passes.sort(key=lambda data: data[1])
 
         # Переводим все данные в более удобный для чтения формат
-        all_passes = list(map(prepare_data, all_passes))
+        return [(name, start.strftime('%Y.%m.%d %H:%M:%S'), end.strftime('%Y.%m.%d %H:%M:%S'), round(apogee, 2))
+                for name, start, end, apogee in all_passes]
+
+    @staticmethod
+    def get_satellites_passes(satellites: list, params: tuple) -> list:
+        """
+        Расчитывает пролеты нескольких спутников, params - параметры наблюдения в том же порядке,
+        что и в get_passes. Выполняется в том числе в процессах пула
+        :returns: [[satellite_name, start_time, end_time, apogee], ...]
+        """
+        lat, lon, alt, min_elevation, min_apogee, start_time, duration, tolerance = params
+
+        # Если положение спутников расчитывается массивами, поминутная элевация всех спутников расчитывается
+        # одним вызовом, как для сети станций из одной станции
+        if propagators.get_propagator().vectorized:
+            observers = np.array([[lat, lon, alt]], dtype=float)
+            network_params = (observers, min_elevation, min_apogee, start_time, duration, tolerance)
+            return OrbCalculator.get_network_satellites_passes(satellites, network_params)[0]
+
+        all_passes = []
+
+        for satellite in satellites:
+            try:
+                orb = propagators.get_orbital(satellite)
+            except NotImplementedError:
+                # pyorbital не умеет расчитывать орбиты дальнего космоса (например, геостационарные),
+                # такие спутники все равно не восходят и не заходят за горизонт
+                continue
+
+            with metrics.timed('passes.search'):
+                passes = orb.get_next_passes(start_time, duration, lon, lat, alt)
+            with metrics.timed('passes.refine'):
+                all_passes += OrbCalculator.filter_passes(orb, satellite, passes, lat, lon, alt,
+                                                          min_elevation, min_apogee, tolerance)
 
         return all_passes
 
+    @staticmethod
+    def filter_passes(orb, satellite: str, passes: list, lat: float, lon: float, alt: float,
+                      min_elevation: float, min_apogee: float, tolerance: float) -> list:
+        """
+        Отбрасывает пролеты с кульминацией ниже min_apogee и обрезает у остальных части,
+        где элевация меньше min_elevation
+        :param passes: [(rise_time, fall_time, max_elevation_time), ...], как у Orbital.get_next_passes
+        :returns: [[satellite_name, start_time, end_time, apogee], ...]
+        """
+
+        # math.floor(elevation) >= min_elevation выполняется тогда и только тогда, когда elevation >= threshold
+        threshold = math.ceil(min_elevation)
+
+        def first_second_above(time_at, length):
+            """
+            Находит первую целую секунду shift из [0, length), в которую элевация спутника
+            в момент time_at(shift) не меньше threshold. На промежутке [0, length] элевация
+            должна возрастать, поэтому момент пересечения ищется методом Брента
+            """
+
+            def excess(shift):
+                return orb.get_observer_look(time_at(shift), lon, lat, alt)[1] - threshold
+
+            if int(length) <= 0:
+                return None
+            if excess(0) >= 0:
+                return 0
+            if excess(length) < 0:
+                return None
+
+            shift = math.ceil(optimize.brentq(excess, 0, length, xtol=tolerance))
+
+            # Доводим найденный корень до целой секунды, как при посекундном переборе
+            while shift > 0 and excess(shift - 1) >= 0:
+                shift -= 1
+            while shift < length and excess(shift) < 0:
+                shift += 1
+
+            return shift if shift < int(length) else None
+
+        def map_by_min_elevation(datetimes):
+            start, end, max_elevation = datetimes
+            mapped_start, mapped_end = start, end
+
+            shift = first_second_above(lambda shift: start + dt.timedelta(seconds=shift),
+                                       (max_elevation - start).total_seconds())
+            if shift is not None:
+                mapped_start = start + dt.timedelta(seconds=shift)
+
+            shift = first_second_above(lambda shift: end - dt.timedelta(seconds=shift),
+                                       (end - max_elevation).total_seconds())
+            if shift is not None:
+                mapped_end = end - dt.timedelta(seconds=shift)
+
+            return mapped_start, mapped_end, max_elevation
+
+        filtered_passes = []
+
+        for start, end, max_elevation in passes:
+            apogee = orb.get_observer_look(max_elevation, lon, lat, alt)[1]
+
+            # Убираем пролеты с апогеем ниже указанного
+            if apogee < min_apogee:
+                continue
+
+            # Убираем из пролета части, где элевация меньше чем min_elevation
+            start, end, max_elevation = map_by_min_elevation((start, end, max_elevation))
+
+            filtered_passes.append([satellite, start, end, apogee])
+
+        return filtered_passes
+
+    @staticmethod
+    def get_network_passes(observers: list, min_elevation: float, min_apogee: float, start_time: dt.datetime,
+                           duration: int, tolerance: float = PASS_BOUNDARY_TOLERANCE, satellites: list = None,
+                           deadline: float = None, cancelled=None, prefilter: bool = True):
+        """
+        Возвращает расписания пролетов сразу для нескольких точек наблюдения (сети наземных станций).
+        Положение каждого спутника расчитывается один раз на всё окно, а элевация для всех станций -
+        одним векторизованным вызовом, поэтому время расчета почти не зависит от количества станций.
+        Поиск пролетов повторяет Orbital.get_next_passes. deadline, cancelled и prefilter - как в get_passes,
+        спутник отбрасывается, только если он не виден ни с одной станции
+        :param observers: [(lat, lon, alt), ...]
+        :returns: [[[satellite_name, start_time, end_time, apogee], ...], ...] - по списку на каждую станцию
+        """
+        if satellites is None:
+            satellites = SATELLITES
+
+        observers = np.array(observers, dtype=float).reshape(-1, 3)
+        if prefilter:
+            satellites, _ = visibility.prefilter(catalog.get_orbit_bounds(), satellites, observers[:, 0], min_apogee)
+        params = (observers, min_elevation, min_apogee, start_time, duration, tolerance)
+
+        results = OrbCalculator.run_chunks(OrbCalculator.get_network_satellites_passes, satellites, params,
+                                           deadline, cancelled)
+
+        result = []
+        for i in range(len(observers)):
+            passes = [data for chunk_passes in results for data in chunk_passes[i]]
+            passes.sort(key=lambda data: data[1])
+            result.append([(name, start.strftime('%Y.%m.%d %H:%M:%S'), end.strftime('%Y.%m.%d %H:%M:%S'),
+                            round(apogee, 2)) for name, start, end, apogee in passes])
+        return result
+
+    @staticmethod
+    def get_network_satellites_passes(satellites: list, params: tuple) -> list:
+        """
+        Расчитывает пролеты нескольких спутников для всех станций, params - параметры в том же порядке,
+        что и в get_network_passes. Выполняется в том числе в процессах пула
+        :returns: [[[satellite_name, start_time, end_time, apogee], ...], ...] - по списку на каждую станцию
+        """
+        observers, min_elevation, min_apogee, start_time, duration, tolerance = params
+
+        # Столбцы (станции, 1), чтобы расчеты транслировались на сетку (станции, моменты времени)
+        lats, lons, alts = (observers[:, i, np.newaxis] for i in range(3))
+
+        # Сетка с шагом в минуту, как в Orbital.get_next_passes
+        times = to_datetime64(start_time) + np.arange(duration * 60) * np.timedelta64(1, 'm')
+
+        stations_passes = [[] for _ in observers]
+
+        # Положения всех спутников на сетке - одним вызовом, если способ расчета это умеет
+        propagator = propagators.get_propagator()
+        satellites = [satellite for satellite in satellites if propagator.supports(satellite)]
+        with metrics.timed('passes.search'):
+            all_positions = propagator.get_positions(satellites, times)
+
+        for j, satellite in enumerate(satellites):
+            positions = all_positions[:, j]
+            # Спутник, положение которого не расчитывается (например, сошедший с орбиты), пропускаем
+            if not np.all(np.isfinite(positions)):
+                continue
+            orb = propagator.get_orbital(satellite)
+
+            with metrics.timed('passes.search'):
+                elevations = observers_elevation(positions, times, lons, lats, alts)
+
+            for i, (lat, lon, alt) in enumerate(observers.tolist()):
+                with metrics.timed('passes.search'):
+                    passes = find_passes(orb, elevations[i], start_time, lon, lat, alt)
+                with metrics.timed('passes.refine'):
+                    stations_passes[i] += OrbCalculator.filter_passes(orb, satellite, passes, lat, lon, alt,
+                                                                      min_elevation, min_apogee, tolerance)
+
+        return stations_passes
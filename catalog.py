@@ -0,0 +1,212 @@
+import datetime as dt
+import os
+import threading
+import time
+from collections import namedtuple
+from pyorbital.orbital import Orbital
+from search import SearchIndex
+from visibility import OrbitBounds
+
+TLE_FILE = 'tle.txt'
+
+# Как часто (в секундах) проверять, не изменился ли файл с TLE
+CHECK_INTERVAL = 1.0
+
+TleRecord = namedtuple('TleRecord', ['name', 'norad_id', 'intl_designator', 'line1', 'line2', 'epoch'])
+
+
+def parse_epoch(line1: str) -> dt.datetime:
+    """
+    Достает эпоху TLE из первой строки элементов
+    """
+    year = int(line1[18:20])
+    year += 2000 if year < 57 else 1900
+    day = float(line1[20:32])
+    return dt.datetime(year, 1, 1, tzinfo=dt.timezone.utc) + dt.timedelta(days=day - 1)
+
+
+def parse_tle(text: str) -> list:
+    """
+    Разбирает текст в формате трехстрочных TLE
+    :returns: [TleRecord, ...] в порядке следования в файле
+    """
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+    records = []
+
+    for i in range(0, len(lines) - 2, 3):
+        name, line1, line2 = lines[i].strip(), lines[i + 1].strip(), lines[i + 2].strip()
+
+        if not line1.startswith('1 ') or not line2.startswith('2 '):
+            raise ValueError(f'Неверный формат TLE для "{name}"')
+
+        records.append(TleRecord(
+            name=name.upper(),
+            norad_id=line1[2:7].strip(),
+            intl_designator=line1[9:17].strip(),
+            line1=line1,
+            line2=line2,
+            epoch=parse_epoch(line1),
+        ))
+
+    return records
+
+
+class _Snapshot:
+    """
+    Неизменяемый срез каталога, который полностью заменяется при перезагрузке файла
+    """
+
+    def __init__(self, records: list, mtime: int):
+        self.records = records
+        self.mtime = mtime
+        self.by_name = {record.name: record for record in records}
+        self.by_norad_id = {record.norad_id.lstrip('0'): record for record in records}
+        self.epoch = max((record.epoch for record in records), default=None)
+        self.version = f'{self.epoch.strftime("%Y%m%d%H%M%S") if self.epoch else "0"}-{mtime}'
+        # Объекты Orbital создаются лениво, при первом обращении к спутнику
+        self.orbitals = {}
+        # Поисковый индекс и границы орбит строятся при первом обращении
+        self.search_index = None
+        self.orbit_bounds = None
+
+
+class TleCatalog:
+    """
+    Каталог TLE, который один раз читает файл и хранит его в памяти,
+    перечитывая только при изменении времени модификации файла
+    """
+
+    def __init__(self, tle_file: str = TLE_FILE, check_interval: float = CHECK_INTERVAL):
+        self.tle_file = tle_file
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+
+    def _load(self) -> _Snapshot:
+        mtime = os.stat(self.tle_file).st_mtime_ns
+        with open(self.tle_file, encoding='utf-8') as file:
+            records = parse_tle(file.read())
+        return _Snapshot(records, mtime)
+
+    def snapshot(self) -> _Snapshot:
+        """
+        Возвращает актуальный срез каталога, при необходимости перечитывая файл
+        """
+        snapshot = self._snapshot
+        now = time.monotonic()
+
+        if snapshot is not None and now - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            self._checked_at = now
+
+            try:
+                mtime = os.stat(self.tle_file).st_mtime_ns
+            except OSError:
+                if snapshot is None:
+                    raise
+                # Файл временно недоступен (например, его перезаписывают), продолжаем работать со старыми данными
+                return snapshot
+
+            if snapshot is None or snapshot.mtime != mtime:
+                snapshot = self._snapshot = self._load()
+
+        return snapshot
+
+    def reload(self, tle_file: str = None) -> _Snapshot:
+        """
+        Сразу перечитывает каталог, при необходимости из другого файла
+        """
+        with self._lock:
+            if tle_file is not None:
+                self.tle_file = tle_file
+            self._snapshot = self._load()
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    @staticmethod
+    def _find(snapshot: _Snapshot, satellite: str) -> TleRecord:
+        key = str(satellite).strip().upper()
+
+        record = snapshot.by_name.get(key) or snapshot.by_norad_id.get(key.lstrip('0'))
+        if record is None:
+            raise KeyError(f"Found no TLE entry for '{key}'")
+        return record
+
+    def get_record(self, satellite: str) -> TleRecord:
+        """
+        Ищет спутник по названию или по номеру NORAD
+        """
+        return self._find(self.snapshot(), satellite)
+
+    def get_orbital(self, satellite: str) -> Orbital:
+        """
+        Возвращает готовый объект Orbital для спутника
+        """
+        snapshot = self.snapshot()
+        record = self._find(snapshot, satellite)
+
+        orb = snapshot.orbitals.get(record.name)
+        if orb is None:
+            orb = Orbital(record.name, line1=record.line1, line2=record.line2)
+            snapshot.orbitals[record.name] = orb
+        return orb
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        Ищет спутники по названию, номеру NORAD или международному обозначению
+        :returns: [TleRecord, ...] - лучшие совпадения первыми
+        """
+        snapshot = self.snapshot()
+
+        if snapshot.search_index is None:
+            with self._index_lock:
+                if snapshot.search_index is None:
+                    snapshot.search_index = SearchIndex(snapshot.records)
+
+        return snapshot.search_index.search(query, limit)
+
+    def get_orbit_bounds(self) -> OrbitBounds:
+        """
+        Наклонения и наибольшие радиусы орбит всех спутников каталога для visibility.prefilter
+        """
+        snapshot = self.snapshot()
+
+        if snapshot.orbit_bounds is None:
+            with self._index_lock:
+                if snapshot.orbit_bounds is None:
+                    snapshot.orbit_bounds = OrbitBounds(snapshot.records)
+
+        return snapshot.orbit_bounds
+
+    @property
+    def names(self) -> list:
+        """
+        Названия всех спутников в порядке следования в файле
+        """
+        return [record.name for record in self.snapshot().records]
+
+    @property
+    def records(self) -> list:
+        return self.snapshot().records
+
+    @property
+    def epoch(self) -> dt.datetime:
+        """
+        Самая свежая эпоха TLE в каталоге
+        """
+        return self.snapshot().epoch
+
+    @property
+    def version(self) -> str:
+        """
+        Строка, однозначно определяющая текущее содержимое каталога, для использования в ключах кешей
+        """
+        return self.snapshot().version
+
+
+catalog = TleCatalog()
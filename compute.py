@@ -0,0 +1,90 @@
+from contextlib import contextmanager
+import socket
+import threading
+import time
+
+# Сколько тяжелых расчетов может выполняться одновременно, ограничение времени одного расчета (в секундах)
+# и бюджет одного запроса в спутнико-часах (количество спутников x длительность в часах x количество станций)
+COMPUTE_MAX_RUNNING = 4
+COMPUTE_TIMEOUT = 60
+COMPUTE_BUDGET = 5000
+
+
+class BudgetExceeded(Exception):
+    """
+    Запрос требует больше расчетов, чем разрешено одному запросу
+    """
+
+
+class Overloaded(Exception):
+    """
+    Все места для тяжелых расчетов заняты
+    """
+
+
+class ComputeLimiter:
+    """
+    Ограничивает тяжелые расчеты: запрос дороже budget отклоняется сразу, одновременно выполняется
+    не больше max_running расчетов (остальные сразу получают отказ, а не ждут в очереди, занимая поток сервера),
+    а на каждый расчет отводится не больше timeout секунд
+    """
+
+    def __init__(self, max_running: int = COMPUTE_MAX_RUNNING, timeout: float = COMPUTE_TIMEOUT,
+                 budget: float = COMPUTE_BUDGET):
+        self.max_running = max_running
+        self.timeout = timeout
+        self.budget = budget
+        self.running = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_running)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, cost: float):
+        """
+        Занимает место для расчета стоимостью cost спутнико-часов
+        :returns: deadline расчета по time.monotonic
+        """
+        if cost > self.budget:
+            raise BudgetExceeded(f'Стоимость расчета {cost:g} больше допустимой {self.budget:g}')
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded()
+
+        with self._lock:
+            self.running += 1
+        try:
+            yield time.monotonic() + self.timeout
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {'running': self.running, 'max_running': self.max_running, 'rejected': self.rejected,
+                'timeout': self.timeout, 'budget': self.budget}
+
+
+def disconnect_checker(environ: dict):
+    """
+    Функция, проверяющая, не закрыл ли клиент соединение. Работает на встроенном сервере werkzeug,
+    который передает сокет соединения в environ, на других серверах всегда возвращает False
+    """
+    connection = environ.get('werkzeug.socket')
+    # На Windows неблокирующего флага для recv нет
+    flags = getattr(socket, 'MSG_DONTWAIT', None)
+
+    def disconnected() -> bool:
+        if connection is None or flags is None:
+            return False
+        try:
+            # Закрытое клиентом соединение читается как пустые данные, открытое - как отсутствие данных
+            return connection.recv(1, socket.MSG_PEEK | flags) == b''
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+
+    return disconnected
@@ -0,0 +1,135 @@
+import base64
+from collections import namedtuple
+import datetime as dt
+import math
+import struct
+import zlib
+import numpy as np
+from pyorbital import astronomy
+from pyorbital.orbital import A, F
+from calculations import check_abort
+import propagators
+from propagators import to_datetime64
+
+# Шаг по времени (в секундах), с которым проверяется видимость спутника из каждой ячейки
+COVERAGE_STEP = 20
+# Сколько значений (ячейки x моменты) обрабатывается за раз: ограничивает память расчета (около 8 байт на значение
+# в каждом из нескольких временных массивов)
+COVERAGE_TILE_POINTS = 4000000
+
+# Результат расчета: широты и долготы центров ячеек (строки - с севера на юг), суммарное время видимости
+# (в секундах) и наибольшая элевация (в градусах) в каждой ячейке - массивы (строки, столбцы)
+Coverage = namedtuple('Coverage', ['lats', 'lons', 'visible_time', 'max_elevation'])
+
+
+def make_grid(resolution: float, south: float = -90, north: float = 90, west: float = -180, east: float = 180):
+    """
+    Центры ячеек сетки с шагом около resolution градусов, точно покрывающей заданный прямоугольник.
+    Строки идут с севера на юг, как строки изображения
+    :returns: (широты строк, долготы столбцов)
+    """
+    rows = max(round((north - south) / resolution), 1)
+    cols = max(round((east - west) / resolution), 1)
+    lat_step, lon_step = (north - south) / rows, (east - west) / cols
+    return north - lat_step * (np.arange(rows) + 0.5), west + lon_step * (np.arange(cols) + 0.5)
+
+
+def observer_vectors(lats: np.ndarray, lons: np.ndarray):
+    """
+    Положения точек на поверхности Земли (км) и направления вертикали в них во вращающейся с Землей системе
+    координат, так же, как в astronomy.observer_position
+    :returns: два массива (точки, 3)
+    """
+    lat, lon = np.radians(lats), np.radians(lons)
+    c = 1 / np.sqrt(1 + F * (F - 2) * np.sin(lat) ** 2)
+    sq = c * (1 - F) ** 2
+
+    up = np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+    position = np.column_stack([A * c * up[:, 0], A * c * up[:, 1], A * sq * up[:, 2]])
+    return position, up
+
+
+def satellite_track(satellite: str, times: np.ndarray) -> np.ndarray:
+    """
+    Положения спутника (км) во вращающейся с Землей системе координат в моменты times.
+    Моменты, в которые положение не удалось расчитать, отбрасываются
+    :returns: массив (3, моменты)
+    """
+    x, y, z = propagators.get_propagator().get_positions([satellite], times)[:, 0]
+    theta = astronomy.gmst(times)
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+
+    track = np.vstack([cos_theta * x + sin_theta * y, -sin_theta * x + cos_theta * y, z])
+    return track[:, np.all(np.isfinite(track), axis=0)]
+
+
+def compute_coverage(satellite: str, start_time: dt.datetime, duration: float, resolution: float = 1.0,
+                     bounds: tuple = (-90, 90, -180, 180), min_elevation: float = 0, step: float = COVERAGE_STEP,
+                     tile_points: int = COVERAGE_TILE_POINTS, deadline: float = None, cancelled=None) -> Coverage:
+    """
+    Карта видимости спутника за duration часов с момента start_time: для каждой ячейки сетки
+    (bounds = (south, north, west, east), шаг resolution градусов) - суммарное время, когда элевация спутника
+    из центра ячейки не меньше min_elevation, и наибольшая элевация. Положение спутника расчитывается один раз
+    на все окно с шагом step секунд, а элевация для всех ячеек части сетки - двумя матричными произведениями.
+    Время и наибольшая элевация определяются по моментам с шагом step, то есть с точностью до шага.
+    deadline и cancelled прерывают расчет между частями сетки, как в OrbCalculator.run_chunks
+    """
+    lats, lons = make_grid(resolution, *bounds)
+    grid_lats, grid_lons = np.meshgrid(lats, lons, indexing='ij')
+    positions, ups = observer_vectors(grid_lats.ravel(), grid_lons.ravel())
+
+    # Каждый момент - середина своего промежутка длиной step
+    count = max(math.ceil(duration * 3600 / step), 1)
+    times = to_datetime64(start_time) + ((np.arange(count) + 0.5) * step * 1e6).astype('timedelta64[us]')
+    track = satellite_track(satellite, times)
+    track_squared = np.sum(track ** 2, axis=0)
+
+    min_sin = math.sin(math.radians(min_elevation))
+    visible = np.zeros(len(positions), dtype=np.int64)
+    max_sin = np.full(len(positions), -1.0)
+
+    tile = max(tile_points // max(track.shape[1], 1), 1)
+    for i in range(0, len(positions) if track.shape[1] else 0, tile):
+        check_abort(deadline, cancelled)
+
+        position, up = positions[i:i + tile], ups[i:i + tile]
+        # Синус элевации - проекция направления на спутник r = s - o на вертикаль: (u·s - u·o) / |s - o|
+        up_dot = up @ track - np.sum(up * position, axis=1)[:, np.newaxis]
+        distance = np.sqrt(track_squared - 2 * (position @ track) + np.sum(position ** 2, axis=1)[:, np.newaxis])
+        sin_elevation = up_dot / distance
+
+        visible[i:i + tile] = np.count_nonzero(sin_elevation >= min_sin, axis=1)
+        max_sin[i:i + tile] = sin_elevation.max(axis=1)
+
+    shape = (len(lats), len(lons))
+    return Coverage(lats, lons, (visible * step).reshape(shape),
+                    np.degrees(np.arcsin(np.clip(max_sin, -1, 1))).reshape(shape))
+
+
+def encode_raster(values: np.ndarray, dtype: str, scale: float = 1) -> dict:
+    """
+    Компактное представление растра: значения / scale, округленные до dtype, в base64 (little-endian, по строкам)
+    """
+    data = np.round(np.asarray(values) / scale).astype(np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': dtype, 'scale': scale, 'data': base64.b64encode(data.tobytes()).decode()}
+
+
+def to_png(values: np.ndarray, vmax: float) -> bytes:
+    """
+    Растр в виде PNG для наложения на карту: чем больше значение, тем краснее и непрозрачнее ячейка,
+    ячейки со значением не больше 0 прозрачны
+    """
+    level = np.clip(np.nan_to_num(values) / vmax if vmax > 0 else 0, 0, 1)
+    rgba = np.zeros(values.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = np.round(255 * (1 - level))
+    rgba[..., 3] = np.where(level > 0, np.round(64 + 160 * level), 0)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    height, width = values.shape
+    # Каждая строка изображения начинается с байта типа фильтра (0 - без фильтра)
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)]).tobytes()
+    return b''.join([b'\x89PNG\r\n\x1a\n', chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(raw, 6)), chunk(b'IEND', b'')])
@@ -1 +1,4 @@
-from . import users
\ No newline at end of file
+from . import users
+from . import trajectories
+from . import jobs
+from . import timetables
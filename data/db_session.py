@@ -1,13 +1,33 @@
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
+import metrics
 
 SqlAlchemyBase = orm.declarative_base()
 
 __factory = None
 
 
-def global_init(db_file):
+# Настройки SQLite для каждого нового соединения: журнал WAL позволяет читать базу параллельно с записью,
+# synchronous=NORMAL в режиме WAL не теряет целостность, а лишь последние транзакции при сбое питания
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+    'mmap_size': 64 * 1024 * 1024,
+}
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def global_init(db_file, pool_size=5, max_overflow=10):
     global __factory
 
     if __factory:
@@ -19,7 +39,10 @@ def global_init(db_file):
     conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
     print(f"Подключение к базе данных по адресу {conn_str}")
 
-    engine = sa.create_engine(conn_str, echo=False)
+    engine = sa.create_engine(conn_str, echo=False, poolclass=sa.pool.QueuePool, pool_size=pool_size,
+                              max_overflow=max_overflow)
+    sa.event.listen(engine, 'connect', _set_sqlite_pragmas)
+    metrics.instrument_engine(engine)
     __factory = orm.sessionmaker(bind=engine)
 
     from . import __all_models
@@ -0,0 +1,35 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+
+
+class PassJob(SqlAlchemyBase):
+    """
+    Фоновый расчет пролетов на длительный срок (см. jobs.JobQueue). Расчет разбит на части по времени,
+    результаты готовых частей хранятся в PassJobChunk
+    """
+    __tablename__ = 'pass_jobs'
+
+    id = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    # Хеш параметров расчета: одинаковые запросы присоединяются к уже существующему расчету
+    key = sqlalchemy.Column(sqlalchemy.String, index=True)
+    # queued, running, done, failed или cancelled
+    status = sqlalchemy.Column(sqlalchemy.String, index=True)
+    # Параметры расчета в JSON: точка наблюдения, время начала, длительность, ограничения и спутники
+    params = sqlalchemy.Column(sqlalchemy.String)
+    chunks_total = sqlalchemy.Column(sqlalchemy.Integer)
+    chunks_done = sqlalchemy.Column(sqlalchemy.Integer, default=0)
+    error = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    created_at = sqlalchemy.Column(sqlalchemy.Float)
+    updated_at = sqlalchemy.Column(sqlalchemy.Float, index=True)
+
+
+class PassJobChunk(SqlAlchemyBase):
+    """
+    Пролеты, начинающиеся в одной части фонового расчета
+    """
+    __tablename__ = 'pass_job_chunks'
+
+    job_id = sqlalchemy.Column(sqlalchemy.String, sqlalchemy.ForeignKey('pass_jobs.id'), primary_key=True)
+    number = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    # [[satellite_name, start_time, end_time, apogee], ...] в JSON, как у OrbCalculator.get_passes
+    passes = sqlalchemy.Column(sqlalchemy.String)
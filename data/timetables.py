@@ -0,0 +1,44 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+
+
+class Timetable(SqlAlchemyBase):
+    """
+    Заранее расчитанное расписание пролетов для сохраненной пользователями точки наблюдения
+    (см. timetables.Timetables). Пользователи с почти одинаковыми координатами делят одно расписание
+    """
+    __tablename__ = 'timetables'
+
+    # Округленные координаты точки наблюдения, по которым расчитаны пролеты
+    id = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    lat = sqlalchemy.Column(sqlalchemy.Float)
+    lon = sqlalchemy.Column(sqlalchemy.Float)
+    alt = sqlalchemy.Column(sqlalchemy.Float)
+    # Версия каталога TLE, по которой расчитаны пролеты (None - еще не расчитаны)
+    catalog_version = sqlalchemy.Column(sqlalchemy.String, nullable=True)
+    # Промежуток (unix time), в котором начинаются все сохраненные пролеты
+    window_start = sqlalchemy.Column(sqlalchemy.Float, default=0)
+    window_end = sqlalchemy.Column(sqlalchemy.Float, default=0)
+    used_at = sqlalchemy.Column(sqlalchemy.Float, index=True)
+
+
+class TimetablePass(SqlAlchemyBase):
+    """
+    Один пролет из расписания Timetable. Пролеты расчитываются с min_elevation = 0 и min_apogee = 0,
+    поэтому расписание с любым min_apogee получается отбором по apogee, а с любым min_elevation -
+    сдвигом начала и конца пролета на rise_offsets и set_offsets
+    """
+    __tablename__ = 'timetable_passes'
+    __table_args__ = (sqlalchemy.Index('ix_timetable_passes_start', 'timetable_id', 'start_time'),)
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    timetable_id = sqlalchemy.Column(sqlalchemy.String, sqlalchemy.ForeignKey('timetables.id'))
+    satellite = sqlalchemy.Column(sqlalchemy.String)
+    # Время в формате '%Y.%m.%d %H:%M:%S' (UTC), как у OrbCalculator.get_passes
+    start_time = sqlalchemy.Column(sqlalchemy.String)
+    end_time = sqlalchemy.Column(sqlalchemy.String)
+    apogee = sqlalchemy.Column(sqlalchemy.Float)
+    # Через пробел для каждой целой элевации k от 1 до наибольшей в пролете: через сколько секунд после начала
+    # пролета спутник поднимается не ниже k и за сколько секунд до конца опускается ниже k
+    rise_offsets = sqlalchemy.Column(sqlalchemy.String, default='')
+    set_offsets = sqlalchemy.Column(sqlalchemy.String, default='')
@@ -0,0 +1,17 @@
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+
+
+class PassTrajectory(SqlAlchemyBase):
+    """
+    Траектория пролета, расчитанная для просмотра на карте. Сама траектория хранится
+    в виде массива float32 (см. trajectory_store), а в сессии пользователя - только token
+    """
+    __tablename__ = 'pass_trajectories'
+
+    token = sqlalchemy.Column(sqlalchemy.String, primary_key=True)
+    created_at = sqlalchemy.Column(sqlalchemy.Float, index=True)
+    # Параметры пролета в JSON: спутник, точка наблюдения, время начала и конца
+    params = sqlalchemy.Column(sqlalchemy.String)
+    data = sqlalchemy.Column(sqlalchemy.LargeBinary)
+    size = sqlalchemy.Column(sqlalchemy.Integer)
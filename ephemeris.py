@@ -0,0 +1,249 @@
+import datetime as dt
+import logging
+import math
+import threading
+import time
+import numpy as np
+from pyorbital import astronomy
+from pyorbital.orbital import A, F, XKMPER
+from catalog import catalog
+import propagators
+from propagators import to_datetime64, eci_to_lonlatalt
+
+logger = logging.getLogger(__name__)
+
+# Шаг таблицы (в секундах) и окно, на которое она расчитывается относительно текущего момента
+EPHEMERIS_STEP = 60
+EPHEMERIS_PAST = 2 * 3600
+EPHEMERIS_FUTURE = 4 * 3600
+# Таблица перестраивается, когда до конца окна остается меньше EPHEMERIS_FUTURE - EPHEMERIS_REFRESH секунд
+EPHEMERIS_REFRESH = 1800
+# Таблица спутника, к которому не обращались EPHEMERIS_TTL секунд, удаляется и больше не перестраивается
+EPHEMERIS_TTL = 3600
+
+# Угловая скорость спутника на низкой орбите (рад/с) и радиус орбиты (км), по которым оценивается погрешность
+_LEO_ANGULAR_VELOCITY = 2 * np.pi / (88 * 60)
+_LEO_RADIUS = XKMPER + 2000
+
+
+def error_bound(step: float) -> float:
+    """
+    Оценка сверху погрешности (в км) кубической интерполяции Эрмита по положениям и скоростям с шагом step секунд.
+    Погрешность не превосходит h^4 / 384 * max|x''''|, а для круговой орбиты |x''''| = w^4 * r.
+    Для низких орбит (период от 88 минут, высота до 2000 км) и шага в 60 секунд это около 0.5 м
+    """
+    return step ** 4 / 384 * _LEO_ANGULAR_VELOCITY ** 4 * _LEO_RADIUS
+
+
+class Ephemeris:
+    """
+    Таблица положений и скоростей одного спутника с постоянным шагом
+    """
+
+    def __init__(self, satellite: str, start: np.datetime64, step: float, count: int):
+        self.satellite = satellite
+        self.version = catalog.version
+        self.start = start
+        self.step = step
+        self._step = np.timedelta64(round(step * 1e6), 'us')
+        self.end = start + self._step * (count - 1)
+
+        times = start + self._step * np.arange(count)
+        positions, velocities = propagators.get_orbital(satellite).get_position(times, normalize=False)
+
+        # Массивы (count, 3): положение в км и скорость в км/с
+        self.positions = np.ascontiguousarray(np.asarray(positions).T)
+        self.velocities = np.ascontiguousarray(np.asarray(velocities).T)
+
+        # Те же данные в виде списков для расчета одного момента без накладных расходов numpy
+        self._rows = np.hstack([self.positions, self.velocities * step]).tolist()
+        self._start_jdays = float(astronomy.jdays2000(start))
+
+    def covers(self, times) -> bool:
+        if self.version != catalog.version:
+            return False
+        if np.ndim(times) == 0:
+            return self.start <= times <= self.end
+        return bool(np.all((self.start <= times) & (times <= self.end)))
+
+    def get_position(self, times: np.ndarray) -> np.ndarray:
+        """
+        Положение спутника (массив (3, n), км) в моменты times, интерполированное по таблице
+        """
+        offset = (times - self.start) / self._step
+        index = np.clip(np.floor(offset).astype(int), 0, len(self.positions) - 2)
+        u = (offset - index)[:, np.newaxis]
+
+        # Базисные функции кубического сплайна Эрмита
+        u2, u3 = u * u, u * u * u
+        h00 = 2 * u3 - 3 * u2 + 1
+        h10 = u3 - 2 * u2 + u
+        h01 = -2 * u3 + 3 * u2
+        h11 = u3 - u2
+
+        positions = (h00 * self.positions[index] + h10 * self.velocities[index] * self.step +
+                     h01 * self.positions[index + 1] + h11 * self.velocities[index + 1] * self.step)
+        return positions.T
+
+    def get_lonlatalt_at(self, time: np.datetime64):
+        """
+        Долгота, широта и высота спутника в один момент time. Те же вычисления, что и в get_position
+        и eci_to_lonlatalt, но на скалярах, что для одной точки на порядок быстрее
+        """
+        offset = float((time - self.start) / self._step)
+        index = min(max(int(offset), 0), len(self._rows) - 2)
+        u = offset - index
+
+        u2, u3 = u * u, u * u * u
+        h00 = 2 * u3 - 3 * u2 + 1
+        h10 = u3 - 2 * u2 + u
+        h01 = -2 * u3 + 3 * u2
+        h11 = u3 - u2
+
+        x0, y0, z0, vx0, vy0, vz0 = self._rows[index]
+        x1, y1, z1, vx1, vy1, vz1 = self._rows[index + 1]
+        pos_x = (h00 * x0 + h10 * vx0 + h01 * x1 + h11 * vx1) / XKMPER
+        pos_y = (h00 * y0 + h10 * vy0 + h01 * y1 + h11 * vy1) / XKMPER
+        pos_z = (h00 * z0 + h10 * vz0 + h01 * z1 + h11 * vz1) / XKMPER
+
+        # astronomy.gmst для одного момента
+        ut1 = (self._start_jdays + offset * self.step / 86400) / 36525.0
+        theta = 67310.54841 + ut1 * (876600 * 3600 + 8640184.812866 + ut1 * (0.093104 - ut1 * 6.2 * 10e-6))
+        gmst = math.radians(theta / 240.0) % (2 * math.pi)
+
+        lon = (math.atan2(pos_y, pos_x) - gmst) % (2 * math.pi)
+        if lon > math.pi:
+            lon -= 2 * math.pi
+
+        r = math.hypot(pos_x, pos_y)
+        lat = math.atan2(pos_z, r)
+        e2 = F * (2 - F)
+        while True:
+            lat2 = lat
+            c = 1 / math.sqrt(1 - e2 * math.sin(lat2) ** 2)
+            lat = math.atan2(pos_z + c * e2 * math.sin(lat2), r)
+            if abs(lat - lat2) < 1e-10:
+                break
+        alt = (r / math.cos(lat) - c) * A
+
+        return math.degrees(lon), math.degrees(lat), alt
+
+
+class EphemerisStore:
+    """
+    Хранилище таблиц положений спутников на скользящем окне вокруг текущего момента.
+    Запрос положения сводится к чтению двух соседних строк таблицы и интерполяции.
+    Таблица строится при первом запросе спутника и затем перестраивается в фоне,
+    пока к спутнику обращались в последние ttl секунд.
+    При verify=True каждый результат сравнивается с прямым расчетом, а максимальное отклонение
+    сохраняется в stats()
+    """
+
+    def __init__(self, step: float = EPHEMERIS_STEP, past: float = EPHEMERIS_PAST, future: float = EPHEMERIS_FUTURE,
+                 refresh: float = EPHEMERIS_REFRESH, verify: bool = False, ttl: float = EPHEMERIS_TTL):
+        self.step = step
+        self.past = dt.timedelta(seconds=past)
+        self.future = dt.timedelta(seconds=future)
+        self.refresh = refresh
+        self.verify = verify
+        self.ttl = ttl
+        self.lookups = 0
+        self.fallbacks = 0
+        self.max_error = 0.0
+        self._tables = {}
+        # Время последнего обращения к таблице каждого спутника (по time.monotonic)
+        self._used = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _build(self, satellite: str) -> Ephemeris:
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        start = to_datetime64(now - self.past).astype('datetime64[s]')
+        # Пара лишних точек в конце, чтобы таблица покрывала окно несмотря на округление начала
+        count = int((self.past + self.future).total_seconds() // self.step) + 3
+
+        table = Ephemeris(satellite, start, self.step, count)
+        self._tables[satellite] = table
+        return table
+
+    def _get_table(self, satellite: str, times: np.ndarray):
+        table = self._tables.get(satellite)
+        if table is not None and table.covers(times):
+            self._used[satellite] = time.monotonic()
+            return table
+
+        # Перестраиваем таблицу, только если запрошенное время попадает в окно относительно текущего момента
+        now = to_datetime64(dt.datetime.now(tz=dt.timezone.utc))
+        window_start, window_end = now - np.timedelta64(self.past), now + np.timedelta64(self.future)
+        if np.all((window_start <= times) & (times <= window_end)):
+            with self._lock:
+                table = self._tables.get(satellite)
+                if table is None or not table.covers(times):
+                    table = self._build(satellite)
+                self._used[satellite] = time.monotonic()
+                self._start()
+            return table
+
+        return None
+
+    def get_lonlatalt(self, satellite: str, utc_time):
+        """
+        То же, что и Orbital.get_lonlatalt, но по таблице. Время вне окна таблицы расчитывается напрямую
+        """
+        satellite = catalog.get_record(satellite).name
+        scalar = np.ndim(utc_time) == 0
+        times = to_datetime64(utc_time) if scalar else np.asarray(utc_time, dtype='datetime64[us]')
+
+        self.lookups += 1
+        table = self._get_table(satellite, times)
+
+        if table is None:
+            self.fallbacks += 1
+            return propagators.get_orbital(satellite).get_lonlatalt(times)
+
+        if self.verify:
+            self._check(satellite, np.atleast_1d(times), table.get_position(np.atleast_1d(times)))
+
+        if scalar:
+            return table.get_lonlatalt_at(times)
+        return eci_to_lonlatalt(times, table.get_position(times))
+
+    def _check(self, satellite: str, times: np.ndarray, positions: np.ndarray):
+        expected, _ = propagators.get_orbital(satellite).get_position(times, normalize=False)
+        error = float(np.max(np.linalg.norm(np.asarray(expected) - positions, axis=0)))
+        self.max_error = max(self.max_error, error)
+
+        if error > error_bound(self.step):
+            logger.warning('Погрешность интерполяции для %s составила %.3f км', satellite, error)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ephemeris', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh / 4)
+
+            threshold = to_datetime64(dt.datetime.now(tz=dt.timezone.utc) + self.future) - \
+                np.timedelta64(round(self.refresh * 1e6), 'us')
+
+            expired = time.monotonic() - self.ttl
+            for satellite, table in list(self._tables.items()):
+                if self._used.get(satellite, 0) < expired:
+                    with self._lock:
+                        # К таблице могли обратиться, пока шла проверка
+                        if self._used.get(satellite, 0) < expired:
+                            self._tables.pop(satellite, None)
+                            self._used.pop(satellite, None)
+                elif table.end < threshold or table.version != catalog.version:
+                    try:
+                        with self._lock:
+                            self._build(satellite)
+                    except Exception:
+                        logger.exception('Не удалось перестроить таблицу положений %s', satellite)
+                        self._tables.pop(satellite, None)
+
+    def stats(self) -> dict:
+        return {'satellites': len(self._tables), 'lookups': self.lookups, 'fallbacks': self.fallbacks,
+                'verify': self.verify, 'max_error_km': self.max_error, 'error_bound_km': error_bound(self.step)}
@@ -2,6 +2,9 @@ from flask_wtf import FlaskForm
 from wtforms import FloatField, DateTimeLocalField, IntegerField
 from wtforms.validators import NumberRange, InputRequired
 
+# Наибольшая длительность наблюдения (в часах)
+MAX_DURATION = 720
+
 
 class ObservationPointCoordsForm(FlaskForm):
     """
@@ -37,7 +40,7 @@ class ObservationPointCoordsForm(FlaskForm):
     ])
     duration = IntegerField('Длительность наблюдения (в часах)', validators=[
         InputRequired(message='Это обязательное поле'),
-        NumberRange(min=0, message='Длительность наблюдения не может быть отрицательной')
+        NumberRange(min=0, max=MAX_DURATION, message='Длительность наблюдения должна быть от %(min)s до %(max)s часов')
     ])
 
 
@@ -63,5 +66,5 @@ class PassesSettingsForm(FlaskForm):
     ])
     duration = IntegerField('Длительность наблюдения (в часах)', validators=[
         InputRequired(message='Это обязательное поле'),
-        NumberRange(min=0, message='Длительность наблюдения не может быть отрицательной')
+        NumberRange(min=0, max=MAX_DURATION, message='Длительность наблюдения должна быть от %(min)s до %(max)s часов')
     ])
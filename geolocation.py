@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+import geoip2.database
+import geoip2.errors
+import maxminddb
+from cache import LRUCache
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GEOIP_DATABASE = 'db/GeoLite2-City.mmdb'
+
+# Через сколько секунд повторять попытку открыть базу, если ее не удалось открыть
+RETRY_INTERVAL = 60
+
+
+class GeoIP:
+    """
+    Определение координат по IP адресу. База открывается один раз в режиме отображения в память
+    и используется всеми запросами, а результаты поиска кешируются.
+    Если базы нет, координаты просто не определяются
+    """
+
+    def __init__(self, database: str = GEOIP_DATABASE, cache_size: int = 4096):
+        self.database = database
+        self._reader = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+        self._cache = LRUCache(cache_size)
+
+    def _get_reader(self):
+        if self._reader is not None:
+            return self._reader
+
+        with self._lock:
+            if self._reader is None:
+                if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_INTERVAL:
+                    return None
+                try:
+                    self._reader = geoip2.database.Reader(self.database, mode=maxminddb.MODE_MMAP)
+                except (OSError, ValueError, maxminddb.InvalidDatabaseError):
+                    logger.warning('Не удалось открыть базу GeoIP %s', self.database)
+                    self._failed_at = time.monotonic()
+        return self._reader
+
+    def locate(self, ip: str):
+        """
+        Возвращает (lat, lon) для IP адреса или (None, None), если определить координаты не удалось
+        """
+        if not ip:
+            return None, None
+
+        location = self._cache.get(ip)
+        if location is not None:
+            return location
+
+        with metrics.timed('geoip'):
+            reader = self._get_reader()
+            if reader is None:
+                return None, None
+
+            try:
+                response = reader.city(ip)
+                location = response.location.latitude, response.location.longitude
+            except (geoip2.errors.AddressNotFoundError, ValueError):
+                location = None, None
+
+        self._cache.set(ip, location)
+        return location
+
+    def stats(self) -> dict:
+        return {'database_loaded': self._reader is not None, **self._cache.stats()}
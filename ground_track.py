@@ -0,0 +1,148 @@
+import datetime as dt
+import math
+import threading
+import numpy as np
+from cache import LRUCache
+from catalog import catalog
+from propagators import to_datetime64
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Длина интервала (в секундах), на который расчитывается одна общая для всех клиентов трасса,
+# количество витков трассы по умолчанию и наибольшее
+GROUND_TRACK_BUCKET = 60
+GROUND_TRACK_ORBITS = 1
+GROUND_TRACK_MAX_ORBITS = 5
+# Шаг, с которым трасса расчитывается перед прореживанием (в секундах), и наибольшее количество таких точек
+GROUND_TRACK_STEP = 20
+GROUND_TRACK_MAX_POINTS = 20000
+# Прореживание: точка сохраняется, когда трасса с последней сохраненной точки повернула на TOLERANCE градусов,
+# но точки не реже, чем раз в MAX_GAP секунд
+GROUND_TRACK_TOLERANCE = 2.0
+GROUND_TRACK_MAX_GAP = 600
+
+
+def adaptive_indices(lon: np.ndarray, lat: np.ndarray, times: np.ndarray, tolerance: float = GROUND_TRACK_TOLERANCE,
+                     max_gap: float = GROUND_TRACK_MAX_GAP) -> np.ndarray:
+    """
+    Индексы точек трассы, которые нужно сохранить, чтобы ломаная по ним отличалась от трассы не больше,
+    чем на поворот в tolerance градусов. Поворот считается на карте (долгота, широта), поэтому на почти прямых
+    участках у экватора точек мало, а у самой северной и самой южной точек трассы, где она разворачивается, - много.
+    times - время точек в секундах
+    """
+    if len(lon) < 3:
+        return np.arange(len(lon))
+
+    # Долгота без скачков на антимеридиане, чтобы направление сегментов на нем не разворачивалось
+    lon = np.degrees(np.unwrap(np.radians(lon)))
+    heading = np.arctan2(np.diff(lat), np.diff(lon) * np.cos(np.radians(lat[:-1])))
+    turn = np.abs(np.angle(np.exp(1j * np.diff(heading))))
+
+    # Точка сохраняется, когда накопленный поворот или время переходят через очередное кратное tolerance и max_gap
+    turned = np.floor(np.concatenate([[0], np.cumsum(np.degrees(turn))]) / tolerance)
+    elapsed = np.floor((times[1:-1] - times[0]) / max_gap)
+    keep = (np.diff(turned) > 0) | (np.diff(np.concatenate([[0], elapsed])) > 0)
+
+    return np.concatenate([[0], np.flatnonzero(keep) + 1, [len(lon) - 1]])
+
+
+def split_antimeridian(lon: np.ndarray, lat: np.ndarray, alt: np.ndarray) -> list:
+    """
+    Разбивает трассу на части, не пересекающие антимеридиан. Концы соседних частей достраиваются
+    до долготы ±180, чтобы на карте между ними не было разрыва
+    :returns: [[[lon, lat, alt], ...], ...]
+    """
+    points = np.column_stack([lon, lat, alt])
+    crossings = np.flatnonzero(np.abs(np.diff(lon)) > 180)
+
+    segments = []
+    start = 0
+    for i in crossings:
+        (lon1, lat1, alt1), (lon2, lat2, alt2) = points[i], points[i + 1]
+        # Долгота второй точки по ту же сторону антимеридиана, что и первая
+        edge = math.copysign(180, lon1)
+        lon2 += math.copysign(360, lon1)
+        fraction = (edge - lon1) / (lon2 - lon1)
+        lat_edge, alt_edge = lat1 + (lat2 - lat1) * fraction, alt1 + (alt2 - alt1) * fraction
+
+        segments.append(points[start:i + 1].tolist() + [[edge, lat_edge, alt_edge]])
+        points[i] = [-edge, lat_edge, alt_edge]
+        start = i
+    segments.append(points[start:].tolist())
+    return segments
+
+
+class GroundTracks:
+    """
+    Трассы спутников для страницы /object: трасса расчитывается один раз на спутник и интервал длиной bucket секунд
+    и отдается всем клиентам. Трасса охватывает orbits витков с текущим моментом посередине,
+    расчитывается с шагом step секунд и прореживается adaptive_indices
+    """
+
+    def __init__(self, ephemeris, bucket: int = GROUND_TRACK_BUCKET, maxsize: int = 256,
+                 step: float = GROUND_TRACK_STEP, tolerance: float = GROUND_TRACK_TOLERANCE,
+                 max_gap: float = GROUND_TRACK_MAX_GAP):
+        self.ephemeris = ephemeris
+        self.bucket = bucket
+        self.step = step
+        self.tolerance = tolerance
+        self.max_gap = max_gap
+        self._cache = LRUCache(maxsize, ttl=bucket * 2)
+        self._lock = threading.Lock()
+        # Блокировки трасс, которые сейчас запрашиваются: ключ -> [блокировка, количество запросов]
+        self._key_locks = {}
+
+    def floor_to_bucket(self, time: dt.datetime) -> dt.datetime:
+        timestamp = time.timestamp()
+        return dt.datetime.fromtimestamp(timestamp - timestamp % self.bucket, dt.timezone.utc)
+
+    def get(self, satellite: str, time: dt.datetime, orbits: float = GROUND_TRACK_ORBITS) -> dict:
+        """
+        Трасса спутника на интервал, в который попадает time
+        :returns: {'satellite', 'time', 'start', 'end', 'position', 'segments'}
+        """
+        record = catalog.get_record(satellite)
+        time = self.floor_to_bucket(time)
+        key = (record.name, time, orbits, catalog.version)
+
+        # Одновременные запросы одной трассы ждут, пока ее расчитает первый из них, и одна трасса
+        # не расчитывается дважды, а трассы разных спутников и интервалов расчитываются параллельно
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                track = self._cache.get(key)
+                if track is None:
+                    track = self._compute(record, time, orbits)
+                    self._cache.set(key, track)
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    del self._key_locks[key]
+        return track
+
+    def _compute(self, record, time: dt.datetime, orbits: float) -> dict:
+        # Период обращения по среднему движению из TLE (оборотов в сутки)
+        period = 86400 / float(record.line2[52:63])
+        half = orbits * period / 2
+        step = max(self.step, 2 * half / GROUND_TRACK_MAX_POINTS)
+
+        offsets = np.arange(-half, half + step / 2, step)
+        offsets = np.union1d(offsets, [0])
+        times = to_datetime64(time) + (offsets * 1e6).astype('timedelta64[us]')
+        lon, lat, alt = (np.asarray(values, dtype=float)
+                         for values in self.ephemeris.get_lonlatalt(record.name, times))
+
+        index = adaptive_indices(lon, lat, offsets, self.tolerance, self.max_gap)
+        current = int(np.searchsorted(offsets, 0))
+
+        return {'satellite': record.name, 'time': time.strftime(TIME_FORMAT),
+                'start': (time + dt.timedelta(seconds=offsets[0])).strftime(TIME_FORMAT),
+                'end': (time + dt.timedelta(seconds=offsets[-1])).strftime(TIME_FORMAT),
+                'position': [float(lon[current]), float(lat[current]), float(alt[current])],
+                'segments': split_antimeridian(lon[index], lat[index], alt[index])}
+
+    def stats(self) -> dict:
+        return self._cache.stats()
@@ -0,0 +1,129 @@
+from functools import wraps
+import hashlib
+import json
+import zlib
+from flask import current_app, request, make_response, Response
+from catalog import catalog
+import propagators
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Сколько секунд клиенты и прокси могут использовать ответ без перепроверки
+HTTP_CACHE_MAX_AGE = 3600
+# Ответы меньше этого размера (в байтах) не сжимаются, уровень сжатия gzip и качество brotli
+HTTP_COMPRESS_MIN_SIZE = 1024
+HTTP_COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Сжимаются только текстовые ответы. Поток событий не сжимается, чтобы события не задерживались в буфере
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/csv', 'text/tab-separated-values'}
+
+
+def make_etag(path: str, args) -> str:
+    """
+    Тег ответа, однозначно определяемый адресом, параметрами запроса, содержимым каталога TLE
+    и способом расчета положения
+    """
+    data = json.dumps([path, sorted(args.items(multi=True)), catalog.version, propagators.get_propagator().name])
+    return hashlib.sha256(data.encode()).hexdigest()[:32]
+
+
+def is_not_modified(etag: str, last_modified) -> bool:
+    # If-Modified-Since учитывается, только если нет If-None-Match (RFC 7232)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since is not None and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def cacheable(required: tuple = ()):
+    """
+    Декоратор для ответов, которые полностью определяются параметрами запроса и каталогом TLE.
+    Ответ получает ETag и Last-Modified (эпоха каталога) и может кешироваться клиентами и прокси,
+    а на условный запрос с тем же тегом сразу отдается 304 без расчета.
+    Если в запросе нет какого-либо параметра из required (например, time - тогда берется текущий момент),
+    ответ не кешируется
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not all(request.args.get(name) for name in required):
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.no_store = True
+                return response
+
+            etag = make_etag(request.path, request.args)
+            last_modified = catalog.epoch
+
+            if is_not_modified(etag, last_modified):
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            # Тег слабый, потому что сжатые и несжатые ответы должны иметь один тег
+            response.set_etag(etag, weak=True)
+            response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.config.get('HTTP_CACHE_MAX_AGE', HTTP_CACHE_MAX_AGE)
+            response.vary.add('Accept-Encoding')
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def _compress_stream(chunks, encoding: str, level: int):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress(response: Response, min_size: int = HTTP_COMPRESS_MIN_SIZE,
+             level: int = HTTP_COMPRESS_LEVEL) -> Response:
+    """
+    Сжимает текстовый ответ в brotli (если установлен пакет brotli) или gzip, если клиент это поддерживает.
+    Ответы, которые отдаются частями, сжимаются по мере отдачи
+    """
+    if response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES \
+            or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli is not None else ['gzip'])
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            response.set_data(compressor.compress(data) + compressor.flush())
+
+    response.headers['Content-Encoding'] = encoding
+    return response
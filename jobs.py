@@ -0,0 +1,282 @@
+import datetime as dt
+import hashlib
+import json
+import logging
+import math
+import secrets
+import threading
+import time
+import sqlalchemy as sa
+from calculations import OrbCalculator, CalculationCancelled
+from catalog import catalog
+from data import db_session
+from data.jobs import PassJob, PassJobChunk
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%Y.%m.%d %H:%M:%S'
+
+# Количество потоков, выполняющих расчеты, длина одной части расчета и запас окна расчета части
+# с каждой стороны (в часах), чтобы пролеты на границе частей находились так же, как при расчете целиком
+JOBS_WORKERS = 2
+JOBS_CHUNK_HOURS = 24
+JOBS_CHUNK_MARGIN = 2
+# Сколько хранятся завершенные расчеты (в секундах) и как часто потоки проверяют базу на новые расчеты,
+# поставленные другими процессами (в секундах)
+JOBS_TTL = 24 * 3600
+JOBS_POLL_INTERVAL = 5
+
+ACTIVE_STATUSES = ('queued', 'running')
+STATUSES = ACTIVE_STATUSES + ('done', 'failed', 'cancelled')
+
+
+class JobQueue:
+    """
+    Очередь фоновых расчетов пролетов на длительный срок без внешнего брокера: очередью служит
+    таблица pass_jobs в базе данных приложения. Потоки очереди забирают расчеты из таблицы и считают их
+    частями по chunk_hours часов (сами пролеты расчитываются в пуле процессов OrbCalculator, если он запущен),
+    сохраняя пролеты каждой части сразу после расчета, поэтому клиент получает результаты по мере готовности,
+    а прерванный остановкой сервера расчет продолжается с последней сохраненной части.
+    Одинаковый запрос, пока его расчет выполняется или хранится, присоединяется к нему, а не ставится заново
+    """
+
+    def __init__(self, workers: int = JOBS_WORKERS, chunk_hours: int = JOBS_CHUNK_HOURS,
+                 margin: int = JOBS_CHUNK_MARGIN, ttl: float = JOBS_TTL, poll_interval: float = JOBS_POLL_INTERVAL):
+        self.workers = workers
+        self.chunk_hours = chunk_hours
+        self.margin = margin
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._cancelled = set()
+        self._submit_lock = threading.Lock()
+        # Уведомляет потоки очереди о новых расчетах, а ожидающих результат - о готовых частях
+        self._queued = threading.Condition()
+        self._updated = threading.Condition()
+
+    def start(self):
+        """
+        Запускает потоки очереди. Расчеты, которые выполнялись при остановке сервера, ставятся в очередь заново
+        """
+        if self._threads:
+            return
+
+        db_sess = db_session.create_session()
+        try:
+            db_sess.query(PassJob).filter(PassJob.status == 'running').update({'status': 'queued'})
+            db_sess.commit()
+        finally:
+            db_sess.close()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'jobs-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @staticmethod
+    def make_key(params: dict) -> str:
+        data = json.dumps([params, catalog.version], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def submit(self, params: dict):
+        """
+        Ставит в очередь расчет пролетов или находит такой же уже поставленный.
+        :param params: {'lat', 'lon', 'alt', 'min_elevation', 'min_apogee', 'time' (в TIME_FORMAT, UTC),
+                        'duration' (в часах), 'satellites'}
+        :returns: (состояние расчета, как у get, True, если расчет поставлен заново)
+        """
+        key = self.make_key(params)
+        now = time.time()
+
+        with self._submit_lock:
+            db_sess = db_session.create_session()
+            try:
+                self._remove_expired(db_sess, now)
+
+                job = db_sess.query(PassJob) \
+                    .filter(PassJob.key == key, PassJob.status.in_(ACTIVE_STATUSES + ('done',))) \
+                    .order_by(PassJob.created_at.desc()).first()
+                created = job is None
+                if created:
+                    job = PassJob(id=secrets.token_urlsafe(12), key=key, status='queued', params=json.dumps(params),
+                                  chunks_total=max(math.ceil(params['duration'] / self.chunk_hours), 1),
+                                  chunks_done=0, created_at=now, updated_at=now)
+                    db_sess.add(job)
+                    db_sess.commit()
+                job_id = job.id
+            finally:
+                db_sess.close()
+
+        if created:
+            with self._queued:
+                self._queued.notify()
+
+        return self.get(job_id, after=None), created
+
+    def get(self, job_id: str, after: int = 0):
+        """
+        Состояние расчета и пролеты из частей, начиная с номера after (None - без пролетов)
+        :returns: {'id', 'status', 'progress', 'chunks_done', 'chunks_total', 'error', 'passes'} или None
+        """
+        db_sess = db_session.create_session()
+        try:
+            job = db_sess.get(PassJob, job_id)
+            if job is None:
+                return None
+
+            passes = []
+            if after is not None:
+                chunks = db_sess.query(PassJobChunk.passes) \
+                    .filter(PassJobChunk.job_id == job_id, PassJobChunk.number >= after) \
+                    .order_by(PassJobChunk.number).all()
+                for chunk_passes, in chunks:
+                    passes += json.loads(chunk_passes)
+
+            return {'id': job.id, 'status': job.status, 'progress': round(job.chunks_done / job.chunks_total, 4),
+                    'chunks_done': job.chunks_done, 'chunks_total': job.chunks_total, 'error': job.error,
+                    'passes': passes}
+        finally:
+            db_sess.close()
+
+    def cancel(self, job_id: str):
+        """
+        Отменяет расчет. Если к расчету присоединились несколько клиентов, он отменяется для всех
+        :returns: состояние расчета, как у get, или None, если расчета нет
+        """
+        db_sess = db_session.create_session()
+        try:
+            job = db_sess.get(PassJob, job_id)
+            if job is not None and job.status in ACTIVE_STATUSES:
+                # Выполняющийся в этом процессе расчет прерывается сразу, в других процессах - после текущей части
+                if job.status == 'running':
+                    self._cancelled.add(job_id)
+                job.status, job.updated_at = 'cancelled', time.time()
+                db_sess.commit()
+        finally:
+            db_sess.close()
+
+        self._notify_updated()
+        return self.get(job_id, after=None)
+
+    def wait(self, timeout: float):
+        """
+        Ждет, пока у какого-либо расчета этого процесса не изменится состояние, но не дольше timeout секунд
+        """
+        with self._updated:
+            self._updated.wait(timeout)
+
+    def stats(self) -> dict:
+        """
+        Количество расчетов в каждом состоянии
+        """
+        db_sess = db_session.create_session()
+        try:
+            counts = dict(db_sess.query(PassJob.status, sa.func.count()).group_by(PassJob.status).all())
+        finally:
+            db_sess.close()
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+    def _remove_expired(self, db_sess, now: float):
+        expired = [job_id for job_id, in db_sess.query(PassJob.id)
+                   .filter(PassJob.status.notin_(ACTIVE_STATUSES), PassJob.updated_at < now - self.ttl).all()]
+        if expired:
+            db_sess.query(PassJobChunk).filter(PassJobChunk.job_id.in_(expired)).delete(synchronize_session=False)
+            db_sess.query(PassJob).filter(PassJob.id.in_(expired)).delete(synchronize_session=False)
+            db_sess.commit()
+
+    def _notify_updated(self):
+        with self._updated:
+            self._updated.notify_all()
+
+    def _claim(self):
+        """
+        Забирает самый старый расчет из очереди. Расчет достается только одному потоку (и процессу),
+        потому что статус меняется при условии, что расчет все еще в очереди
+        :returns: PassJob или None, если очередь пуста
+        """
+        db_sess = db_session.create_session()
+        try:
+            while True:
+                job = db_sess.query(PassJob).filter(PassJob.status == 'queued') \
+                    .order_by(PassJob.created_at).first()
+                if job is None:
+                    return None
+
+                claimed = db_sess.query(PassJob).filter(PassJob.id == job.id, PassJob.status == 'queued') \
+                    .update({'status': 'running', 'updated_at': time.time()})
+                db_sess.commit()
+                if claimed:
+                    db_sess.refresh(job)
+                    db_sess.expunge(job)
+                    return job
+        finally:
+            db_sess.close()
+
+    def _run(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                with self._queued:
+                    self._queued.wait(self.poll_interval)
+                continue
+
+            try:
+                self._compute(job)
+            except CalculationCancelled:
+                pass
+            except Exception as error:
+                logger.exception('Фоновый расчет %s завершился с ошибкой', job.id)
+                self._finish_chunk(job.id, None, None, error=str(error))
+            finally:
+                self._cancelled.discard(job.id)
+                self._notify_updated()
+
+    def _compute(self, job: PassJob):
+        params = json.loads(job.params)
+        start_time = dt.datetime.strptime(f"{params['time']} +0000", f'{TIME_FORMAT} %z')
+        end_time = start_time + dt.timedelta(hours=params['duration'])
+
+        for number in range(job.chunks_done, job.chunks_total):
+            chunk_start = start_time + dt.timedelta(hours=number * self.chunk_hours)
+            chunk_end = min(chunk_start + dt.timedelta(hours=self.chunk_hours), end_time)
+            last = number == job.chunks_total - 1
+
+            # Пролет, начинающийся в части, может начать восходить и закончиться за ее границами,
+            # поэтому окно расчета шире части на margin часов (кроме границ всего расчета),
+            # а в результат части попадают только пролеты, начинающиеся в ней
+            window_start = chunk_start - dt.timedelta(hours=self.margin) if number else chunk_start
+            window_end = chunk_end if last else chunk_end + dt.timedelta(hours=self.margin)
+            hours = math.ceil((window_end - window_start) / dt.timedelta(hours=1))
+
+            passes = OrbCalculator.get_passes(params['lat'], params['lon'], params['alt'], params['min_elevation'],
+                                              params['min_apogee'], window_start, hours,
+                                              satellites=params['satellites'],
+                                              cancelled=lambda: job.id in self._cancelled)
+
+            start, end = chunk_start.strftime(TIME_FORMAT), chunk_end.strftime(TIME_FORMAT)
+            passes = [data for data in passes if start <= data[1] and (data[1] < end or last)]
+
+            if not self._finish_chunk(job.id, number, passes, done=last):
+                # Расчет отменили, пока считалась часть
+                return
+            self._notify_updated()
+
+    def _finish_chunk(self, job_id: str, number, passes, done: bool = False, error: str = None) -> bool:
+        """
+        Сохраняет пролеты части и продвигает расчет, либо, если указана error, помечает расчет неудавшимся
+        :returns: False, если расчет уже не выполняется (например, отменен)
+        """
+        db_sess = db_session.create_session()
+        try:
+            job = db_sess.query(PassJob).filter(PassJob.id == job_id, PassJob.status == 'running')
+            if error is not None:
+                updated = job.update({'status': 'failed', 'error': error, 'updated_at': time.time()})
+            else:
+                updated = job.update({'chunks_done': number + 1, 'status': 'done' if done else 'running',
+                                      'updated_at': time.time()})
+                if updated:
+                    db_sess.add(PassJobChunk(job_id=job_id, number=number, passes=json.dumps(passes)))
+            db_sess.commit()
+            return bool(updated)
+        finally:
+            db_sess.close()
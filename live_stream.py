@@ -0,0 +1,128 @@
+import datetime as dt
+import logging
+import queue
+import threading
+import time
+import numpy as np
+from catalog import catalog
+import propagators
+
+logger = logging.getLogger(__name__)
+
+# Период (в секундах) обновления положения спутников
+TICK_INTERVAL = 1.0
+
+
+class Subscription:
+    """
+    Подписка на положение спутника. Хранит только последнее расчитанное положение,
+    поэтому медленный клиент не копит очередь устаревших данных
+    """
+
+    def __init__(self, satellite: str, observer: tuple = None):
+        self.satellite = satellite
+        self.observer = observer
+        self._queue = queue.Queue(maxsize=1)
+
+    def put(self, data: dict):
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        self._queue.put_nowait(data)
+
+    def get(self, timeout: float = None) -> dict:
+        """
+        Ждет следующее положение спутника, при истечении timeout бросает queue.Empty
+        """
+        return self._queue.get(timeout=timeout)
+
+
+class LiveStream:
+    """
+    Рассылает текущее положение спутников всем подписчикам. Один фоновый поток раз в interval секунд
+    расчитывает положение каждого спутника, на который есть подписки, ровно один раз, а азимут и элевацию -
+    одним векторизованным вызовом для всех наблюдателей этого спутника. Поток запускается при первой
+    подписке и останавливается, когда подписчиков не остается
+    """
+
+    def __init__(self, interval: float = TICK_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        # {спутник: {наблюдатель или None: {подписка, ...}}}
+        self._subscriptions = {}
+        self._thread = None
+
+    def subscribe(self, satellite: str, observer: tuple = None) -> Subscription:
+        """
+        Подписывает на положение спутника, observer - (lat, lon, alt) наблюдателя или None
+        """
+        satellite = catalog.get_record(satellite).name
+        subscription = Subscription(satellite, observer)
+
+        with self._lock:
+            self._subscriptions.setdefault(satellite, {}).setdefault(observer, set()).add(subscription)
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-stream', daemon=True)
+                self._thread.start()
+
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            observers = self._subscriptions.get(subscription.satellite, {})
+            subscribers = observers.get(subscription.observer, set())
+            subscribers.discard(subscription)
+
+            if not subscribers:
+                observers.pop(subscription.observer, None)
+            if not observers:
+                self._subscriptions.pop(subscription.satellite, None)
+
+    def subscribers_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for observers in self._subscriptions.values()
+                       for subscribers in observers.values())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._subscriptions:
+                    self._thread = None
+                    return
+                subscriptions = {satellite: {observer: list(subscribers) for observer, subscribers in observers.items()}
+                                 for satellite, observers in self._subscriptions.items()}
+
+            self._tick(subscriptions)
+
+            # Выравниваем обновления по границам интервала
+            time.sleep(self.interval - time.time() % self.interval)
+
+    def _tick(self, subscriptions: dict):
+        current_time = dt.datetime.now(tz=dt.timezone.utc)
+        time_string = current_time.strftime('%Y-%m-%d %H:%M:%S')
+
+        for satellite, observers in subscriptions.items():
+            try:
+                orb = propagators.get_orbital(satellite)
+                lon, lat, alt = orb.get_lonlatalt(current_time)
+                position = {'time': time_string, 'lon': float(lon), 'lat': float(lat), 'alt': float(alt)}
+
+                viewers = [observer for observer in observers if observer is not None]
+                if viewers:
+                    viewer_lat, viewer_lon, viewer_alt = np.array(viewers, dtype=float).T
+                    azimuths, elevations = orb.get_observer_look(current_time, viewer_lon, viewer_lat, viewer_alt)
+                    looks = {observer: {'azimuth': round(float(azimuth), 2), 'elevation': round(float(elevation), 2)}
+                             for observer, azimuth, elevation in zip(viewers, azimuths, elevations)}
+            except Exception:
+                logger.exception('Не удалось расчитать положение спутника %s', satellite)
+                continue
+
+            for observer, subscribers in observers.items():
+                data = position if observer is None else {**position, **looks[observer]}
+                for subscription in subscribers:
+                    subscription.put(data)
+
+
+live_stream = LiveStream()
@@ -0,0 +1,267 @@
+from collections import Counter as Tally
+from contextlib import contextmanager
+import bisect
+import contextvars
+import functools
+import os
+import sys
+import threading
+import time
+
+# Границы корзин гистограмм времени (в секундах) и количества вызовов
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+
+# Период (в секундах) опроса стека потока профилировщиком
+PROFILE_INTERVAL = 0.005
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self) -> list:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(key)} {value}' for key, value in values]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Количество наблюдений в каждой корзине (последняя - +Inf) и их сумма
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+
+    def render(self) -> list:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        lines = self.header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик, отдаваемых в текстовом формате Prometheus. Кроме счетчиков и гистограмм,
+    можно зарегистрировать функцию, которая при каждом опросе возвращает текущие значения
+    (например, статистику кеша)
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, description: str) -> Counter:
+        metric = Counter(name, description)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, description, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, description: str, function, kind: str = 'gauge'):
+        """
+        function() возвращает {(('label', 'value'), ...): значение, ...} или одно число
+        """
+        self._collectors.append((name, description, kind, function))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        for name, description, kind, function in self._collectors:
+            try:
+                values = function()
+            except Exception:
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{_format_labels(key)} {float(value)}' for key, value in values.items())
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.histogram('orbitracker_request_duration_seconds', 'Время обработки запроса')
+section_latency = registry.histogram('orbitracker_section_duration_seconds', 'Время выполнения участков кода')
+propagator_calls = registry.counter('orbitracker_propagator_calls_total', 'Количество вызовов расчета положения')
+request_propagator_calls = registry.histogram('orbitracker_request_propagator_calls',
+                                              'Количество вызовов расчета положения за запрос', COUNT_BUCKETS)
+
+# Счетчики текущего запроса: {'propagator_calls': ..., участок: секунды, ...}
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def start_request():
+    _request_stats.set(Tally())
+
+
+def finish_request(route: str, method: str, status: int, duration: float) -> dict:
+    """
+    Записывает время и количество вызовов расчета положения за запрос
+    :returns: счетчики запроса
+    """
+    stats = _request_stats.get() or Tally()
+    _request_stats.set(None)
+
+    request_latency.observe(duration, route=route, method=method, status=status)
+    request_propagator_calls.observe(stats['propagator_calls'], route=route)
+    return stats
+
+
+@contextmanager
+def timed(section: str):
+    """
+    Замеряет время выполнения участка кода
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        section_latency.observe(duration, section=section)
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats[section] += duration
+
+
+def count_propagator_call(method: str):
+    propagator_calls.inc(method=method)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats['propagator_calls'] += 1
+
+
+def instrument_orbital(orbital_class, method: str = 'get_position'):
+    """
+    Подсчитывает вызовы orbital_class.method. Через Orbital.get_position идут и get_lonlatalt,
+    и get_observer_look, и поиск пролетов. В процессах пула вызовы считаются в метриках самих процессов
+    """
+    function = getattr(orbital_class, method)
+    if getattr(function, 'instrumented', False):
+        return
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        count_propagator_call(method)
+        return function(self, *args, **kwargs)
+
+    wrapper.instrumented = True
+    setattr(orbital_class, method, wrapper)
+
+
+def instrument_engine(engine):
+    """
+    Замеряет время SQL запросов движка SQLAlchemy
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        section_latency.observe(duration, section='sqlite')
+
+        stats = _request_stats.get()
+        if stats is not None:
+            stats['sqlite'] += duration
+
+
+class SamplingProfiler:
+    """
+    Профилировщик одного потока: раз в interval секунд снимает стек потока из отдельного потока
+    и считает одинаковые стеки. Результат - формат "свернутых стеков" (folded stacks),
+    который понимают flamegraph.pl, speedscope и inferno
+    """
+
+    def __init__(self, thread_id: int = None, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Tally()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> Tally:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def dump(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f'{stack} {count}\n')
@@ -0,0 +1,129 @@
+import datetime as dt
+import math
+import threading
+from cache import LRUCache
+from calculations import OrbCalculator, SATELLITES
+from catalog import catalog
+
+TIME_FORMAT = '%Y.%m.%d %H:%M:%S'
+
+
+class PassesCache:
+    """
+    Кеш расписаний пролетов перед OrbCalculator.get_passes.
+
+    Координаты наблюдателя округляются до precision знаков после запятой, а время начала -
+    до начала интервала длиной bucket минут. Расписание расчитывается для округленных координат
+    на окно, покрывающее весь интервал, и затем обрезается до запрошенного промежутка, поэтому
+    любой запрос, попадающий в уже расчитанное окно, отдается из кеша.
+    Кеш сбрасывается при изменении каталога TLE
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600, precision: int = 2, alt_precision: int = 2,
+                 bucket: int = 15):
+        self.precision = precision
+        self.alt_precision = alt_precision
+        self.bucket = dt.timedelta(minutes=bucket)
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self._cache = LRUCache(maxsize, ttl)
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self) -> str:
+        version = catalog.version
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._version = version
+        return version
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _floor_to_bucket(self, time: dt.datetime) -> dt.datetime:
+        epoch = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+        return time - (time - epoch) % self.bucket
+
+    def _find_window(self, group: tuple, start_time: dt.datetime, end_time: dt.datetime):
+        """
+        Ищет среди сохраненных окон то, которое покрывает [start_time, end_time]
+        """
+        for key, (window_start, window_end, passes) in reversed(self._cache.items()):
+            if key[:-2] == group and window_start <= start_time and end_time <= window_end:
+                self._cache.touch(key)
+                return passes
+        return None
+
+    def get_passes(self, lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
+                   start_time: dt.datetime, duration: int, satellites: list = None, deadline: float = None,
+                   cancelled=None):
+        """
+        То же, что и OrbCalculator.get_passes, но с использованием кеша
+        """
+        return self._get_passes(lat, lon, alt, min_elevation, min_apogee, start_time, duration, satellites,
+                                deadline, cancelled, compute=True)
+
+    def lookup(self, lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
+               start_time: dt.datetime, duration: int, satellites: list = None):
+        """
+        То же, что и get_passes, но без расчета: если расписания нет в кеше, возвращается None.
+        Позволяет не занимать место для тяжелого расчета, когда ответ уже есть в кеше
+        """
+        return self._get_passes(lat, lon, alt, min_elevation, min_apogee, start_time, duration, satellites,
+                                compute=False)
+
+    def _get_passes(self, lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
+                    start_time: dt.datetime, duration: int, satellites: list = None, deadline: float = None,
+                    cancelled=None, compute: bool = True):
+        version = self._check_version()
+
+        # Время без часового пояса считается временем в UTC
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=dt.timezone.utc)
+        end_time = start_time + dt.timedelta(hours=duration)
+
+        lat, lon = round(lat, self.precision), round(lon, self.precision)
+        alt = round(alt, self.alt_precision)
+        satellites = tuple(SATELLITES if satellites is None else satellites)
+
+        group = (lat, lon, alt, min_elevation, min_apogee, satellites, version)
+        window_start = self._floor_to_bucket(start_time)
+        key = group + (window_start, duration)
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._count('hits')
+            passes = cached[2]
+        else:
+            passes = self._find_window(group, start_time, end_time)
+
+            if passes is not None:
+                self._count('partial_hits')
+            elif not compute:
+                # Промах учитывается при последующем расчете через get_passes
+                return None
+            else:
+                self._count('misses')
+
+                # Окно с запасом на сдвиг начала внутри интервала
+                hours = duration + math.ceil(self.bucket / dt.timedelta(hours=1))
+                passes = tuple(OrbCalculator.get_passes(lat, lon, alt, min_elevation, min_apogee, window_start,
+                                                        hours, satellites=list(satellites), deadline=deadline,
+                                                        cancelled=cancelled))
+                self._cache.set(key, (window_start, window_start + dt.timedelta(hours=hours), passes))
+
+        # Строки времени в формате TIME_FORMAT сравниваются в хронологическом порядке
+        start, end = start_time.strftime(TIME_FORMAT), end_time.strftime(TIME_FORMAT)
+        return [data for data in passes if start <= data[1] and data[2] <= end]
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.partial_hits + self.misses
+        return {'hits': self.hits, 'partial_hits': self.partial_hits, 'misses': self.misses,
+                'size': len(self._cache), 'maxsize': self._cache.maxsize,
+                'hit_ratio': round((self.hits + self.partial_hits) / total, 4) if total else 0.0}
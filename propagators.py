@@ -0,0 +1,258 @@
+import datetime as dt
+import math
+import threading
+import numpy as np
+from pyorbital import astronomy, tlefile
+from pyorbital.orbital import Orbital, A, F, XKMPER, XMNPDA, SECDAY
+from catalog import catalog
+import metrics
+
+try:
+    from sgp4.api import Satrec, SatrecArray, WGS72
+except ImportError:
+    Satrec = SatrecArray = WGS72 = None
+
+# Расчет положения спутников: pyorbital - по одному спутнику (только околоземные орбиты),
+# sgp4 - массивами спутники x моменты одним вызовом (нужен пакет sgp4)
+PROPAGATOR = 'pyorbital'
+
+# Юлианская дата 1970-01-01 00:00 UTC, начало отсчета astronomy.jdays2000 и его юлианская дата
+_UNIX_EPOCH_JD = 2440587.5
+_J2000 = dt.datetime(2000, 1, 1, 12)
+_J2000_JD = 2451545.0
+
+
+def to_datetime64(time) -> np.datetime64:
+    """
+    Переводит datetime в np.datetime64 в UTC. Время без часового пояса считается временем в UTC
+    """
+    if isinstance(time, dt.datetime) and time.tzinfo is not None:
+        time = time.astimezone(dt.timezone.utc).replace(tzinfo=None)
+    return np.datetime64(time, 'us')
+
+
+def eci_to_lonlatalt(times: np.ndarray, positions: np.ndarray):
+    """
+    Переводит положения спутника в инерциальной системе (км) в долготу, широту и высоту
+    так же, как это делает Orbital.get_lonlatalt. positions - массив (3, ...), последняя ось - моменты times
+    """
+    pos_x, pos_y, pos_z = positions / XKMPER
+
+    lon = (np.arctan2(pos_y, pos_x) - astronomy.gmst(times)) % (2 * np.pi)
+    lon = np.where(lon > np.pi, lon - np.pi * 2, lon)
+    lon = np.where(lon <= -np.pi, lon + np.pi * 2, lon)
+
+    r = np.sqrt(pos_x ** 2 + pos_y ** 2)
+    lat = np.arctan2(pos_z, r)
+    e2 = F * (2 - F)
+    while True:
+        lat2 = lat
+        c = 1 / (np.sqrt(1 - e2 * (np.sin(lat2) ** 2)))
+        lat = np.arctan2(pos_z + c * e2 * np.sin(lat2), r)
+        if np.all(abs(lat - lat2) < 1e-10):
+            break
+    alt = (r / np.cos(lat) - c) * A
+
+    return np.rad2deg(lon), np.rad2deg(lat), alt
+
+
+def julian_dates(times: np.ndarray):
+    """
+    Юлианские даты моментов times (np.datetime64, UTC) в виде целой и дробной частей, как их принимает sgp4
+    """
+    days = (np.asarray(times, dtype='datetime64[us]') - np.datetime64(0, 'us')) / np.timedelta64(1, 'D')
+    whole = np.floor(days)
+    return _UNIX_EPOCH_JD + whole, days - whole
+
+
+def jdays2000(utc_time) -> float:
+    """
+    astronomy.jdays2000 для одного момента (datetime или np.datetime64) без накладных расходов numpy
+    """
+    if isinstance(utc_time, dt.datetime):
+        if utc_time.tzinfo is not None:
+            utc_time = utc_time.astimezone(dt.timezone.utc).replace(tzinfo=None)
+        return (utc_time - _J2000) / dt.timedelta(days=1)
+    return float((np.datetime64(utc_time, 'us') - np.datetime64(_J2000, 'us')) / np.timedelta64(1, 'D'))
+
+
+class Sgp4Orbital(Orbital):
+    """
+    Orbital, положение которого расчитывается пакетом sgp4. Остальные методы (азимут и элевация,
+    поиск пролетов) унаследованы от Orbital, поэтому объект взаимозаменяем с ним.
+    В отличие от pyorbital, sgp4 расчитывает и орбиты дальнего космоса
+    """
+
+    def __init__(self, satellite: str, line1: str, line2: str):
+        self.satellite_name = satellite
+        self.tle = tlefile.read(satellite, line1=line1, line2=line2)
+        self.satrec = Satrec.twoline2rv(line1, line2, WGS72)
+
+    def get_position(self, utc_time, normalize=True):
+        scalar = np.ndim(utc_time) == 0
+        times = to_datetime64(utc_time) if scalar else np.asarray(utc_time, dtype='datetime64[us]')
+
+        errors, positions, velocities = self.satrec.sgp4_array(*julian_dates(np.atleast_1d(times)))
+        # Моменты, для которых sgp4 вернул ошибку (например, спутник сошел с орбиты), заполняются nan
+        positions[errors != 0] = np.nan
+        velocities[errors != 0] = np.nan
+
+        positions, velocities = positions.T, velocities.T
+        if scalar:
+            positions, velocities = positions[:, 0], velocities[:, 0]
+        if normalize:
+            positions = positions / XKMPER
+            velocities = velocities / (XKMPER * XMNPDA / SECDAY)
+        return positions, velocities
+
+    def get_position_at(self, days: float):
+        """
+        Положение (x, y, z) в км в один момент, заданный как astronomy.jdays2000, или None при ошибке sgp4
+        """
+        whole = math.floor(days)
+        error, position, _ = self.satrec.sgp4(_J2000_JD + whole, days - whole)
+        return None if error else position
+
+    def get_observer_look(self, utc_time, lon, lat, alt):
+        if np.ndim(utc_time) or np.ndim(lon) or np.ndim(lat) or np.ndim(alt):
+            return super().get_observer_look(utc_time, lon, lat, alt)
+
+        # Для одного момента и одного наблюдателя - те же вычисления, что и в Orbital.get_observer_look
+        # и astronomy.observer_position, но на скалярах: на них приходится большая часть уточнения границ пролетов
+        days = jdays2000(utc_time)
+        position = self.get_position_at(days)
+        if position is None:
+            return math.nan, math.nan
+        pos_x, pos_y, pos_z = position
+
+        # astronomy.gmst
+        ut1 = days / 36525.0
+        theta = 67310.54841 + ut1 * (876600 * 3600 + 8640184.812866 + ut1 * (0.093104 - ut1 * 6.2 * 10e-6))
+        gmst = math.radians(theta / 240.0) % (2 * math.pi)
+
+        lat = math.radians(lat)
+        theta = (gmst + math.radians(lon)) % (2 * math.pi)
+        sin_lat, cos_lat = math.sin(lat), math.cos(lat)
+        sin_theta, cos_theta = math.sin(theta), math.cos(theta)
+
+        # Положение наблюдателя в инерциальной системе
+        c = 1 / math.sqrt(1 + F * (F - 2) * sin_lat ** 2)
+        sq = c * (1 - F) ** 2
+        achcp = (A * c + alt) * cos_lat
+
+        rx = pos_x - achcp * cos_theta
+        ry = pos_y - achcp * sin_theta
+        rz = pos_z - (A * sq + alt) * sin_lat
+
+        top_s = sin_lat * cos_theta * rx + sin_lat * sin_theta * ry - cos_lat * rz
+        top_e = -sin_theta * rx + cos_theta * ry
+        top_z = cos_lat * cos_theta * rx + cos_lat * sin_theta * ry + sin_lat * rz
+
+        azimuth = (math.atan2(-top_e, top_s) + math.pi) % (2 * math.pi)
+        elevation = math.asin(min(top_z / math.sqrt(rx * rx + ry * ry + rz * rz), 1))
+        return math.degrees(azimuth), math.degrees(elevation)
+
+
+class PyorbitalPropagator:
+    """
+    Расчет положения по одному спутнику через pyorbital.orbital.Orbital
+    """
+    name = 'pyorbital'
+    # Расчитывает ли get_positions много спутников быстрее, чем по одному
+    vectorized = False
+
+    def get_orbital(self, satellite: str) -> Orbital:
+        return catalog.get_orbital(satellite)
+
+    def supports(self, satellite: str) -> bool:
+        """
+        Может ли положение спутника быть расчитано (pyorbital не умеет расчитывать орбиты дальнего космоса)
+        """
+        try:
+            self.get_orbital(satellite)
+        except NotImplementedError:
+            return False
+        return True
+
+    def get_positions(self, satellites: list, times: np.ndarray) -> np.ndarray:
+        """
+        Положения спутников в инерциальной системе в моменты times (np.datetime64, UTC)
+        :returns: массив (3, спутники, моменты) в км
+        """
+        positions = np.empty((3, len(satellites), len(times)))
+        for i, satellite in enumerate(satellites):
+            positions[:, i], _ = self.get_orbital(satellite).get_position(times, normalize=False)
+        return positions
+
+
+class Sgp4Propagator(PyorbitalPropagator):
+    """
+    Расчет положения пакетом sgp4: положения многих спутников во многие моменты расчитываются
+    одним вызовом SatrecArray без цикла на Python
+    """
+    name = 'sgp4'
+    vectorized = True
+
+    def __init__(self):
+        if Satrec is None:
+            raise ImportError('Для расчета положения через sgp4 нужен пакет sgp4')
+        self._orbitals = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_orbital(self, satellite: str) -> Sgp4Orbital:
+        record = catalog.get_record(satellite)
+        version = catalog.version
+
+        with self._lock:
+            # При изменении каталога объекты создаются заново по новым TLE
+            if version != self._version:
+                self._orbitals = {}
+                self._version = version
+
+            orb = self._orbitals.get(record.name)
+            if orb is None:
+                orb = self._orbitals[record.name] = Sgp4Orbital(record.name, record.line1, record.line2)
+        return orb
+
+    def supports(self, satellite: str) -> bool:
+        return True
+
+    def get_positions(self, satellites: list, times: np.ndarray) -> np.ndarray:
+        metrics.count_propagator_call('sgp4_array')
+
+        satrecs = SatrecArray([self.get_orbital(satellite).satrec for satellite in satellites])
+        errors, positions, _ = satrecs.sgp4(*julian_dates(times))
+        positions[errors != 0] = np.nan
+        return np.moveaxis(positions, -1, 0)
+
+
+PROPAGATORS = {propagator.name: propagator for propagator in (PyorbitalPropagator, Sgp4Propagator)}
+
+_propagator = PyorbitalPropagator()
+# Уже созданные объекты расчета положения, чтобы при переключении не терять их кеши
+_propagators = {_propagator.name: _propagator}
+
+
+def set_propagator(backend: str = PROPAGATOR):
+    """
+    Выбирает способ расчета положения спутников для всего процесса: pyorbital или sgp4
+    """
+    global _propagator
+
+    if backend not in PROPAGATORS:
+        raise ValueError(f'Неизвестный способ расчета положения: {backend}')
+    if backend not in _propagators:
+        _propagators[backend] = PROPAGATORS[backend]()
+    _propagator = _propagators[backend]
+
+
+def get_propagator():
+    return _propagator
+
+
+def get_orbital(satellite: str) -> Orbital:
+    """
+    Объект Orbital (или совместимый с ним) для спутника в выбранном способе расчета положения
+    """
+    return _propagator.get_orbital(satellite)
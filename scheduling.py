@@ -0,0 +1,229 @@
+import heapq
+import numpy as np
+
+
+def pass_times(passes: list):
+    """
+    Переводит время начала и конца пролетов из строк OrbCalculator.get_passes в секунды от 1970-01-01 UTC
+    :returns: (starts, ends) - массивы float
+    """
+    if not passes:
+        return np.empty(0), np.empty(0)
+
+    # 2024.01.02 03:04:05 -> 2024-01-02T03:04:05, такие строки numpy разбирает сразу всем массивом
+    times = np.array([f'{data[1][:4]}-{data[1][5:7]}-{data[1][8:10]}T{data[1][11:]}' for data in passes] +
+                     [f'{data[2][:4]}-{data[2][5:7]}-{data[2][8:10]}T{data[2][11:]}' for data in passes],
+                     dtype='datetime64[s]').astype(float)
+    return times[:len(passes)], times[len(passes):]
+
+
+def find_overlaps(starts: np.ndarray, ends: np.ndarray, gap: float = 0):
+    """
+    Находит пролеты, пересекающиеся хотя бы с одним другим, проходом по пролетам в порядке начала.
+    Пролеты пересекаются, если между концом одного и началом другого меньше gap секунд
+    (например, времени на перенаведение антенны)
+    :returns: (does_overlap - массив bool, max_concurrent - наибольшее количество одновременных пролетов)
+    """
+    count = len(starts)
+    if not count:
+        return np.zeros(0, dtype=bool), 0
+
+    order = np.argsort(starts, kind='stable')
+    sorted_starts, sorted_ends = starts[order], ends[order] + gap
+
+    # Пролет пересекается с одним из предыдущих, если начинается раньше самого позднего конца среди них,
+    # и со следующими, если заканчивается позже начала следующего
+    previous_end = np.maximum.accumulate(sorted_ends)
+    overlaps = np.zeros(count, dtype=bool)
+    overlaps[1:] |= sorted_starts[1:] < previous_end[:-1]
+    overlaps[:-1] |= sorted_ends[:-1] > sorted_starts[1:]
+
+    does_overlap = np.empty(count, dtype=bool)
+    does_overlap[order] = overlaps
+
+    # Количество одновременных пролетов: +1 в начале каждого и -1 в конце, концы раньше начал в тот же момент
+    events = np.concatenate([np.column_stack([sorted_starts, np.ones(count)]),
+                             np.column_stack([sorted_ends, -np.ones(count)])])
+    events = events[np.lexsort((events[:, 1], events[:, 0]))]
+    max_concurrent = int(np.max(np.cumsum(events[:, 1])))
+
+    return does_overlap, max_concurrent
+
+
+def schedule_one(starts: np.ndarray, ends: np.ndarray, values: np.ndarray, gap: float = 0) -> np.ndarray:
+    """
+    Оптимальный план для одной антенны (взвешенное планирование интервалов) динамическим программированием
+    :returns: номера выбранных пролетов в порядке начала
+    """
+    count = len(starts)
+    if not count:
+        return np.zeros(0, dtype=int)
+
+    order = np.argsort(ends + gap, kind='stable')
+    sorted_ends = (ends + gap)[order]
+    # previous[j] - сколько пролетов (в порядке конца) успевает закончиться до начала пролета j
+    previous = np.searchsorted(sorted_ends, starts[order], side='right').tolist()
+    sorted_values = values[order].tolist()
+
+    # best[j] - наибольшая ценность плана из первых j пролетов
+    best = [0.0] * (count + 1)
+    for j in range(count):
+        take = sorted_values[j] + best[previous[j]]
+        best[j + 1] = take if take > best[j] else best[j]
+
+    chosen = []
+    j = count
+    while j > 0:
+        if best[j] != best[j - 1]:
+            chosen.append(order[j - 1])
+            j = previous[j - 1]
+        else:
+            j -= 1
+
+    return np.array(chosen[::-1], dtype=int)
+
+
+def _min_cost_plan(starts: np.ndarray, ends: np.ndarray, values: np.ndarray, antennas: int, gap: float) -> list:
+    """
+    Оптимальный набор пролетов для нескольких одинаковых антенн через поток минимальной стоимости:
+    вершины - моменты времени по порядку, ребра между соседними моментами пропускают antennas единиц потока
+    бесплатно, а ребро пролета от его начала до конца пропускает одну единицу со стоимостью -ценность.
+    Каждая единица потока - план одной антенны, поток наращивается по кратчайшим путям (с потенциалами)
+    :returns: номера выбранных пролетов
+    """
+    count = len(starts)
+    points, index = np.unique(np.concatenate([starts, ends + gap]), return_inverse=True)
+    begin, finish = index[:count].tolist(), index[count:].tolist()
+    nodes = len(points)
+
+    # Остаточная сеть: ребро - [куда, пропускная способность, стоимость, номер обратного ребра]
+    graph = [[] for _ in range(nodes)]
+
+    def add_edge(u, v, capacity, cost):
+        graph[u].append([v, capacity, cost, len(graph[v])])
+        graph[v].append([u, 0, -cost, len(graph[u]) - 1])
+
+    for u in range(nodes - 1):
+        add_edge(u, u + 1, antennas, 0.0)
+    pass_edges = []
+    for j in range(count):
+        pass_edges.append((begin[j], len(graph[begin[j]])))
+        add_edge(begin[j], finish[j], 1, -float(values[j]))
+
+    # Начальные потенциалы - кратчайшие расстояния в ациклическом графе (все ребра идут вперед по времени)
+    potential = [0.0] * nodes
+    for u in range(nodes):
+        for v, capacity, cost, _ in graph[u]:
+            if capacity > 0 and v > u and potential[u] + cost < potential[v]:
+                potential[v] = potential[u] + cost
+
+    source, sink = 0, nodes - 1
+    for _ in range(antennas):
+        distance = [float('inf')] * nodes
+        parent = [None] * nodes
+        distance[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > distance[u]:
+                continue
+            for i, (v, capacity, cost, _) in enumerate(graph[u]):
+                if capacity <= 0:
+                    continue
+                # Приведенная стоимость неотрицательна, поправка - от ошибок округления
+                nd = d + max(cost + potential[u] - potential[v], 0.0)
+                if nd < distance[v]:
+                    distance[v] = nd
+                    parent[v] = (u, i)
+                    heapq.heappush(heap, (nd, v))
+
+        for u in range(nodes):
+            potential[u] += distance[u]
+
+        # Путь, стоимость которого не меньше нуля, план не улучшает
+        if potential[sink] - potential[source] >= 0:
+            break
+
+        v = sink
+        while v != source:
+            u, i = parent[v]
+            edge = graph[u][i]
+            edge[1] -= 1
+            graph[v][edge[3]][1] += 1
+            v = u
+
+    return [j for j, (u, i) in enumerate(pass_edges) if graph[u][i][1] == 0]
+
+
+def schedule_many(starts: np.ndarray, ends: np.ndarray, values: np.ndarray, antennas: int,
+                  gap: float = 0) -> np.ndarray:
+    """
+    Оптимальный план для нескольких одинаковых антенн. Пролеты разбиваются на группы, которые
+    не пересекаются между собой; если в группе одновременно идет не больше antennas пролетов,
+    сопровождаются все, иначе группа планируется через поток минимальной стоимости
+    :returns: номер антенны для каждого пролета или -1, если пролет не выбран
+    """
+    count = len(starts)
+    assignment = np.full(count, -1, dtype=int)
+    if not count:
+        return assignment
+
+    order = np.argsort(starts, kind='stable')
+    sorted_ends = (ends + gap)[order]
+    # Новая группа начинается с пролета, который начинается не раньше конца всех предыдущих
+    previous_end = np.maximum.accumulate(sorted_ends)
+    boundaries = np.flatnonzero(starts[order][1:] >= previous_end[:-1]) + 1
+
+    chosen = []
+    for group in np.split(order, boundaries):
+        _, max_concurrent = find_overlaps(starts[group], ends[group], gap)
+        if max_concurrent <= antennas:
+            chosen.extend(group.tolist())
+        else:
+            plan = _min_cost_plan(starts[group], ends[group], values[group], antennas, gap)
+            chosen.extend(group[plan].tolist())
+
+    # Выбранные пролеты одновременно занимают не больше antennas антенн, поэтому их можно раздать
+    # по порядку начала: каждый пролет достается антенне, освободившейся раньше других
+    free_antennas = [(-float('inf'), antenna) for antenna in range(antennas)]
+    for j in sorted(chosen, key=lambda j: starts[j]):
+        free_at, antenna = heapq.heappop(free_antennas)
+        assignment[j] = antenna
+        heapq.heappush(free_antennas, (ends[j] + gap, antenna))
+
+    return assignment
+
+
+def make_schedule(passes: list, antennas: int = 1, priorities: dict = None, gap: float = 0) -> dict:
+    """
+    Строит план сопровождения пролетов из OrbCalculator.get_passes.
+    Ценность пролета - его длительность в секундах, умноженная на приоритет спутника из priorities
+    (по умолчанию 1, спутники с нулевым приоритетом не сопровождаются)
+    :returns: {'passes': [{satellite, start_time, end_time, apogee, does_overlap, antenna}, ...],
+               'max_concurrent': ..., 'scheduled': ..., 'value': ...}
+    """
+    priorities = priorities or {}
+    starts, ends = pass_times(passes)
+    weights = np.array([float(priorities.get(data[0], 1)) for data in passes])
+    values = weights * (ends - starts)
+
+    does_overlap, max_concurrent = find_overlaps(starts, ends, gap)
+
+    # Пролеты с неположительной ценностью план не улучшают
+    candidates = np.flatnonzero(values > 0)
+    assignment = np.full(len(passes), -1, dtype=int)
+    if antennas == 1:
+        assignment[candidates[schedule_one(starts[candidates], ends[candidates], values[candidates], gap)]] = 0
+    else:
+        assignment[candidates] = schedule_many(starts[candidates], ends[candidates], values[candidates],
+                                               antennas, gap)
+
+    scheduled = assignment >= 0
+    return {
+        'passes': [{'satellite': data[0], 'start_time': data[1], 'end_time': data[2], 'apogee': data[3],
+                    'does_overlap': bool(overlap), 'antenna': int(antenna) if antenna >= 0 else None}
+                   for data, overlap, antenna in zip(passes, does_overlap, assignment)],
+        'max_concurrent': max_concurrent,
+        'scheduled': int(np.count_nonzero(scheduled)),
+        'value': round(float(values[scheduled].sum()), 2),
+    }
@@ -0,0 +1,104 @@
+from bisect import bisect_left, bisect_right
+import re
+
+# Максимальное количество результатов поиска
+MAX_SEARCH_LIMIT = 100
+
+
+def normalize(text: str) -> str:
+    text = ' '.join(str(text).upper().split())
+    # Международное обозначение в полной записи (1998-067A) приводится к виду из TLE (98067A)
+    return re.sub(r'^(?:19|20)(\d\d)-(\d{3}[A-Z]*)$', r'\1\2', text)
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class PrefixIndex:
+    """
+    Префиксное дерево, развернутое в отсортированный массив ключей: все ключи с общим префиксом
+    лежат подряд, и поддерево префикса находится двумя бинарными поисками
+    """
+
+    def __init__(self, items: list):
+        items = sorted(items)
+        self._keys = [key for key, _ in items]
+        self._ids = [record_id for _, record_id in items]
+
+    def find(self, prefix: str):
+        """
+        Номера записей с ключами, начинающимися с prefix, в алфавитном порядке ключей
+        """
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_right(self._keys, prefix + '\uffff', lo)
+        for i in range(lo, hi):
+            yield self._ids[i]
+
+
+class SearchIndex:
+    """
+    Индекс для поиска спутников по названию, номеру NORAD и международному обозначению.
+    Результаты упорядочены по типу совпадения: точное совпадение, начало названия, начало слова в названии,
+    начало номера или обозначения и, наконец, подстрока (ищется по пересечению триграмм).
+    Внутри одного типа совпадения упорядочены по алфавиту, а подстроки - в порядке каталога,
+    поэтому поиск останавливается, как только набрано limit результатов
+    """
+
+    def __init__(self, records: list):
+        self.records = records
+        self._exact = {}
+        self._texts = []
+        self._trigrams = {}
+        names, words, designators = [], [], []
+
+        for record_id, record in enumerate(records):
+            name = normalize(record.name)
+            fields = [name] + [field for field in {record.norad_id, record.norad_id.lstrip('0'),
+                                                   record.intl_designator} if field]
+
+            names.append((name, record_id))
+            words.extend((word, record_id) for word in re.findall(r'[A-Z0-9]+', name)[1:])
+            designators.extend((field, record_id) for field in fields[1:])
+
+            for field in fields:
+                self._exact.setdefault(field, []).append(record_id)
+
+            # Поля разделены переводом строки, чтобы подстрока не находилась на стыке двух полей
+            text = '\n'.join(fields)
+            self._texts.append(text)
+            for trigram in trigrams(text):
+                self._trigrams.setdefault(trigram, []).append(record_id)
+
+        self._prefixes = [PrefixIndex(names), PrefixIndex(words), PrefixIndex(designators)]
+
+    def _substring(self, query: str):
+        postings = [self._trigrams.get(trigram, []) for trigram in trigrams(query)]
+        if not postings:
+            return
+
+        # Достаточно проверить записи из самого короткого списка триграммы
+        for record_id in min(postings, key=len):
+            if query in self._texts[record_id]:
+                yield record_id
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        :returns: [TleRecord, ...] - не больше limit записей, лучшие совпадения первыми
+        """
+        query = normalize(query)
+        if not query or limit <= 0:
+            return []
+
+        found = {}
+        sources = [self._exact.get(query, [])] + [prefix.find(query) for prefix in self._prefixes]
+        if len(query) >= 3:
+            sources.append(self._substring(query))
+
+        for source in sources:
+            for record_id in source:
+                found.setdefault(record_id, None)
+                if len(found) >= limit:
+                    return [self.records[record_id] for record_id in found]
+
+        return [self.records[record_id] for record_id in found]
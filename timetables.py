@@ -0,0 +1,313 @@
+import datetime as dt
+import logging
+import math
+import threading
+import time
+import numpy as np
+import sqlalchemy as sa
+from calculations import OrbCalculator, SATELLITES
+from catalog import catalog
+import propagators
+from propagators import to_datetime64
+from data import db_session
+from data.timetables import Timetable, TimetablePass
+from data.users import User
+
+logger = logging.getLogger(__name__)
+
+TIME_FORMAT = '%Y.%m.%d %H:%M:%S'
+
+# На сколько часов вперед расчитаны расписания, сколько часов прошедших пролетов в них хранится
+# и запас окна расчета (в часах) с каждой стороны, чтобы пролеты на границе находились так же, как при расчете целиком
+TIMETABLES_HOURS = 48
+TIMETABLES_KEEP = 1
+TIMETABLES_MARGIN = 2
+# Как часто расписания продлеваются (в секундах) и через сколько секунд без обращений расписание удаляется
+TIMETABLES_REFRESH_INTERVAL = 600
+TIMETABLES_TTL = 7 * 24 * 3600
+# Как часто (в секундах) при обращении обновляется время последнего использования расписания
+TIMETABLES_TOUCH_INTERVAL = 60
+
+
+def _format(timestamp: float) -> str:
+    return dt.datetime.fromtimestamp(timestamp, dt.timezone.utc).strftime(TIME_FORMAT)
+
+
+def elevation_offsets(satellite: str, lat: float, lon: float, alt: float, start: str, end: str) -> tuple:
+    """
+    Смещения начала и конца пролета (start, end в формате TIME_FORMAT) для каждой целой элевации k
+    от 1 до наибольшей в пролете: первая целая секунда от начала, в которую элевация не меньше k,
+    и первая такая секунда от конца. Так же границы пролета ищутся в OrbCalculator.filter_passes,
+    поэтому пролет с любым min_elevation получается из пролета с min_elevation = 0 с точностью до секунды
+    :returns: (rise_offsets, set_offsets) - смещения в секундах через пробел
+    """
+    start_time, end_time = dt.datetime.strptime(start, TIME_FORMAT), dt.datetime.strptime(end, TIME_FORMAT)
+    seconds = np.arange(int((end_time - start_time).total_seconds()) + 1) * np.timedelta64(1, 's')
+    orbital = propagators.get_orbital(satellite)
+
+    offsets = []
+    for times in (to_datetime64(start_time) + seconds, to_datetime64(end_time) - seconds):
+        elevation = np.nan_to_num(np.asarray(orbital.get_observer_look(times, lon, lat, alt)[1], dtype=float),
+                                  nan=-90)
+        # До кульминации элевация возрастает, а накопленный максимум не убывает даже при погрешностях расчета
+        rising = np.maximum.accumulate(elevation[:np.argmax(elevation) + 1])
+        levels = np.arange(1, math.floor(rising[-1]) + 1)
+        offsets.append(' '.join(str(offset) for offset in np.searchsorted(rising, levels)))
+    return tuple(offsets)
+
+
+def _apply_offsets(start: str, end: str, rise_offsets: str, set_offsets: str, min_elevation: float) -> tuple:
+    """
+    Начало и конец пролета, из которого убраны части с элевацией меньше min_elevation
+    """
+    # Как и в OrbCalculator.filter_passes, элевация сравнивается с ближайшим сверху целым числом
+    level = math.ceil(min_elevation)
+    if level <= 0:
+        return start, end
+
+    rise_offsets, set_offsets = rise_offsets.split(), set_offsets.split()
+    if level <= len(rise_offsets):
+        start = (dt.datetime.strptime(start, TIME_FORMAT) +
+                 dt.timedelta(seconds=int(rise_offsets[level - 1]))).strftime(TIME_FORMAT)
+    if level <= len(set_offsets):
+        end = (dt.datetime.strptime(end, TIME_FORMAT) -
+               dt.timedelta(seconds=int(set_offsets[level - 1]))).strftime(TIME_FORMAT)
+    return start, end
+
+
+class Timetables:
+    """
+    Расписания пролетов на ближайшие hours часов для точек наблюдения, сохраненных пользователями.
+    Расписание хранится в таблицах timetables и timetable_passes и создается при первом обращении
+    пользователя с сохраненными координатами к /passes. Поток обновления продлевает расписания по мере хода
+    времени, расчитывая только новые часы и удаляя прошедшие пролеты, а при изменении каталога TLE
+    расчитывает расписание заново. Координаты округляются до precision знаков, как в PassesCache,
+    поэтому пользователи в почти одной точке пользуются одним расписанием. Расписание одно на точку
+    наблюдения: пролеты хранятся с min_elevation = 0, а другие min_elevation учитываются при чтении
+    """
+
+    def __init__(self, satellites=None, hours: int = TIMETABLES_HOURS, keep: int = TIMETABLES_KEEP,
+                 margin: int = TIMETABLES_MARGIN, interval: float = TIMETABLES_REFRESH_INTERVAL,
+                 ttl: float = TIMETABLES_TTL, precision: int = 2, alt_precision: int = 2):
+        # Функция, возвращающая список спутников для расчета (по умолчанию SATELLITES)
+        self.satellites = satellites or (lambda: SATELLITES)
+        self.hours = hours
+        self.keep = keep
+        self.margin = margin
+        self.interval = interval
+        self.ttl = ttl
+        self.precision = precision
+        self.alt_precision = alt_precision
+        self.hits = 0
+        self.misses = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        # Будит поток обновления, когда появилось новое или устаревшее расписание
+        self._wakeup = threading.Event()
+
+    def start(self):
+        """
+        Запускает поток, продлевающий расписания
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='timetables', daemon=True)
+            self._thread.start()
+
+    def make_key(self, lat: float, lon: float, alt: float) -> tuple:
+        """
+        Округленные координаты точки наблюдения и id ее расписания
+        :returns: (id, lat, lon, alt)
+        """
+        lat, lon = round(lat, self.precision), round(lon, self.precision)
+        alt = round(alt, self.alt_precision)
+        return f'{lat:g}:{lon:g}:{alt:g}', lat, lon, alt
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_passes(self, db_sess, lat: float, lon: float, alt: float, min_elevation: float, min_apogee: float,
+                   start_time: dt.datetime, duration: int):
+        """
+        То же, что и OrbCalculator.get_passes, но из расписания точки наблюдения. Если расписания нет,
+        оно создается (и расчитывается потоком обновления), а пока его нет или оно не покрывает
+        запрошенный промежуток, возвращается None и расписание нужно расчитать обычным способом.
+        db_sess - сессия базы данных текущего запроса
+        """
+        timetable_id, lat, lon, alt = self.make_key(lat, lon, alt)
+
+        # Время без часового пояса считается временем в UTC
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=dt.timezone.utc)
+        end_time = start_time + dt.timedelta(hours=duration)
+        now = time.time()
+
+        timetable = db_sess.get(Timetable, timetable_id)
+        if timetable is None:
+            db_sess.add(Timetable(id=timetable_id, lat=lat, lon=lon, alt=alt, window_start=0, window_end=0,
+                                  used_at=now))
+            try:
+                db_sess.commit()
+            except sa.exc.IntegrityError:
+                # Расписание одновременно создал другой запрос
+                db_sess.rollback()
+            self._wakeup.set()
+            self._count('misses')
+            return None
+
+        if timetable.used_at < now - TIMETABLES_TOUCH_INTERVAL:
+            timetable.used_at = now
+            db_sess.commit()
+
+        covered = timetable.window_start <= start_time.timestamp() and end_time.timestamp() <= timetable.window_end
+        if timetable.catalog_version != catalog.version or not covered:
+            self._wakeup.set()
+            self._count('misses')
+            return None
+
+        # Строки времени в формате TIME_FORMAT сравниваются в хронологическом порядке. Границы пролета
+        # сдвигаются внутрь при учете min_elevation, поэтому отбираются все пролеты, пересекающие промежуток
+        start, end = start_time.strftime(TIME_FORMAT), end_time.strftime(TIME_FORMAT)
+        rows = db_sess.query(TimetablePass.satellite, TimetablePass.start_time, TimetablePass.end_time,
+                             TimetablePass.apogee, TimetablePass.rise_offsets, TimetablePass.set_offsets) \
+            .filter(TimetablePass.timetable_id == timetable_id, TimetablePass.start_time <= end,
+                    TimetablePass.end_time >= start, TimetablePass.apogee >= min_apogee) \
+            .order_by(TimetablePass.start_time, TimetablePass.id).all()
+
+        passes = []
+        for satellite, pass_start, pass_end, apogee, rise_offsets, set_offsets in rows:
+            pass_start, pass_end = _apply_offsets(pass_start, pass_end, rise_offsets, set_offsets, min_elevation)
+            if start <= pass_start and pass_end <= end:
+                passes.append((satellite, pass_start, pass_end, apogee))
+        passes.sort(key=lambda data: data[1])
+
+        self._count('hits')
+        return passes
+
+    def release(self, db_sess, lat: float, lon: float, alt: float):
+        """
+        Удаляет расписание точки наблюдения, если ее больше не сохранил ни один пользователь.
+        Вызывается после изменения пользователем своих координат, db_sess - сессия базы данных текущего запроса
+        """
+        if lat is None or lon is None or alt is None:
+            return
+        timetable_id, lat, lon, alt = self.make_key(lat, lon, alt)
+        step = 10 ** -self.precision
+
+        candidates = db_sess.query(User.lat, User.lon, User.alt) \
+            .filter(User.lat.between(lat - step, lat + step), User.lon.between(lon - step, lon + step),
+                    User.alt.isnot(None)).all()
+        if any(self.make_key(*coords)[1:] == (lat, lon, alt) for coords in candidates):
+            return
+
+        self._delete(db_sess, [timetable_id])
+
+    def stats(self) -> dict:
+        db_sess = db_session.create_session()
+        try:
+            size = db_sess.query(sa.func.count(Timetable.id)).scalar()
+        finally:
+            db_sess.close()
+
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': size,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0}
+
+    @staticmethod
+    def _delete(db_sess, timetable_ids: list):
+        if timetable_ids:
+            db_sess.query(TimetablePass).filter(TimetablePass.timetable_id.in_(timetable_ids)) \
+                .delete(synchronize_session=False)
+            db_sess.query(Timetable).filter(Timetable.id.in_(timetable_ids)).delete(synchronize_session=False)
+            db_sess.commit()
+
+    def refresh(self):
+        """
+        Удаляет давно не используемые расписания и продлевает остальные до текущего момента + hours часов
+        """
+        now = time.time()
+
+        db_sess = db_session.create_session()
+        try:
+            expired = [timetable_id for timetable_id, in db_sess.query(Timetable.id)
+                       .filter(Timetable.used_at < now - self.ttl).all()]
+            self._delete(db_sess, expired)
+
+            timetables = db_sess.query(Timetable).all()
+            db_sess.expunge_all()
+        finally:
+            db_sess.close()
+
+        for timetable in timetables:
+            try:
+                self._extend(timetable, now)
+            except Exception:
+                logger.exception('Не удалось продлить расписание %s', timetable.id)
+
+    def _extend(self, timetable: Timetable, now: float):
+        # Границы расписания выравниваются по целым часам
+        hour = math.floor(now / 3600) * 3600
+        window_start = hour - self.keep * 3600
+        window_end = hour + self.hours * 3600
+        version = catalog.version
+
+        if timetable.catalog_version != version or timetable.window_end <= window_start:
+            # Расписание по старому каталогу или давно не продлевавшееся расчитывается заново
+            compute_from, reset = window_start, True
+        else:
+            compute_from, reset = timetable.window_end, False
+            window_start = max(window_start, timetable.window_start)
+            if compute_from >= window_end and window_start == timetable.window_start:
+                return
+
+        passes = self._compute(timetable, compute_from, window_end) if compute_from < window_end else []
+
+        db_sess = db_session.create_session()
+        try:
+            # Расписание меняется, только если его не изменил параллельно другой процесс
+            updated = db_sess.query(Timetable) \
+                .filter(Timetable.id == timetable.id, Timetable.window_end == timetable.window_end,
+                        Timetable.catalog_version == timetable.catalog_version) \
+                .update({'catalog_version': version, 'window_start': window_start,
+                         'window_end': max(window_end, compute_from)}, synchronize_session=False)
+            if not updated:
+                db_sess.rollback()
+                return
+
+            old_passes = db_sess.query(TimetablePass).filter(TimetablePass.timetable_id == timetable.id)
+            if not reset:
+                old_passes = old_passes.filter(TimetablePass.start_time < _format(window_start))
+            old_passes.delete(synchronize_session=False)
+
+            db_sess.add_all([TimetablePass(timetable_id=timetable.id, satellite=satellite, start_time=start,
+                                           end_time=end, apogee=apogee, rise_offsets=rise_offsets,
+                                           set_offsets=set_offsets)
+                             for satellite, start, end, apogee, rise_offsets, set_offsets in passes])
+            db_sess.commit()
+        finally:
+            db_sess.close()
+
+    def _compute(self, timetable: Timetable, compute_from: float, compute_to: float) -> list:
+        """
+        Пролеты с min_elevation = 0, начинающиеся в [compute_from, compute_to), вместе со смещениями
+        elevation_offsets. Пролет может начать восходить и закончиться за границами промежутка,
+        поэтому окно расчета шире на margin часов с каждой стороны
+        """
+        start_time = dt.datetime.fromtimestamp(compute_from, dt.timezone.utc) - dt.timedelta(hours=self.margin)
+        hours = math.ceil((compute_to - compute_from) / 3600) + 2 * self.margin
+
+        passes = OrbCalculator.get_passes(timetable.lat, timetable.lon, timetable.alt, 0, 0, start_time, hours,
+                                          satellites=self.satellites())
+
+        start, end = _format(compute_from), _format(compute_to)
+        return [data + elevation_offsets(data[0], timetable.lat, timetable.lon, timetable.alt, data[1], data[2])
+                for data in passes if start <= data[1] < end]
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Не удалось обновить расписания')
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
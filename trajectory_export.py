@@ -0,0 +1,81 @@
+from io import BytesIO
+import datetime as dt
+import numpy as np
+
+# Запись бинарного формата: время (секунды от 1970-01-01 UTC), азимут и элевация (в градусах)
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('azimuth', '<f4'), ('elevation', '<f4')])
+
+
+def _time_unit(step: float) -> str:
+    return 's' if float(step).is_integer() else 'ms'
+
+
+def tsv(chunks, satellite: str, start_time: dt.datetime, end_time: dt.datetime, step: float):
+    """
+    Текстовый файл с заголовком и столбцами "время, азимут, элевация", разделенными табуляцией.
+    Если траектория длиннее суток, время выводится вместе с датой
+    """
+    header = f'Спутник {satellite}\n'
+    header += f'Начальная дата и время {start_time.strftime("%Y-%m-%d %H:%M:%S UTC")}\n'
+    header += '\n'
+    header += 'Время (UTC)\tАзимут\tЭлевация\n'
+    header += '\n'
+    yield header.encode('utf-8')
+
+    unit = _time_unit(step)
+    with_date = end_time - start_time > dt.timedelta(days=1)
+
+    for chunk in chunks:
+        times = np.datetime_as_string(chunk.times, unit=unit)
+        if not with_date:
+            times = [time[11:] for time in times]
+        else:
+            times = [time.replace('T', ' ') for time in times]
+
+        yield ''.join(f'{time}\t{azimuth:.2f}\t{elevation:.2f}\n'
+                      for time, azimuth, elevation in zip(times, chunk.azimuth, chunk.elevation)).encode('utf-8')
+
+
+def csv(chunks, satellite: str, start_time: dt.datetime, end_time: dt.datetime, step: float):
+    """
+    CSV со столбцами time (ISO 8601, UTC), azimuth, elevation
+    """
+    yield b'time,azimuth,elevation\n'
+
+    unit = _time_unit(step)
+
+    for chunk in chunks:
+        times = np.datetime_as_string(chunk.times, unit=unit)
+        yield ''.join(f'{time}Z,{azimuth:.2f},{elevation:.2f}\n'
+                      for time, azimuth, elevation in zip(times, chunk.azimuth, chunk.elevation)).encode('utf-8')
+
+
+def npy(chunks, satellite: str, start_time: dt.datetime, end_time: dt.datetime, step: float):
+    """
+    Одномерный массив записей RECORD_DTYPE в формате .npy (читается через numpy.load)
+    """
+    # Количество точек считается в микросекундах, так же как строится сетка времени в OrbCalculator.get_trajectory
+    step_us = round(step * 1e6)
+    count = max(0, -(-round((end_time - start_time) / dt.timedelta(microseconds=1)) // step_us))
+
+    header = BytesIO()
+    np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(RECORD_DTYPE),
+                                                  'fortran_order': False, 'shape': (count,)})
+    yield header.getvalue()
+
+    for chunk in chunks:
+        records = np.empty(len(chunk.times), dtype=RECORD_DTYPE)
+        records['time'] = (chunk.times - np.datetime64(0, 'us')) / np.timedelta64(1, 's')
+        records['azimuth'] = chunk.azimuth
+        records['elevation'] = chunk.elevation
+        yield records.tobytes()
+
+
+# Форматы выгрузки траектории: (генератор, MIME-тип, расширение файла). Каждый генератор получает
+# траекторию частями (см. OrbCalculator.iter_trajectory) и сразу отдает готовые байты,
+# поэтому файл любой длины выгружается без накопления в памяти
+FORMATS = {
+    'tsv': (tsv, 'text/plain', 'txt'),
+    'csv': (csv, 'text/csv', 'csv'),
+    'npy': (npy, 'application/octet-stream', 'npy'),
+}
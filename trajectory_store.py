@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import json
+import secrets
+import threading
+import time
+import numpy as np
+import sqlalchemy as sa
+from data import db_session
+from data.trajectories import PassTrajectory
+
+# Время жизни траектории (в секундах) и ограничение на суммарный размер хранимых траекторий (в байтах)
+TRAJECTORY_TTL = 6 * 3600
+TRAJECTORY_MAX_BYTES = 64 * 1024 * 1024
+
+
+def encode(absolute_trajectory: np.ndarray, viewer_trajectory: np.ndarray) -> bytes:
+    """
+    Упаковывает траекторию в массив float32 из строк [lon, lat, alt, azimuth, elevation]
+    """
+    return np.column_stack([absolute_trajectory, viewer_trajectory]).astype('<f4').tobytes()
+
+
+def decode(data: bytes):
+    """
+    :returns: (absolute_trajectory (n, 3), viewer_trajectory (n, 2))
+    """
+    rows = np.frombuffer(data, dtype='<f4').reshape(-1, 5)
+    return rows[:, :3], rows[:, 3:]
+
+
+class MemoryTrajectoryStore:
+    """
+    Хранилище траекторий в памяти процесса. Когда суммарный размер превышает max_bytes,
+    удаляются самые старые траектории
+    """
+
+    def __init__(self, ttl: float = TRAJECTORY_TTL, max_bytes: int = TRAJECTORY_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, params: dict, absolute_trajectory: np.ndarray, viewer_trajectory: np.ndarray) -> str:
+        """
+        Сохраняет траекторию и возвращает ее token
+        """
+        token = secrets.token_urlsafe(12)
+        data = encode(absolute_trajectory, viewer_trajectory)
+
+        with self._lock:
+            self._data[token] = (time.monotonic(), params, data)
+            self._size += len(data)
+
+            while self._size > self.max_bytes and len(self._data) > 1:
+                _, (_, _, removed) = self._data.popitem(last=False)
+                self._size -= len(removed)
+
+        return token
+
+    def get(self, token: str):
+        """
+        :returns: (params, absolute_trajectory, viewer_trajectory) или None, если траектории нет или она устарела
+        """
+        with self._lock:
+            item = self._data.get(token)
+            if item is None:
+                return None
+
+            created_at, params, data = item
+            if time.monotonic() - created_at > self.ttl:
+                del self._data[token]
+                self._size -= len(data)
+                return None
+
+        return (params, *decode(data))
+
+
+class DatabaseTrajectoryStore:
+    """
+    Хранилище траекторий в базе данных приложения, общее для всех процессов сервера
+    """
+
+    def __init__(self, ttl: float = TRAJECTORY_TTL, max_bytes: int = TRAJECTORY_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def put(self, params: dict, absolute_trajectory: np.ndarray, viewer_trajectory: np.ndarray) -> str:
+        token = secrets.token_urlsafe(12)
+        data = encode(absolute_trajectory, viewer_trajectory)
+        now = time.time()
+
+        db_sess = db_session.create_session()
+        try:
+            db_sess.add(PassTrajectory(token=token, created_at=now, params=json.dumps(params), data=data,
+                                       size=len(data)))
+
+            # Удаляем устаревшие траектории, а затем самые старые, пока не уложимся в ограничение по размеру
+            db_sess.query(PassTrajectory).filter(PassTrajectory.created_at < now - self.ttl).delete()
+            db_sess.flush()
+            total = db_sess.query(sa.func.coalesce(sa.func.sum(PassTrajectory.size), 0)).scalar()
+            if total > self.max_bytes:
+                old = db_sess.query(PassTrajectory.token, PassTrajectory.size) \
+                    .filter(PassTrajectory.token != token).order_by(PassTrajectory.created_at).all()
+                for old_token, size in old:
+                    if total <= self.max_bytes:
+                        break
+                    db_sess.query(PassTrajectory).filter(PassTrajectory.token == old_token).delete()
+                    total -= size
+
+            db_sess.commit()
+        finally:
+            db_sess.close()
+
+        return token
+
+    def get(self, token: str):
+        db_sess = db_session.create_session()
+        try:
+            trajectory = db_sess.get(PassTrajectory, token)
+            if trajectory is None or time.time() - trajectory.created_at > self.ttl:
+                return None
+            return (json.loads(trajectory.params), *decode(trajectory.data))
+        finally:
+            db_sess.close()
+
+
+def create_trajectory_store(backend: str = 'memory', ttl: float = TRAJECTORY_TTL,
+                            max_bytes: int = TRAJECTORY_MAX_BYTES):
+    """
+    backend - memory (в памяти процесса) или database (в базе данных приложения)
+    """
+    if backend == 'database':
+        return DatabaseTrajectoryStore(ttl, max_bytes)
+    return MemoryTrajectoryStore(ttl, max_bytes)
@@ -0,0 +1,91 @@
+from collections import Counter
+import math
+import numpy as np
+import metrics
+
+# Гравитационный параметр Земли (км^3/с^2) в WGS72, как в SGP4, и полярный радиус Земли (км).
+# Полярный радиус меньше экваториального, поэтому с ним наибольшая элевация оценивается с запасом
+MU = 398600.8
+POLAR_RADIUS = 6356.75
+
+# Запас (в градусах) на отличие геодезической широты наблюдателя от геоцентрической и колебания наклонения
+# орбиты относительно средних элементов TLE, и запас (в км) на колебания высоты апогея
+ANGLE_MARGIN = 1.0
+ALTITUDE_MARGIN = 50
+
+# Причины, по которым спутник отбрасывается до поиска пролетов
+NEVER_RISES = 'never_rises'
+BELOW_MIN_APOGEE = 'below_min_apogee'
+
+skipped_satellites = metrics.registry.counter('orbitracker_prefilter_skipped_total',
+                                              'Спутники, отброшенные до поиска пролетов')
+
+
+class OrbitBounds:
+    """
+    Наклонение и наибольший радиус орбиты каждого спутника каталога, расчитанные по элементам TLE
+    """
+
+    def __init__(self, records: list):
+        self.index = {record.name: i for i, record in enumerate(records)}
+
+        inclination = np.array([float(record.line2[8:16]) for record in records])
+        eccentricity = np.array([float(f'0.{record.line2[26:33].strip()}') for record in records])
+        # Среднее движение в оборотах в сутки -> большая полуось по третьему закону Кеплера
+        mean_motion = np.array([float(record.line2[52:63]) for record in records]) * 2 * math.pi / 86400
+
+        # Ретроградная орбита достигает тех же широт, что и прямая с наклонением 180 - i
+        self.inclination = np.minimum(inclination, 180 - inclination)
+        with np.errstate(divide='ignore'):
+            self.max_radius = (MU / mean_motion ** 2) ** (1 / 3) * (1 + eccentricity) + ALTITUDE_MARGIN
+
+
+def max_elevation(lats, inclination: np.ndarray, max_radius: np.ndarray) -> np.ndarray:
+    """
+    Оценка сверху наибольшей элевации (в градусах), на которой спутник может быть виден с широт lats.
+    Ближе всего к наблюдателю спутник подходит, когда пролетает над самой северной (южной) точкой своей трассы,
+    то есть на угловом расстоянии |lat| - i от наблюдателя (если наблюдатель севернее трассы), и на наибольшей
+    высоте орбиты. Элевация точки на расстоянии r от центра Земли над точкой на угловом расстоянии d
+    равна atan((cos d - R / r) / sin d)
+    :returns: массив (спутники,) - наибольшая элевация по всем широтам
+    """
+    lats = np.abs(np.atleast_1d(np.asarray(lats, dtype=float)))[:, np.newaxis]
+    distance = np.radians(np.maximum(np.min(lats - inclination, axis=0, initial=np.inf) - ANGLE_MARGIN, 0))
+    return np.degrees(np.arctan2(np.cos(distance) - POLAR_RADIUS / max_radius, np.sin(distance)))
+
+
+def skip_reasons(bounds: OrbitBounds, satellites: list, lats, min_apogee: float = 0) -> dict:
+    """
+    Спутники, которые заведомо не поднимаются над горизонтом или выше min_apogee ни для одной из широт lats
+    (наклонение орбиты не позволяет подойти близко к наблюдателю, а высота мала).
+    Проверка не зависит от времени, поэтому остальные спутники не обязательно пролетают в заданный промежуток
+    :returns: {спутник: причина, ...}
+    """
+    index = [bounds.index.get(satellite) for satellite in satellites]
+    known = np.array([i for i in index if i is not None], dtype=int)
+
+    elevations = dict(zip(known.tolist(), max_elevation(lats, bounds.inclination[known],
+                                                        bounds.max_radius[known]).tolist()))
+
+    reasons = {}
+    for satellite, i in zip(satellites, index):
+        # Спутники не из каталога (их ошибку покажет сам поиск) и с неизвестной высотой не отбрасываются
+        elevation = elevations.get(i, math.nan)
+        if elevation <= 0:
+            reasons[satellite] = NEVER_RISES
+        elif elevation < min_apogee:
+            reasons[satellite] = BELOW_MIN_APOGEE
+    return reasons
+
+
+def prefilter(bounds: OrbitBounds, satellites: list, lats, min_apogee: float = 0):
+    """
+    Отбрасывает спутники, которые не могут пролететь над наблюдателем (см. skip_reasons), и учитывает их в метрике
+    :returns: (оставшиеся спутники в том же порядке, {отброшенный спутник: причина, ...})
+    """
+    skipped = skip_reasons(bounds, satellites, lats, min_apogee)
+
+    for reason, count in Counter(skipped.values()).items():
+        skipped_satellites.inc(count, reason=reason)
+
+    return [satellite for satellite in satellites if satellite not in skipped], skipped